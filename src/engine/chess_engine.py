@@ -1,8 +1,28 @@
 import chess
 import numpy as np
+import os
+import sys
+import time
+
+from search_board import SearchBoard, decode_move
+
+# Weights files are read and checked by the tuner's module in src/server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+from eval_weights import read_weights
+
+# Deepest iteration when the search is limited by time only
+MAX_DEPTH = 64
+
+# Color order of the piece planes used by the batch evaluator
+PLANE_COLORS = [chess.WHITE, chess.BLACK]
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time limit runs out."""
+
 
 class ChessEngine:
-    def __init__(self):
+    def __init__(self, weights_path=None):
         # Piece values for material evaluation
         self.piece_values = {
             chess.PAWN: 100,
@@ -25,6 +45,65 @@ class ChessEngine:
             [0,  0,  0,  0,  0,  0,  0,  0]
         ])
 
+        # Tuned weights written by src/server/tuning.py
+        if weights_path:
+            self.load_weights(weights_path)
+
+        # Material plus pawn-table value per [color][piece_type][square],
+        # from white's perspective, for the incremental evaluation
+        self.square_values = {
+            color: {
+                piece_type: [self.piece_square_value(piece_type, color, square) for square in chess.SQUARES]
+                for piece_type in chess.PIECE_TYPES
+            }
+            for color in chess.COLORS
+        }
+
+        # The same values as a (12, 64) matrix matching the planes of encode_boards
+        self.plane_weights = np.array([
+            self.square_values[color][piece_type]
+            for color in PLANE_COLORS
+            for piece_type in chess.PIECE_TYPES
+        ], dtype=np.int64)
+
+        # The same values indexed like SearchBoard pieces, so the search
+        # board keeps the score up to date move by move
+        self.search_values = [
+            self.square_values[bool(piece & 1)][(piece >> 1) + 1]
+            for piece in range(12)
+        ]
+
+        # Counters of the last search
+        self.nodes = 0
+        self.completed_depth = 0
+
+    def load_weights(self, path):
+        """
+        Takes the pawn table from an evaluation weights file.
+        Tables there are laid out from white's side with rank 8 first,
+        while pawn_weights is indexed by [rank][file]. Values are rounded
+        to whole centipawns, which all the evaluators work in.
+        """
+        weights = read_weights(path)
+        if 'pawn_position_values' in weights:
+            table = np.rint(weights['pawn_position_values']).astype(np.int64)
+            self.pawn_weights = table.reshape(8, 8)[::-1]
+
+    def piece_square_value(self, piece_type, color, square):
+        """
+        Returns the material and pawn-table value of one piece,
+        from white's perspective.
+        """
+        value = self.piece_values[piece_type]
+        if piece_type == chess.PAWN:
+            rank = chess.square_rank(square)
+            file = chess.square_file(square)
+            if color == chess.WHITE:
+                value += int(self.pawn_weights[rank][file])
+            else:
+                value += int(self.pawn_weights[7-rank][file])
+        return value if color == chess.WHITE else -value
+
     def evaluate_position(self, board):
         """
         Evaluates the current position on the board.
@@ -54,64 +133,174 @@ class ChessEngine:
         
         return score
 
-    def get_best_move(self, board, depth=3):
+    def encode_boards(self, boards):
+        """
+        Encodes positions as an (N, 12, 64) array of piece planes.
+        Planes are white pawn..king followed by black pawn..king, and
+        are unpacked directly from the python-chess bitboards.
+        """
+        bitboards = np.array([
+            [board.pieces_mask(piece_type, color)
+             for color in PLANE_COLORS
+             for piece_type in chess.PIECE_TYPES]
+            for board in boards
+        ], dtype='<u8').reshape(len(boards), 12)
+        planes = np.unpackbits(bitboards.view(np.uint8), bitorder='little')
+        return planes.reshape(len(boards), 12, 64)
+
+    def evaluate_batch(self, boards):
+        """
+        Evaluates many positions at once.
+        Returns an array of scores from white's perspective, equal to
+        calling evaluate_position on each board.
+        """
+        boards = list(boards)
+        if not boards:
+            return np.zeros(0)
+
+        planes = self.encode_boards(boards)
+        scores = np.tensordot(planes, self.plane_weights, axes=([1, 2], [0, 1])).astype(np.float64)
+
+        # Checkmates score as infinity, like the scalar evaluator
+        for i, board in enumerate(boards):
+            if board.is_checkmate():
+                scores[i] = -np.inf if board.turn else np.inf
+        return scores
+
+    def get_best_move(self, board, depth=3, time_limit=None):
         """
         Returns the best move for the current position using minimax algorithm.
+
+        Searches with iterative deepening up to ``depth`` plies. When
+        ``time_limit`` (seconds) is given, ``depth`` may be None; the search
+        aborts at the deadline and the move from the deepest completed
+        iteration is returned.
+        """
+        lines = self.search(board, depth, time_limit)
+        if not lines:
+            return next(iter(board.legal_moves), None)
+        return lines[0][0]
+
+    def get_top_moves(self, board, num_moves=3, depth=3, time_limit=None):
+        """
+        Returns the top N best moves for the current position.
+
+        Each is a (move, score, pv) tuple from a ``depth``-ply multi-PV
+        search, best first; scores are from white's perspective.
+        """
+        return self.search(board, depth, time_limit, multipv=num_moves)
+
+    def search(self, board, depth=3, time_limit=None, multipv=1):
+        """
+        Iterative deepening search for the ``multipv`` best moves.
+
+        Returns [(move, score, pv)] best first, with white's scores, from
+        the deepest completed iteration (empty if not even depth 1 finished).
+        All lines come from one search of the root: once ``multipv`` lines
+        are known, the other moves are searched with the worst of them as
+        their bound, so they are cut off like in a single-PV search.
         """
-        def minimax(board, depth, alpha=-np.inf, beta=np.inf, maximizing_player=True):
-            if depth == 0 or board.is_game_over():
-                return self.evaluate_position(board)
+        start = time.monotonic()
+        deadline = None if time_limit is None else start + time_limit
+
+        # The search runs on a compact copy of the position; its score holds
+        # the material and pawn-table terms, updated on every push and pop
+        position = SearchBoard.from_board(board, self.search_values)
+
+        # Triangular PV table: pv[ply] is the best line found from that ply
+        pv = [[] for _ in range(MAX_DEPTH + 2)]
+
+        def mated_score():
+            # Checkmates score as infinity, like evaluate_position
+            return -np.inf if position.turn else np.inf
+
+        def is_drawn():
+            return (position.is_insufficient_material() or position.halfmove_clock >= 150
+                    or position.repetitions() >= 5)
+
+        def minimax(depth, alpha=-np.inf, beta=np.inf, maximizing_player=True, ply=1):
+            self.nodes += 1
+            if deadline is not None and time.monotonic() >= deadline:
+                raise SearchTimeout()
+            pv[ply] = []
+
+            if depth == 0:
+                if position.is_check() and not position.legal_moves():
+                    return mated_score()
+                return position.score
+
+            moves = position.legal_moves()
+            if not moves:
+                return mated_score() if position.is_check() else position.score
+            if is_drawn():
+                return position.score
             
             if maximizing_player:
                 max_eval = -np.inf
-                for move in board.legal_moves:
-                    board.push(move)
-                    eval = minimax(board, depth-1, alpha, beta, False)
-                    board.pop()
-                    max_eval = max(max_eval, eval)
+                for move in moves:
+                    position.push(move)
+                    eval = minimax(depth-1, alpha, beta, False, ply + 1)
+                    position.pop()
+                    if eval > max_eval or not pv[ply]:
+                        max_eval = eval
+                        pv[ply] = [move] + pv[ply + 1]
                     alpha = max(alpha, eval)
                     if beta <= alpha:
                         break
                 return max_eval
             else:
                 min_eval = np.inf
-                for move in board.legal_moves:
-                    board.push(move)
-                    eval = minimax(board, depth-1, alpha, beta, True)
-                    board.pop()
-                    min_eval = min(min_eval, eval)
+                for move in moves:
+                    position.push(move)
+                    eval = minimax(depth-1, alpha, beta, True, ply + 1)
+                    position.pop()
+                    if eval < min_eval or not pv[ply]:
+                        min_eval = eval
+                        pv[ply] = [move] + pv[ply + 1]
                     beta = min(beta, eval)
                     if beta <= alpha:
                         break
                 return min_eval
 
-        best_move = None
-        best_value = -np.inf if board.turn else np.inf
-        
-        for move in board.legal_moves:
-            board.push(move)
-            value = minimax(board, depth-1, -np.inf, np.inf, not board.turn)
-            board.pop()
-            
-            if board.turn and value > best_value:
-                best_value = value
-                best_move = move
-            elif not board.turn and value < best_value:
-                best_value = value
-                best_move = move
-                
-        return best_move
+        def search_root(depth, previous):
+            maximizing = position.turn == chess.WHITE
 
-    def get_top_moves(self, board, num_moves=3, depth=3):
-        """
-        Returns the top N best moves for the current position.
-        """
-        moves = []
-        for move in board.legal_moves:
-            board.push(move)
-            value = self.evaluate_position(board)
-            moves.append((move, value))
-            board.pop()
-            
-        moves.sort(key=lambda x: x[1], reverse=board.turn)
-        return moves[:num_moves] 
\ No newline at end of file
+            # Search the previous iteration's lines first, best first
+            first = [move for move, _, _ in previous]
+            moves = first + [move for move in position.legal_moves() if move not in first]
+
+            lines = []
+            for move in moves:
+                # Once multipv lines are known a move only counts if it beats the worst of them
+                bound = lines[-1][1] if len(lines) == multipv else None
+                position.push(move)
+                if bound is None:
+                    value = minimax(depth-1, -np.inf, np.inf, not maximizing)
+                elif maximizing:
+                    value = minimax(depth-1, bound, np.inf, False)
+                else:
+                    value = minimax(depth-1, -np.inf, bound, True)
+                position.pop()
+
+                if bound is None or (value > bound if maximizing else value < bound):
+                    lines.append((move, value, [move] + pv[1]))
+                    lines.sort(key=lambda line: line[1], reverse=maximizing)
+                    del lines[multipv:]
+            return lines
+
+        lines = []
+        max_depth = depth if depth is not None else MAX_DEPTH
+        self.nodes = 0
+        self.completed_depth = 0
+        for current_depth in range(1, max_depth + 1):
+            try:
+                lines = search_root(current_depth, lines)
+            except SearchTimeout:
+                break
+            self.completed_depth = current_depth
+            # The next iteration would most likely not finish in time
+            if time_limit is not None and time.monotonic() - start >= time_limit / 2:
+                break
+
+        return [(decode_move(move), score, [decode_move(pv_move) for pv_move in line])
+                for move, score, line in lines] 
\ No newline at end of file
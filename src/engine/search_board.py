@@ -0,0 +1,480 @@
+import chess
+import chess.polyglot
+
+# Pieces are stored as their Polyglot index: 2 * (piece_type - 1) + color,
+# with color 1 for white, so a piece's Zobrist key is ZOBRIST[64 * piece + square]
+EMPTY = -1
+
+# Castling rights as bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+# Plies that can be pushed on top of the root position
+MAX_PLY = 256
+
+# Moves are ints: from_square | to_square << 6 | promotion << 12
+PROMOTION_SHIFT = 12
+
+ZOBRIST = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+ZOBRIST_TURN = ZOBRIST[780]
+
+# Zobrist key of every combination of castling rights
+CASTLING_KEYS = [0] * 16
+for rights in range(16):
+    for bit in range(4):
+        if rights & (1 << bit):
+            CASTLING_KEYS[rights] ^= ZOBRIST[768 + bit]
+
+# Castling rights kept when a piece moves from or to a square
+CASTLING_KEEP = [15] * 64
+CASTLING_KEEP[chess.E1] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_KEEP[chess.H1] = 15 & ~WHITE_KINGSIDE
+CASTLING_KEEP[chess.A1] = 15 & ~WHITE_QUEENSIDE
+CASTLING_KEEP[chess.E8] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_KEEP[chess.H8] = 15 & ~BLACK_KINGSIDE
+CASTLING_KEEP[chess.A8] = 15 & ~BLACK_QUEENSIDE
+
+# Castling moves by side to move: (right, king move, squares that must be
+# empty, squares the king must not be attacked on)
+CASTLING_MOVES = {
+    chess.WHITE: [
+        (WHITE_KINGSIDE, chess.E1 | chess.G1 << 6, chess.BB_F1 | chess.BB_G1, (chess.E1, chess.F1, chess.G1)),
+        (WHITE_QUEENSIDE, chess.E1 | chess.C1 << 6, chess.BB_B1 | chess.BB_C1 | chess.BB_D1,
+         (chess.E1, chess.D1, chess.C1)),
+    ],
+    chess.BLACK: [
+        (BLACK_KINGSIDE, chess.E8 | chess.G8 << 6, chess.BB_F8 | chess.BB_G8, (chess.E8, chess.F8, chess.G8)),
+        (BLACK_QUEENSIDE, chess.E8 | chess.C8 << 6, chess.BB_B8 | chess.BB_C8 | chess.BB_D8,
+         (chess.E8, chess.D8, chess.C8)),
+    ],
+}
+
+# Rook (from, to) for each castling king destination
+CASTLING_ROOKS = {
+    chess.G1: (chess.H1, chess.F1),
+    chess.C1: (chess.A1, chess.D1),
+    chess.G8: (chess.H8, chess.F8),
+    chess.C8: (chess.A8, chess.D8),
+}
+
+PROMOTIONS = (chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT)
+
+BETWEEN = [[chess.between(a, b) for b in chess.SQUARES] for a in chess.SQUARES]
+
+KNIGHT_ATTACKS = chess.BB_KNIGHT_ATTACKS
+KING_ATTACKS = chess.BB_KING_ATTACKS
+PAWN_ATTACKS = chess.BB_PAWN_ATTACKS
+DIAG_MASKS = chess.BB_DIAG_MASKS
+DIAG_ATTACKS = chess.BB_DIAG_ATTACKS
+FILE_MASKS = chess.BB_FILE_MASKS
+FILE_ATTACKS = chess.BB_FILE_ATTACKS
+RANK_MASKS = chess.BB_RANK_MASKS
+RANK_ATTACKS = chess.BB_RANK_ATTACKS
+RAYS = chess.BB_RAYS
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = chess.PIECE_TYPES
+
+
+def encode_move(move):
+    """Search board move for a chess.Move."""
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << PROMOTION_SHIFT
+
+
+def decode_move(move):
+    """chess.Move for a search board move."""
+    return chess.Move(move & 63, move >> 6 & 63, move >> PROMOTION_SHIFT or None)
+
+
+class SearchBoard:
+    """
+    Compact position for the search's inner loop.
+
+    Holds a square array, bitboards by piece type and color, and a
+    Polyglot-compatible Zobrist key updated on every move. Moves are plain
+    ints and push/pop save and restore state in preallocated undo arrays,
+    so making and unmaking a move allocates nothing. Move generation is
+    pseudo-legal, with a pin-based legality filter.
+
+    ``values`` optionally gives a score per piece and square (indexed by
+    Polyglot piece index, then square), kept up to date in ``score``.
+    Only standard chess is supported.
+    """
+
+    __slots__ = ('squares', 'pieces', 'occupied_co', 'turn', 'castling', 'ep_square', 'halfmove_clock',
+                 'key', 'score', 'values', 'ply', 'history',
+                 '_moves', '_captured', '_castling', '_ep_square', '_halfmove_clock', '_keys', '_scores')
+
+    def __init__(self, board, values=None):
+        board = board.copy(stack=False)
+        board.castling_rights = board.clean_castling_rights()
+
+        self.values = values or [[0] * 64 for _ in range(12)]
+        self.squares = [EMPTY] * 64
+        self.pieces = [0] * 7
+        self.occupied_co = [0, 0]
+        self.score = 0
+        for square, piece in board.piece_map().items():
+            self._put(square, 2 * (piece.piece_type - 1) + piece.color)
+
+        self.turn = board.turn
+        self.castling = ((WHITE_KINGSIDE if board.castling_rights & chess.BB_H1 else 0)
+                         | (WHITE_QUEENSIDE if board.castling_rights & chess.BB_A1 else 0)
+                         | (BLACK_KINGSIDE if board.castling_rights & chess.BB_H8 else 0)
+                         | (BLACK_QUEENSIDE if board.castling_rights & chess.BB_A8 else 0))
+        self.ep_square = board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.key = chess.polyglot.zobrist_hash(board)
+
+        self.ply = 0
+        self._moves = [0] * MAX_PLY
+        self._captured = [EMPTY] * MAX_PLY
+        self._castling = [0] * MAX_PLY
+        self._ep_square = [None] * MAX_PLY
+        self._halfmove_clock = [0] * MAX_PLY
+        self._keys = [0] * MAX_PLY
+        self._scores = [0] * MAX_PLY
+        self.history = []
+
+    @classmethod
+    def from_board(cls, board, values=None):
+        """
+        Search board for a chess.Board, remembering the keys of the game's
+        positions since the last capture or pawn move for repetition checks.
+        """
+        position = cls(board, values)
+        previous = board.copy()
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            previous.pop()
+            position.history.append(chess.polyglot.zobrist_hash(previous))
+        position.history.reverse()
+        return position
+
+    def _put(self, square, piece):
+        bb = 1 << square
+        self.squares[square] = piece
+        self.pieces[(piece >> 1) + 1] |= bb
+        self.occupied_co[piece & 1] |= bb
+        self.score += self.values[piece][square]
+
+    def _remove(self, square, piece):
+        bb = 1 << square
+        self.squares[square] = EMPTY
+        self.pieces[(piece >> 1) + 1] ^= bb
+        self.occupied_co[piece & 1] ^= bb
+        self.score -= self.values[piece][square]
+
+    def _ep_key(self):
+        """Key of the en passant file, counted only when a pawn could capture (as in Polyglot)."""
+        ep_square = self.ep_square
+        if ep_square is None:
+            return 0
+        if PAWN_ATTACKS[not self.turn][ep_square] & self.pieces[PAWN] & self.occupied_co[self.turn]:
+            return ZOBRIST[772 + (ep_square & 7)]
+        return 0
+
+    def push(self, move):
+        """Make a pseudo-legal move."""
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        promotion = move >> PROMOTION_SHIFT
+        squares = self.squares
+        piece = squares[from_square]
+        color = piece & 1
+
+        ply = self.ply
+        self._moves[ply] = move
+        self._castling[ply] = self.castling
+        self._ep_square[ply] = self.ep_square
+        self._halfmove_clock[ply] = self.halfmove_clock
+        self._keys[ply] = self.key
+        self._scores[ply] = self.score
+        self.ply = ply + 1
+
+        key = self.key ^ ZOBRIST_TURN ^ self._ep_key()
+
+        captured = squares[to_square]
+        self._captured[ply] = captured
+        if captured != EMPTY:
+            self._remove(to_square, captured)
+            key ^= ZOBRIST[64 * captured + to_square]
+
+        self._remove(from_square, piece)
+        key ^= ZOBRIST[64 * piece + from_square]
+        placed = 2 * (promotion - 1) + color if promotion else piece
+        self._put(to_square, placed)
+        key ^= ZOBRIST[64 * placed + to_square]
+
+        ep_square = None
+        if piece >> 1 == 0:
+            self.halfmove_clock = 0
+            if to_square == self.ep_square:
+                captured_square = to_square - 8 if color else to_square + 8
+                captured_pawn = piece ^ 1
+                self._remove(captured_square, captured_pawn)
+                key ^= ZOBRIST[64 * captured_pawn + captured_square]
+            elif to_square - from_square in (16, -16):
+                ep_square = (from_square + to_square) >> 1
+        elif captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+            if piece >> 1 == 5 and to_square - from_square in (2, -2):
+                rook_from, rook_to = CASTLING_ROOKS[to_square]
+                rook = squares[rook_from]
+                self._remove(rook_from, rook)
+                self._put(rook_to, rook)
+                key ^= ZOBRIST[64 * rook + rook_from] ^ ZOBRIST[64 * rook + rook_to]
+
+        castling = self.castling & CASTLING_KEEP[from_square] & CASTLING_KEEP[to_square]
+        key ^= CASTLING_KEYS[self.castling] ^ CASTLING_KEYS[castling]
+        self.castling = castling
+
+        self.ep_square = ep_square
+        self.turn = not self.turn
+        self.key = key ^ self._ep_key()
+
+    def pop(self):
+        """Unmake the last move and return it."""
+        ply = self.ply - 1
+        self.ply = ply
+        move = self._moves[ply]
+        from_square = move & 63
+        to_square = move >> 6 & 63
+        promotion = move >> PROMOTION_SHIFT
+
+        self.turn = not self.turn
+        self.castling = self._castling[ply]
+        self.ep_square = self._ep_square[ply]
+        self.halfmove_clock = self._halfmove_clock[ply]
+
+        placed = self.squares[to_square]
+        piece = 2 * (PAWN - 1) + (placed & 1) if promotion else placed
+        self._remove(to_square, placed)
+        self._put(from_square, piece)
+
+        captured = self._captured[ply]
+        if captured != EMPTY:
+            self._put(to_square, captured)
+        elif piece >> 1 == 0 and to_square == self.ep_square:
+            self._put(to_square - 8 if piece & 1 else to_square + 8, piece ^ 1)
+        elif piece >> 1 == 5 and to_square - from_square in (2, -2):
+            rook_from, rook_to = CASTLING_ROOKS[to_square]
+            rook = self.squares[rook_to]
+            self._remove(rook_to, rook)
+            self._put(rook_from, rook)
+
+        self.key = self._keys[ply]
+        self.score = self._scores[ply]
+        return move
+
+    def attackers_mask(self, color, square, occupied):
+        """Pieces of ``color`` attacking ``square`` with the given occupancy."""
+        pieces = self.pieces
+        queens = pieces[QUEEN]
+        return self.occupied_co[color] & (
+            (KNIGHT_ATTACKS[square] & pieces[KNIGHT])
+            | (KING_ATTACKS[square] & pieces[KING])
+            | (PAWN_ATTACKS[not color][square] & pieces[PAWN])
+            | ((RANK_ATTACKS[square][RANK_MASKS[square] & occupied]
+                | FILE_ATTACKS[square][FILE_MASKS[square] & occupied]) & (pieces[ROOK] | queens))
+            | (DIAG_ATTACKS[square][DIAG_MASKS[square] & occupied] & (pieces[BISHOP] | queens)))
+
+    def is_attacked_by(self, color, square):
+        return bool(self.attackers_mask(color, square, self.occupied_co[0] | self.occupied_co[1]))
+
+    def king(self, color):
+        return (self.pieces[KING] & self.occupied_co[color]).bit_length() - 1
+
+    def is_check(self):
+        return self.is_attacked_by(not self.turn, self.king(self.turn))
+
+    def pseudo_legal_moves(self):
+        """List of pseudo-legal moves; castling moves are fully checked."""
+        turn = self.turn
+        ours = self.occupied_co[turn]
+        theirs = self.occupied_co[not turn]
+        occupied = ours | theirs
+        pieces = self.pieces
+        moves = []
+        append = moves.append
+
+        # Pieces
+        from_mask = ours & ~pieces[PAWN]
+        while from_mask:
+            from_square = from_mask.bit_length() - 1
+            from_mask ^= 1 << from_square
+            piece_type = (self.squares[from_square] >> 1) + 1
+            if piece_type == KNIGHT:
+                targets = KNIGHT_ATTACKS[from_square]
+            elif piece_type == KING:
+                targets = KING_ATTACKS[from_square]
+            else:
+                targets = 0
+                if piece_type != ROOK:
+                    targets = DIAG_ATTACKS[from_square][DIAG_MASKS[from_square] & occupied]
+                if piece_type != BISHOP:
+                    targets |= (RANK_ATTACKS[from_square][RANK_MASKS[from_square] & occupied]
+                                | FILE_ATTACKS[from_square][FILE_MASKS[from_square] & occupied])
+            targets &= ~ours
+            while targets:
+                to_square = targets.bit_length() - 1
+                targets ^= 1 << to_square
+                append(from_square | to_square << 6)
+
+        # Castling
+        if self.castling:
+            them = not turn
+            for right, move, empty, safe in CASTLING_MOVES[turn]:
+                if (self.castling & right and not occupied & empty
+                        and not any(self.attackers_mask(them, square, occupied) for square in safe)):
+                    append(move)
+
+        # Pawn captures, including en passant
+        pawns = ours & pieces[PAWN]
+        promotion_rank = chess.BB_RANK_8 if turn else chess.BB_RANK_1
+        capture_mask = theirs
+        if self.ep_square is not None:
+            capture_mask |= 1 << self.ep_square
+        from_mask = pawns
+        while from_mask:
+            from_square = from_mask.bit_length() - 1
+            from_mask ^= 1 << from_square
+            targets = PAWN_ATTACKS[turn][from_square] & capture_mask
+            while targets:
+                to_square = targets.bit_length() - 1
+                targets ^= 1 << to_square
+                if (1 << to_square) & promotion_rank:
+                    for promotion in PROMOTIONS:
+                        append(from_square | to_square << 6 | promotion << PROMOTION_SHIFT)
+                else:
+                    append(from_square | to_square << 6)
+
+        # Pawn pushes
+        if turn:
+            single = (pawns << 8) & ~occupied & chess.BB_ALL
+            double = ((single & chess.BB_RANK_3) << 8) & ~occupied
+            step = 8
+        else:
+            single = (pawns >> 8) & ~occupied
+            double = ((single & chess.BB_RANK_6) >> 8) & ~occupied
+            step = -8
+        while single:
+            to_square = single.bit_length() - 1
+            single ^= 1 << to_square
+            from_square = to_square - step
+            if (1 << to_square) & promotion_rank:
+                for promotion in PROMOTIONS:
+                    append(from_square | to_square << 6 | promotion << PROMOTION_SHIFT)
+            else:
+                append(from_square | to_square << 6)
+        while double:
+            to_square = double.bit_length() - 1
+            double ^= 1 << to_square
+            append((to_square - 2 * step) | to_square << 6)
+        return moves
+
+    def _pinned(self, king, color):
+        """Mask of ``color``'s pieces pinned to its king."""
+        them = self.occupied_co[not color]
+        pieces = self.pieces
+        queens = pieces[QUEEN]
+        snipers = them & (
+            ((RANK_ATTACKS[king][0] | FILE_ATTACKS[king][0]) & (pieces[ROOK] | queens))
+            | (DIAG_ATTACKS[king][0] & (pieces[BISHOP] | queens)))
+        occupied = self.occupied_co[0] | self.occupied_co[1]
+        pinned = 0
+        while snipers:
+            sniper = snipers.bit_length() - 1
+            snipers ^= 1 << sniper
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1):
+                pinned |= blockers
+        return pinned & self.occupied_co[color]
+
+    def legal_moves(self):
+        """List of legal moves."""
+        turn = self.turn
+        them = not turn
+        king = self.king(turn)
+        occupied = self.occupied_co[0] | self.occupied_co[1]
+        checkers = self.attackers_mask(them, king, occupied)
+        if not checkers:
+            evasions = chess.BB_ALL
+        elif checkers & (checkers - 1):
+            # Double check: only the king can move
+            evasions = 0
+        else:
+            # Capture the checker or block the check
+            evasions = checkers | BETWEEN[king][checkers.bit_length() - 1]
+
+        pinned = self._pinned(king, turn)
+        ep_square = self.ep_square
+        pawns = self.pieces[PAWN]
+        legal = []
+        for move in self.pseudo_legal_moves():
+            from_square = move & 63
+            to_square = move >> 6 & 63
+            if from_square == king:
+                # Castling moves were checked during generation
+                if to_square - from_square in (2, -2) or not self.attackers_mask(
+                        them, to_square, occupied ^ (1 << king)):
+                    legal.append(move)
+            elif to_square == ep_square and pawns & (1 << from_square):
+                # Two pawns leave the capturing rank at once, so try it
+                self.push(move)
+                if not self.attackers_mask(them, king, self.occupied_co[0] | self.occupied_co[1]):
+                    legal.append(move)
+                self.pop()
+            elif evasions & (1 << to_square) and (
+                    not pinned & (1 << from_square) or RAYS[king][from_square] & (1 << to_square)):
+                legal.append(move)
+        return legal
+
+    def has_insufficient_material(self, color):
+        """Whether ``color`` cannot win on material alone, as chess.Board.has_insufficient_material."""
+        pieces = self.pieces
+        ours = self.occupied_co[color]
+        if ours & (pieces[PAWN] | pieces[ROOK] | pieces[QUEEN]):
+            return False
+        if ours & pieces[KNIGHT]:
+            return (bin(ours).count('1') <= 2
+                    and not self.occupied_co[not color] & ~pieces[KING] & ~pieces[QUEEN])
+        if ours & pieces[BISHOP]:
+            bishops = pieces[BISHOP]
+            same_color = not bishops & chess.BB_DARK_SQUARES or not bishops & chess.BB_LIGHT_SQUARES
+            return same_color and not pieces[PAWN] and not pieces[KNIGHT]
+        return True
+
+    def is_insufficient_material(self):
+        return self.has_insufficient_material(chess.WHITE) and self.has_insufficient_material(chess.BLACK)
+
+    def repetitions(self):
+        """How often the current position has occurred since the last capture or pawn move."""
+        key = self.key
+        count = 1
+        reversible = self.halfmove_clock
+        # Positions pushed on this board, most recent first
+        for ply in range(self.ply - 1, max(-1, self.ply - 1 - reversible), -1):
+            if self._keys[ply] == key:
+                count += 1
+        # Earlier positions of the game
+        remaining = reversible - self.ply
+        if remaining > 0:
+            for previous in self.history[-remaining:]:
+                if previous == key:
+                    count += 1
+        return count
+
+    def perft(self, depth):
+        """Number of leaf nodes of the legal move tree to ``depth``."""
+        moves = self.legal_moves()
+        if depth <= 1:
+            return len(moves) if depth == 1 else 1
+        nodes = 0
+        for move in moves:
+            self.push(move)
+            nodes += self.perft(depth - 1)
+            self.pop()
+        return nodes
@@ -3,6 +3,12 @@ from flask_cors import CORS
 from chess_engine import ChessEngine
 import chess
 import logging
+import os
+import sys
+
+# The result cache is shared with the main server in src/server
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'server'))
+from analysis_cache import AnalysisCache, CacheEntry, normalize_fen, fingerprint
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -11,7 +17,38 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 app.debug = True  # Enable debug mode
-engine = ChessEngine()
+# Evaluation weights written by src/server/tuning.py (optional)
+EVAL_WEIGHTS_PATH = os.environ.get('EVAL_WEIGHTS_PATH')
+engine = ChessEngine(weights_path=EVAL_WEIGHTS_PATH)
+
+# Number of moves suggested per position, unless a request asks for
+# another number with "multipv" (at most MAX_MULTIPV)
+NUM_MOVES = 3
+MAX_MULTIPV = 10
+
+# Depth of the multi-PV search ranking the suggested moves
+TOP_MOVES_DEPTH = int(os.environ.get('TOP_MOVES_DEPTH', 3))
+
+cache = AnalysisCache(os.environ.get('ENGINE_CACHE_PATH', 'engine_cache.sqlite3') or None,
+                      memory_entries=int(os.environ.get('ENGINE_CACHE_ENTRIES', 10000)),
+                      disk_entries=int(os.environ.get('ENGINE_CACHE_DISK_ENTRIES', 1000000)),
+                      # Results of other weights are dropped when the cache opens
+                      fingerprint=fingerprint({'engine': 'ChessEngine'}, (EVAL_WEIGHTS_PATH,)))
+
+def get_ranked_moves(board, num_moves=NUM_MOVES):
+    """Top moves as (uci, score, pv) lines, from the cache when possible."""
+    key = normalize_fen(board)
+    entry = cache.get(key, TOP_MOVES_DEPTH)
+    # Entries of older versions hold (uci, score) pairs without a PV
+    if (entry is not None and entry.moves and len(entry.moves[0]) == 3
+            and len(entry.moves) >= min(num_moves, board.legal_moves.count())):
+        return entry.moves[:num_moves]
+
+    moves = [(move.uci(), float(score), [pv_move.uci() for pv_move in pv])
+             for move, score, pv in engine.get_top_moves(board, num_moves=num_moves, depth=TOP_MOVES_DEPTH)]
+    if moves:
+        cache.put(key, CacheEntry(TOP_MOVES_DEPTH, moves[0][1], moves[0][0], moves[0][2], moves))
+    return moves
 
 @app.route('/')
 def home():
@@ -28,7 +65,8 @@ def analyze_position():
         logger.debug(f"Player color: {player_color}")
         
         board = chess.Board(fen)
-        top_moves = engine.get_top_moves(board, num_moves=3)
+        num_moves = max(1, min(int(data.get('multipv', NUM_MOVES)), MAX_MULTIPV))
+        top_moves = get_ranked_moves(board, num_moves)
         
         # If playing as black, only show moves when it's black's turn
         # If playing as white, only show moves when it's white's turn
@@ -40,11 +78,12 @@ def analyze_position():
         response = {
             'moves': [
                 {
-                    'uci': move[0].uci(),
-                    'san': board.san(move[0]),
-                    'score': float(move[1])
+                    'uci': uci,
+                    'san': board.san(chess.Move.from_uci(uci)),
+                    'score': score,
+                    'pv': pv
                 }
-                for move in top_moves
+                for uci, score, pv in top_moves
             ] if should_show_moves else []
         }
         
@@ -1,5 +1,5 @@
-// Utility function to get the current FEN position from chess.com
-function getChessComPosition() {
+// Utility function to get the moves played so far on chess.com, in UCI notation
+function getChessComMoves() {
     try {
         const moveList = document.querySelector('wc-simple-move-list');
         if (!moveList) {
@@ -15,23 +15,27 @@ function getChessComPosition() {
             }
         });
 
-        if (moves.length === 0) {
-            return 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1';  // Starting position
-        }
-
-        // Use chess.js to reconstruct the position
+        // Use chess.js to turn the SAN moves into UCI ones
         const chess = new Chess();
-        moves.forEach(move => {
+        const uciMoves = [];
+        for (const san of moves) {
+            let move = null;
             try {
-                chess.move(move);
+                move = chess.move(san);
             } catch (e) {
-                console.error('Invalid move:', move, e);
+                // Reported below
             }
-        });
+            if (!move) {
+                // The moves after it could not be played on the server either
+                console.error('Invalid move:', san);
+                break;
+            }
+            uciMoves.push(move.from + move.to + (move.promotion || ''));
+        }
 
-        return chess.fen();
+        return uciMoves;
     } catch (error) {
-        console.error('Error getting position:', error);
+        console.error('Error getting moves:', error);
         return null;
     }
 }
@@ -120,7 +124,7 @@ function isPlayingWhite() {
 
 // Function to create and add an SVG arrow to the board
 function createArrow(from, to, color = '#00ff00', width = 8) {
-    // Find the chess board using the same method that works in getChessComPosition
+    // Find the chess board using the same method that works in getChessComMoves
     console.log('Searching for chess board...');
     
     // Wait a short moment to ensure the board is fully loaded
@@ -264,6 +268,9 @@ function displayAnalysisResults(move) {
         const from = move.uci.substring(0, 2);
         const to = move.uci.substring(2, 4);
         content = `Best move: ${from}-${to} (Score: ${move.score})`;
+        if (move.depth) {
+            content += ` depth ${move.depth}`;
+        }
     } else {
         content = 'No recommended moves';
     }
@@ -277,48 +284,166 @@ function displayAnalysisResults(move) {
     }
 }
 
+// How long the engine may think about a position
+const ANALYSIS_MOVETIME_MS = 5000;
+
+// Analysis server
+const SERVER_URL = 'http://localhost:5001';
+
+// This tab's game session on the server and the moves it was sent. The
+// server follows the game move by move, and keeps what it learnt about
+// the game from one analysis to the next
+let gameSession = null;
+
+// Stream of the analysis currently running, if any
+let analysisStream = null;
+
+// Number of the latest analysis request, so a slower older one gives way
+let analysisRequest = 0;
+
+async function postJson(path, body) {
+    return fetch(`${SERVER_URL}${path}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+}
+
+// Pending game session update; updates run one after another, since each
+// one works out what to send from the moves the previous one left
+let sessionSync = Promise.resolve();
+
+// Bring the game session up to date with the page and return its id
+function syncGameSession(moves) {
+    const sync = sessionSync.then(() => updateGameSession(moves));
+    // A failed update must not hold up the next one
+    sessionSync = sync.catch(() => {});
+    return sync;
+}
+
+async function updateGameSession(moves) {
+    const session = gameSession;
+    if (session) {
+        // Moves the page no longer shows (a takeback or a new game) are taken back first
+        let common = 0;
+        while (common < session.moves.length && common < moves.length &&
+               session.moves[common] === moves[common]) {
+            common++;
+        }
+        let response;
+        try {
+            response = await postJson(`/sessions/${session.id}/moves`, {
+                undo: session.moves.length - common,
+                moves: moves.slice(common)
+            });
+        } catch (error) {
+            // Whether the server played the moves is unknown, so the next update starts over
+            if (gameSession === session) {
+                gameSession = null;
+            }
+            throw error;
+        }
+        if (response.ok) {
+            session.moves = moves;
+            return session.id;
+        }
+        // The server evicted the session or refused the moves: start a new one
+        console.log('Game session out of date, starting a new one:', response.status);
+        if (gameSession === session) {
+            gameSession = null;
+        }
+    }
+
+    const response = await postJson('/sessions', { moves: moves });
+    if (!response.ok) {
+        throw new Error(`Could not start a game session: ${response.status}`);
+    }
+    const data = await response.json();
+    gameSession = { id: data.session_id, moves: moves };
+    return gameSession.id;
+}
+
 // Function to analyze the current position
 async function analyzePosition() {
-    try {
-        console.log('Starting position analysis...');
-        const fen = getChessComPosition();
-        console.log('Current FEN:', fen);
-        
-        if (!fen) {
-            console.error('Could not get FEN position');
-            displayAnalysisResults(null);
-            return;
-        }
+    console.log('Starting position analysis...');
+    const request = ++analysisRequest;
+    const moves = getChessComMoves();
+    console.log('Current moves:', moves);
 
-        const response = await fetch('http://localhost:5001/analyze', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                fen: fen,
-                player_color: isPlayingWhite() ? 'white' : 'black'
-            })
-        });
+    if (!moves) {
+        console.error('Could not get the moves played');
+        displayAnalysisResults(null);
+        return;
+    }
+
+    // Closing the previous stream stops its search on the server
+    if (analysisStream) {
+        analysisStream.close();
+        analysisStream = null;
+    }
+
+    let sessionId;
+    try {
+        sessionId = await syncGameSession(moves);
+    } catch (error) {
+        console.error('Error updating the game session:', error);
+        displayAnalysisResults(null);
+        return;
+    }
+    if (request !== analysisRequest) {
+        return;
+    }
 
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+    const params = new URLSearchParams({
+        player_color: isPlayingWhite() ? 'white' : 'black',
+        movetime_ms: ANALYSIS_MOVETIME_MS
+    });
+    const stream = new EventSource(`${SERVER_URL}/sessions/${sessionId}/analyze/stream?${params}`);
+    analysisStream = stream;
+    let gotResult = false;
+
+    function finish() {
+        stream.close();
+        if (analysisStream === stream) {
+            analysisStream = null;
         }
+    }
+
+    // Show the best move of every completed depth as it arrives
+    stream.addEventListener('info', event => {
+        const info = JSON.parse(event.data);
+        gotResult = true;
+        displayAnalysisResults({ uci: info.move, score: info.score, depth: info.depth });
+    });
 
-        const data = await response.json();
+    stream.addEventListener('bestmove', event => {
+        const data = JSON.parse(event.data);
         console.log('Analysis response:', data);
-        
-        if (data.moves && data.moves.length > 0) {
-            displayAnalysisResults(data.moves[0]);
-        } else {
+        displayAnalysisResults(data.move ? { uci: data.move, score: data.score, depth: data.depth } : null);
+        finish();
+    });
+
+    // A newer analysis from this tab replaced this one
+    stream.addEventListener('cancelled', finish);
+
+    // Both connection errors and errors reported by the server
+    stream.addEventListener('error', event => {
+        console.error('Error during analysis:', event.data || event);
+        if (!gotResult) {
             displayAnalysisResults(null);
         }
-    } catch (error) {
-        console.error('Error during analysis:', error);
-        displayAnalysisResults(null);
-    }
+        finish();
+    });
 }
 
+// The server would otherwise keep the session until it has been idle for a while
+window.addEventListener('pagehide', () => {
+    if (gameSession) {
+        fetch(`${SERVER_URL}/sessions/${gameSession.id}`, { method: 'DELETE', keepalive: true });
+        gameSession = null;
+    }
+});
+
 // Function to check if we're in a chess game
 function isInChessGame() {
     return window.location.hostname.includes('chess.com') && 
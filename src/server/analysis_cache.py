@@ -0,0 +1,215 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# One analysis result. Scores are centipawns from White's perspective and
+# moves are UCI strings; ``moves`` optionally holds the ranked (uci, score, pv)
+# lines of a multi-PV search.
+CacheEntry = namedtuple('CacheEntry', ['depth', 'score', 'best_move', 'pv', 'moves'], defaults=[None])
+
+# Share of the on-disk entries removed when the disk tier is full
+DISK_EVICTION_FRACTION = 0.1
+
+# Disk hits whose recency is kept in memory before it is written out; it
+# is also written with the next stored result and when the cache closes
+RECENCY_FLUSH_READS = 1000
+
+
+def normalize_fen(board):
+    """FEN without move counters and with en passant only when it is legal."""
+    return ' '.join(board.fen(en_passant='legal').split()[:4])
+
+
+def fingerprint(settings, paths=()):
+    """
+    Digest of what search results depend on besides the position.
+
+    ``settings`` is any JSON-serializable value. Each file in ``paths``
+    counts by its contents and each directory by the names, sizes and
+    modification times of its files; a missing or unset path counts as
+    absent.
+    """
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode())
+    for path in paths:
+        digest.update(b'\0' + str(path).encode())
+        if path and os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                stat = os.stat(os.path.join(path, name))
+                digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        elif path and os.path.isfile(path):
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Depth-aware cache of analysis results keyed by normalized FEN.
+
+    Recently used entries stay in an in-memory LRU of ``memory_entries``;
+    every result is also written to a SQLite file at ``path`` (memory only
+    when ``path`` is None), so the cache survives restarts. The disk tier
+    holds at most ``disk_entries`` results and drops the least recently
+    read ones first. A result is only replaced by one of equal or greater
+    depth. Safe to use from several threads.
+
+    ``fingerprint`` (see fingerprint()) identifies the engine settings the
+    results were searched with; a file written under another fingerprint
+    is emptied on opening, so results never outlive a re-tune or a change
+    of search settings.
+    """
+
+    def __init__(self, path=None, memory_entries=10000, disk_entries=1000000, fingerprint=None):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, depth INTEGER, score REAL, best_move TEXT,"
+                " pv TEXT, moves TEXT, used INTEGER)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            if fingerprint is not None:
+                row = self.db.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+                if row is None or row[0] != fingerprint:
+                    if self.db.execute("SELECT 1 FROM results LIMIT 1").fetchone() is not None:
+                        logger.info(f"Engine settings changed, clearing the analysis cache at {path}")
+                        self.db.execute("DELETE FROM results")
+                    self.db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('fingerprint', ?)",
+                                    (fingerprint,))
+            self.disk_count, last_used = self.db.execute(
+                "SELECT COUNT(*), MAX(used) FROM results").fetchone()
+            # Logical clock for the disk tier's least-recently-used order, and
+            # the clock of disk hits not yet written, so reads stay read-only
+            self.clock = last_used or 0
+            self.pending_used = {}
+            self.db.commit()
+
+    def get(self, key, min_depth=0):
+        """Return the entry for a key if it was searched to at least min_depth, else None."""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry.depth >= min_depth:
+                    self.memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry
+                # The disk never holds a deeper result than memory
+                self.misses += 1
+                return None
+
+            entry = self._read(key)
+            if entry is not None and entry.depth >= min_depth:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, key, entry):
+        """Store a result unless a deeper one is already cached."""
+        with self.lock:
+            current = self.memory.get(key)
+            if current is None:
+                current = self._read(key)
+            if current is not None and current.depth > entry.depth:
+                return
+            self._remember(key, entry)
+            self._write(key, entry)
+
+    def stats(self):
+        """Hit and miss counters and current sizes."""
+        with self.lock:
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self.memory),
+                'disk_entries': self.disk_count if self.db is not None else 0,
+            }
+
+    def clear(self):
+        """Remove all entries from both tiers."""
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM results")
+                self.db.commit()
+                self.disk_count = 0
+                self.pending_used.clear()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self._flush_used()
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def _read(self, key):
+        if self.db is None:
+            return None
+        row = self.db.execute(
+            "SELECT depth, score, best_move, pv, moves FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.clock += 1
+        self.pending_used[key] = self.clock
+        if len(self.pending_used) >= RECENCY_FLUSH_READS:
+            self._flush_used()
+            self.db.commit()
+        depth, score, best_move, pv, moves = row
+        moves = [tuple(move) for move in json.loads(moves)] if moves else None
+        return CacheEntry(depth, score, best_move, json.loads(pv), moves)
+
+    def _flush_used(self):
+        """Write the recency of the disk hits since the last flush (the caller commits)."""
+        if self.pending_used:
+            self.db.executemany("UPDATE results SET used = ? WHERE key = ?",
+                                [(used, key) for key, used in self.pending_used.items()])
+            self.pending_used.clear()
+
+    def _write(self, key, entry):
+        if self.db is None:
+            return
+        # Eviction below goes by recency, so it must see every hit
+        self._flush_used()
+        exists = self.db.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+        self.clock += 1
+        self.db.execute(
+            "INSERT OR REPLACE INTO results (key, depth, score, best_move, pv, moves, used)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, entry.depth, entry.score, entry.best_move, json.dumps(entry.pv),
+             json.dumps(entry.moves) if entry.moves is not None else None, self.clock))
+        if not exists:
+            self.disk_count += 1
+            if self.disk_count > self.disk_entries:
+                evict = max(1, int(self.disk_entries * DISK_EVICTION_FRACTION))
+                self.db.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)",
+                    (evict,))
+                self.disk_count -= evict
+        self.db.commit()
@@ -1,8 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 import chess
-import random
+import chess.polyglot
+import os
 import logging
+import threading
+import functools
+import json
+import time
+from transposition import TranspositionTable, SharedTranspositionTable, EXACT, LOWER, UPPER
+from lazy_smp import LazySMP
+from time_manager import SearchClock, SearchTimeout, allocate_time
+from incremental_eval import EvalState, piece_square_totals, taper
+from move_picker import MoveOrdering
+from opening_book import OpeningBook
+from tablebase import Tablebase
+from exchange import static_exchange_evaluation
+from attack_map import AttackMap, CENTER_MASK, KING_ZONE_MASKS, SHIELD_SQUARES
+from worker_pool import EnginePool
+from coalescing import RequestCoalescer, SearchCancelled, CANCEL_POLL_INTERVAL
+from analysis_cache import AnalysisCache, CacheEntry, normalize_fen, fingerprint
+from search_stats import SearchStats, EVAL_TERMS
+from metrics import Registry
+from pondering import Ponderer
+from eval_weights import read_weights, apply_weights
+from pawn_hash import HashCache, PawnEntry, pawn_key, pawn_structure
+from sessions import SessionStore, SearchStates, position_history
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -11,8 +34,140 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
+# Engine worker pool settings
+ENGINE_WORKERS = int(os.environ.get('ENGINE_WORKERS', os.cpu_count() or 1))
+HASH_SIZE_MB = int(os.environ.get('HASH_SIZE_MB', 16))
+
+# Polyglot opening book (optional), the lowest entry weight used and the
+# number of half-moves after which the book is no longer consulted
+BOOK_PATH = os.environ.get('BOOK_PATH')
+BOOK_MIN_WEIGHT = int(os.environ.get('BOOK_MIN_WEIGHT', 1))
+BOOK_MAX_PLY = int(os.environ.get('BOOK_MAX_PLY', 20))
+
+# Directory of endgame tables built with tablebase.py (optional)
+TABLEBASE_PATH = os.environ.get('TABLEBASE_PATH')
+
+# Evaluation weights written by tuning.py (optional; the built-in values otherwise)
+EVAL_WEIGHTS_PATH = os.environ.get('EVAL_WEIGHTS_PATH')
+
+# Entries of each engine's pawn-structure hash table and evaluation cache
+# (0 disables a cache); both are kept for the life of the engine
+PAWN_HASH_ENTRIES = int(os.environ.get('PAWN_HASH_ENTRIES', 16384))
+EVAL_CACHE_ENTRIES = int(os.environ.get('EVAL_CACHE_ENTRIES', 65536))
+
+# Maximum search threads (Lazy SMP processes) per worker; requests may use fewer
+SEARCH_THREADS = int(os.environ.get('SEARCH_THREADS', 1))
+ANALYSIS_TIMEOUT = float(os.environ.get('ANALYSIS_TIMEOUT', 30))
+
+# Search time when a request gives neither a depth nor any time control
+DEFAULT_MOVETIME_MS = int(os.environ.get('DEFAULT_MOVETIME_MS', 1000))
+
+# Extra time a worker gets beyond its search budget before it is treated as stuck
+ANALYSIS_TIMEOUT_GRACE = float(os.environ.get('ANALYSIS_TIMEOUT_GRACE', 5))
+
+# Seconds between keep-alive comments on an analysis stream
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 1))
+
+# Result cache file (empty to keep results in memory only) and its sizes
+ANALYSIS_CACHE_PATH = os.environ.get('ANALYSIS_CACHE_PATH', 'analysis_cache.sqlite3')
+ANALYSIS_CACHE_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_ENTRIES', 10000))
+ANALYSIS_CACHE_DISK_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_DISK_ENTRIES', 1000000))
+
+# Depth a cached result needs to answer a request limited by time only
+CACHE_MIN_DEPTH = int(os.environ.get('CACHE_MIN_DEPTH', 4))
+
+# Collect search statistics for every search so /metrics can report them
+# (requests can always ask for their own with "stats")
+SEARCH_STATS = os.environ.get('SEARCH_STATS', '0') == '1'
+
+# Game sessions (see /sessions): the most kept at once and the seconds an
+# unused one is kept for
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 1000))
+SESSION_IDLE_SECONDS = float(os.environ.get('SESSION_IDLE_SECONDS', 1800))
+
+# Transposition table of each game session on an engine worker, and the
+# memory each worker may spend on the tables of its sessions
+SESSION_HASH_MB = int(os.environ.get('SESSION_HASH_MB', 4))
+SESSION_MEMORY_MB = int(os.environ.get('SESSION_MEMORY_MB', 64))
+
+# Budget for searching a session's expected next position while the
+# opponent thinks (0 disables pondering)
+PONDER_MOVETIME_MS = int(os.environ.get('PONDER_MOVETIME_MS', 5000))
+
+# Selective search techniques; SEARCH_FEATURES lists the ones in use so
+# that each can be switched off to measure its effect
+ALL_SEARCH_FEATURES = ('pvs', 'aspiration', 'null_move', 'lmr', 'futility', 'razoring')
+SEARCH_FEATURES = [name for name in os.environ.get('SEARCH_FEATURES', ','.join(ALL_SEARCH_FEATURES)).split(',')
+                   if name]
+
+# Most principal variations a request may ask for with "multipv"
+MAX_MULTIPV = int(os.environ.get('MAX_MULTIPV', 10))
+
+# Deepest iteration when the search is limited by time only
+MAX_DEPTH = 64
+
+# Score of a checkmate; scores beyond MATE_THRESHOLD are mates or tablebase
+# wins, less one for every ply until the mate
+MATE_SCORE = 20000
+MATE_THRESHOLD = 10000
+
+# Safety margin for delta pruning in quiescence search
+DELTA_MARGIN = 200
+
+# Half-width of the first aspiration window around the previous iteration's
+# score, the depth from which it is used and the width beyond which a
+# failed window is opened fully
+ASPIRATION_WINDOW = 50
+ASPIRATION_MIN_DEPTH = 3
+ASPIRATION_MAX_WINDOW = 800
+
+# Null-move pruning: shallowest depth and the depth reduction (one more from depth 6)
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_REDUCTION = 2
+
+# Late move reductions: shallowest depth, and the move ranks from which
+# quiet moves are reduced by one and by two plies
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVE = 3
+LMR_DEEP_MOVE = 8
+
+# Margins by remaining depth for futility pruning of quiet moves (depth 1
+# and 2) and for razoring into quiescence search (depth 1 only, deeper
+# razoring misses quiet mating moves)
+FUTILITY_MARGINS = (0, 200, 500)
+RAZOR_MARGINS = (0, 300)
+
+
+def mate_in(score):
+    """Moves to mate for a mate score, negative when being mated, or None for any other score."""
+    if abs(score) < MATE_THRESHOLD:
+        return None
+    moves = (MATE_SCORE - abs(score) + 1) // 2
+    return moves if score > 0 else -moves
+
+
+def score_to_tt(score, ply):
+    """A mate score counted from the root as stored in the table: counted from the position, ``ply`` deep."""
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    """A mate score counted from a position ``ply`` deep, counted from the root instead."""
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
 class ImprovedChessEngine:
-    def __init__(self):
+    def __init__(self, hash_size_mb=16, threads=1, book_path=None, book_min_weight=1, book_max_ply=None,
+                 tablebase_path=None, search_features=None, weights_path=None,
+                 pawn_hash_entries=PAWN_HASH_ENTRIES, eval_cache_entries=EVAL_CACHE_ENTRIES,
+                 session_hash_mb=SESSION_HASH_MB, session_memory_mb=SESSION_MEMORY_MB):
         # Material values
         self.piece_values = {
             chess.PAWN: 100,
@@ -29,6 +184,12 @@ class ImprovedChessEngine:
             'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1': ['e7e5', 'e7e6', 'c7c5'],  # After 1.e4
             'rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR b KQkq - 0 1': ['d7d5', 'g8f6', 'e7e6'],  # After 1.d4
         }
+
+        # Polyglot book, falling back to the moves above
+        self.book = OpeningBook(book_path, book_min_weight, book_max_ply, fallback=self.opening_moves)
+
+        # Distance-to-mate tables for endgames with few pieces
+        self.tablebase = Tablebase(tablebase_path) if tablebase_path else None
         
         # Position values for each piece type
         self.pawn_position_values = [
@@ -97,11 +258,114 @@ class ImprovedChessEngine:
             20, 30, 10,  0,  0, 10, 30, 20
         ]
 
+        self.king_position_values_endgame = [
+            -50,-40,-30,-20,-20,-30,-40,-50,
+            -30,-20,-10,  0,  0,-10,-20,-30,
+            -30,-10, 20, 30, 30, 20,-10,-30,
+            -30,-10, 30, 40, 40, 30,-10,-30,
+            -30,-10, 30, 40, 40, 30,-10,-30,
+            -30,-10, 20, 30, 30, 20,-10,-30,
+            -30,-30,  0,  0,  0,  0,-30,-30,
+            -50,-30,-30,-30,-30,-30,-30,-50
+        ]
+
+        # Square bonuses per rank a pawn has advanced and per step a knight
+        # stands away from the center
+        self.pawn_advance_bonus = 10
+        self.knight_center_penalty = 10
+
+        # Pawn structure (passed pawns per rank advanced) and piece activity
+        self.doubled_pawn_penalty = 20
+        self.isolated_pawn_penalty = 15
+        self.backward_pawn_penalty = 10
+        self.passed_pawn_bonus = 10
+        self.bishop_mobility_bonus = 5
+        self.rook_open_file_bonus = 30
+        self.queen_mobility_bonus = 2
+
+        # King safety: per shielding pawn and per enemy attack on the king zone
+        self.pawn_shield_bonus = 30
+        self.king_zone_attack_penalty = 20
+
+        # Threats, in percent of the value of a hanging piece and of the
+        # difference to its cheapest attacker for an inadequately defended one
+        self.hanging_piece_percent = 100
+        self.weak_piece_percent = 50
+
+        # Per legal move of the side to move, scaled by the pieces on the board
+        self.mobility_bonus = 5
+
+        # Tuned values replacing the ones above (see eval_weights.py and tuning.py)
+        if weights_path:
+            apply_weights(self, read_weights(weights_path))
+
+        # Selective search techniques in use (see ALL_SEARCH_FEATURES)
+        search_features = ALL_SEARCH_FEATURES if search_features is None else tuple(search_features)
+        unknown = set(search_features) - set(ALL_SEARCH_FEATURES)
+        if unknown:
+            raise ValueError(f"Unknown search features: {', '.join(sorted(unknown))}")
+        self.search_features = search_features
+        self.use_pvs = 'pvs' in search_features
+        self.use_aspiration = 'aspiration' in search_features
+        self.use_null_move = 'null_move' in search_features
+        self.use_lmr = 'lmr' in search_features
+        self.use_futility = 'futility' in search_features
+        self.use_razoring = 'razoring' in search_features
+
+        # Combined material and square values, updated incrementally in the search
+        self.mg_tables = self.build_square_tables(is_endgame=False)
+        self.eg_tables = self.build_square_tables(is_endgame=True)
+        self.eval_state = None
+
+        # Pawn-structure terms by pawn key and static evaluations by position
+        # key, kept across searches since neither depends on the search
+        self.pawn_hash = HashCache(pawn_hash_entries) if pawn_hash_entries else None
+        self.eval_cache = HashCache(eval_cache_entries) if eval_cache_entries else None
+
+        # Transposition table shared by negamax and quiescence search. With
+        # more than one thread it lives in shared memory so that Lazy SMP
+        # helper processes can use it too
+        self.smp = None
+        if threads > 1:
+            self.tt = SharedTranspositionTable(hash_size_mb)
+            helper_factory = functools.partial(ImprovedChessEngine, hash_size_mb=0, tablebase_path=tablebase_path,
+                                               search_features=search_features, weights_path=weights_path,
+                                               pawn_hash_entries=pawn_hash_entries,
+                                               eval_cache_entries=eval_cache_entries)
+            self.smp = LazySMP(helper_factory, self.tt, threads - 1)
+        else:
+            self.tt = TranspositionTable(hash_size_mb)
+
+        # Killer moves and history scores, kept across iterations
+        self.move_ordering = MoveOrdering(self.piece_values, MAX_DEPTH + 1)
+
+        # Game sessions' own transposition tables and move ordering, kept
+        # between their searches; see use_session
+        self.own_search_state = (self.tt, self.move_ordering)
+        self.session_states = SearchStates(
+            lambda: (TranspositionTable(session_hash_mb), MoveOrdering(self.piece_values, MAX_DEPTH + 1)),
+            max(1, session_memory_mb // max(1, session_hash_mb)), SESSION_IDLE_SECONDS)
+
+        # Per-search state, reset by get_best_move
+        self.stop_event = None
+        self.clock = SearchClock()
+        self.nodes = 0
+        self.node_limit = None
+        self.completed_depth = 0
+        # (move, score, pv) of each line of the last multi-PV search, best first
+        self.lines = None
+        # Zobrist keys of the game's and the search path's positions, see is_repetition
+        self.key_history = []
+
+        # SearchStats while statistics are collected, see run_analysis
+        self.stats = None
+
     def get_position_value(self, piece, square, is_endgame=False):
         """Get the position value for a piece on a given square."""
         piece_type = piece.piece_type
         is_white = piece.color == chess.WHITE
-        square_idx = square if is_white else 63 - square
+        # Tables are laid out from white's side with rank 8 first
+        square_idx = chess.square_mirror(square) if is_white else square
 
         if piece_type == chess.PAWN:
             return self.pawn_position_values[square_idx]
@@ -114,28 +378,74 @@ class ImprovedChessEngine:
         elif piece_type == chess.QUEEN:
             return self.queen_position_values[square_idx]
         elif piece_type == chess.KING:
+            if is_endgame:
+                return self.king_position_values_endgame[square_idx]
             return self.king_position_values_middlegame[square_idx]
         return 0
 
-    def evaluate_center_control(self, board):
+    def get_square_bonus(self, piece, square):
+        """Get the fixed per-square bonus for advanced pawns and centralized knights."""
+        rank = chess.square_rank(square)
+        file = chess.square_file(square)
+
+        if piece.piece_type == chess.PAWN:
+            # Reward advanced pawns
+            return (rank if piece.color == chess.WHITE else 7 - rank) * self.pawn_advance_bonus
+        elif piece.piece_type == chess.KNIGHT:
+            # Knights are better in the center
+            center_distance = abs(3.5 - file) + abs(3.5 - rank)
+            return -int(center_distance * self.knight_center_penalty)
+        return 0
+
+    def build_square_tables(self, is_endgame):
+        """Build [color][piece_type][square] tables of material plus square values.
+
+        Values are from white's perspective, so black entries are negated.
+        """
+        tables = {}
+        for color in chess.COLORS:
+            sign = 1 if color == chess.WHITE else -1
+            tables[color] = {}
+            for piece_type in chess.PIECE_TYPES:
+                piece = chess.Piece(piece_type, color)
+                tables[color][piece_type] = [
+                    sign * (self.piece_values[piece_type]
+                            + self.get_position_value(piece, square, is_endgame)
+                            + self.get_square_bonus(piece, square))
+                    for square in chess.SQUARES
+                ]
+        return tables
+
+    def evaluate_piece_squares(self, board):
+        """Evaluate material and piece-square values, tapered by game phase."""
+        if self.eval_state is not None and self.eval_state.board is board:
+            # Kept up to date move by move during the search
+            return self.eval_state.score()
+        return taper(*piece_square_totals(board, self.mg_tables, self.eg_tables))
+
+    def make_move(self, board, move):
+        """Push a move, updating the incremental evaluation when it tracks this board."""
+        if self.eval_state is not None and self.eval_state.board is board:
+            self.eval_state.push(move)
+        else:
+            board.push(move)
+
+    def unmake_move(self, board):
+        """Pop the last move, updating the incremental evaluation when it tracks this board."""
+        if self.eval_state is not None and self.eval_state.board is board:
+            return self.eval_state.pop()
+        return board.pop()
+
+    def evaluate_center_control(self, board, attacks=None):
         """Evaluate control of the center squares."""
-        center_squares = [chess.E4, chess.E5, chess.D4, chess.D5]
-        score = 0
+        attacks = attacks or AttackMap(board)
         
-        for square in center_squares:
-            # Add points for pieces controlling center
-            attackers = board.attackers(chess.WHITE, square)
-            score += len(attackers) * 10
-            attackers = board.attackers(chess.BLACK, square)
-            score -= len(attackers) * 10
-            
-            # Additional points for occupying center
-            piece = board.piece_at(square)
-            if piece:
-                if piece.color == chess.WHITE:
-                    score += 30
-                else:
-                    score -= 30
+        # Add points for pieces controlling center
+        score = (attacks.count(chess.WHITE, CENTER_MASK) - attacks.count(chess.BLACK, CENTER_MASK)) * 10
+        
+        # Additional points for occupying center
+        score += chess.popcount(board.occupied_co[chess.WHITE] & CENTER_MASK) * 30
+        score -= chess.popcount(board.occupied_co[chess.BLACK] & CENTER_MASK) * 30
         
         return score
 
@@ -164,71 +474,61 @@ class ImprovedChessEngine:
         
         return score
 
-    def evaluate_material(self, board):
-        """Evaluate material balance and piece activity."""
-        score = 0
+    def evaluate_pawn_structure(self, board):
+        """Return the PawnEntry of a position, from the pawn hash table when it is there."""
+        if self.eval_state is not None and self.eval_state.board is board:
+            key = self.eval_state.pawn_key
+        else:
+            key = pawn_key(board)
+        entry = self.pawn_hash.probe(key) if self.pawn_hash is not None else None
+        if entry is None:
+            doubled, isolated, backward, passed, open_files = pawn_structure(board)
+            score = (passed * self.passed_pawn_bonus - doubled * self.doubled_pawn_penalty
+                     - isolated * self.isolated_pawn_penalty - backward * self.backward_pawn_penalty)
+            entry = PawnEntry(score, open_files)
+            if self.pawn_hash is not None:
+                self.pawn_hash.store(key, entry)
+        return entry
+
+    def evaluate_material(self, board, attacks=None, pawns=None):
+        """Evaluate material balance, pawn structure and piece activity."""
+        attacks = attacks or AttackMap(board)
+        pawns = pawns or self.evaluate_pawn_structure(board)
+
+        # Material, piece-square tables, pawn advancement and knight centralization
+        score = self.evaluate_piece_squares(board)
+
+        # Doubled, isolated, backward and passed pawns
+        score += pawns.score
         
-        # Count material and evaluate piece positions
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if not piece:
-                continue
-                
-            value = self.piece_values[piece.piece_type]
-            
-            # Basic position evaluation
-            if piece.piece_type == chess.PAWN:
-                # Reward advanced pawns
-                rank = chess.square_rank(square)
-                if piece.color == chess.WHITE:
-                    value += rank * 10
-                else:
-                    value += (7 - rank) * 10
-                    
-                # Penalize doubled pawns
-                file = chess.square_file(square)
-                pawns_in_file = sum(1 for r in range(8) if 
-                    board.piece_at(chess.square(file, r)) and 
-                    board.piece_at(chess.square(file, r)).piece_type == chess.PAWN and
-                    board.piece_at(chess.square(file, r)).color == piece.color)
-                if pawns_in_file > 1:
-                    value -= 20
-                    
-            elif piece.piece_type == chess.KNIGHT:
-                # Knights are better in the center
-                file = chess.square_file(square)
-                rank = chess.square_rank(square)
-                center_distance = abs(3.5 - file) + abs(3.5 - rank)
-                value -= int(center_distance * 10)
-                
-            elif piece.piece_type == chess.BISHOP:
-                # Reward bishops for controlling many squares
-                mobility = len(list(board.attacks(square)))
-                value += mobility * 5
-                
-            elif piece.piece_type == chess.ROOK:
-                # Rooks on open files
-                file = chess.square_file(square)
-                pawns_in_file = sum(1 for r in range(8) if 
-                    board.piece_at(chess.square(file, r)) and 
-                    board.piece_at(chess.square(file, r)).piece_type == chess.PAWN)
-                if pawns_in_file == 0:
-                    value += 30
+        # Evaluate the terms that depend on more than the piece's own square
+        for color in chess.COLORS:
+            value = 0
+            for square, piece_type, piece_attacks in attacks.pieces[color]:
+                if piece_type == chess.BISHOP:
+                    # Reward bishops for controlling many squares
+                    value += chess.popcount(piece_attacks) * self.bishop_mobility_bonus
                     
-            elif piece.piece_type == chess.QUEEN:
-                # Queens should have good mobility
-                mobility = len(list(board.attacks(square)))
-                value += mobility * 2
+                elif piece_type == chess.ROOK:
+                    # Rooks on open files
+                    if pawns.open_files & chess.BB_SQUARES[square]:
+                        value += self.rook_open_file_bonus
+                        
+                elif piece_type == chess.QUEEN:
+                    # Queens should have good mobility
+                    value += chess.popcount(piece_attacks) * self.queen_mobility_bonus
             
-            if piece.color == chess.WHITE:
+            if color == chess.WHITE:
                 score += value
             else:
                 score -= value
                 
         return score
 
-    def evaluate_king_safety(self, board):
+    def evaluate_king_safety(self, board, attacks=None, pawns=None):
         """Evaluate king safety and threats."""
+        attacks = attacks or AttackMap(board)
+        pawns = pawns or self.evaluate_pawn_structure(board)
         score = 0
         
         for color in [chess.WHITE, chess.BLACK]:
@@ -236,28 +536,16 @@ class ImprovedChessEngine:
             if king_square is None:
                 continue
             
-            # Check pawn shield
-            king_file = chess.square_file(king_square)
-            king_rank = chess.square_rank(king_square)
-            shield_score = 0
-            
-            for f in [max(0, king_file - 1), king_file, min(7, king_file + 1)]:
-                pawn_rank = king_rank + (1 if color == chess.WHITE else -1)
-                if 0 <= pawn_rank <= 7:
-                    pawn = board.piece_at(chess.square(f, pawn_rank))
-                    if pawn and pawn.piece_type == chess.PAWN and pawn.color == color:
-                        shield_score += 30
+            # Check pawn shield, kept with the pawn structure while the king stays put
+            if pawns.king_squares[color] != king_square:
+                own_pawns = board.pawns & board.occupied_co[color]
+                pawns.shields[color] = sum(self.pawn_shield_bonus for mask in SHIELD_SQUARES[color][king_square]
+                                           if own_pawns & mask)
+                pawns.king_squares[color] = king_square
+            shield_score = pawns.shields[color]
             
             # Count attackers near king
-            danger_zone = [s for s in chess.SQUARES if abs(chess.square_file(s) - king_file) <= 2
-                          and abs(chess.square_rank(s) - king_rank) <= 2]
-            
-            attackers = 0
-            for square in danger_zone:
-                attackers_to_square = board.attackers(not color, square)
-                attackers += len(attackers_to_square)
-            
-            king_danger = attackers * 20
+            king_danger = attacks.count(not color, KING_ZONE_MASKS[king_square]) * self.king_zone_attack_penalty
             
             if color == chess.WHITE:
                 score += shield_score - king_danger
@@ -266,241 +554,1283 @@ class ImprovedChessEngine:
         
         return score
 
-    def evaluate_threats(self, board):
+    def evaluate_threats(self, board, attacks=None):
         """Evaluate immediate threats and hanging pieces."""
+        attacks = attacks or AttackMap(board)
         score = 0
+        attackers_by_value = sorted(chess.PIECE_TYPES, key=lambda piece_type: self.piece_values[piece_type])
         
-        for square in chess.SQUARES:
-            piece = board.piece_at(square)
-            if not piece:
-                continue
-                
-            # Count attackers and defenders
-            attackers = board.attackers(not piece.color, square)
-            defenders = board.attackers(piece.color, square)
+        for color in chess.COLORS:
+            enemy_attacks = attacks.by_type[not color]
             
-            if attackers:
-                # Piece is under attack
-                piece_value = self.piece_values[piece.piece_type]
+            # Only pieces under attack can score here
+            for square in chess.scan_reversed(board.occupied_co[color] & attacks.all[not color]):
+                piece_value = self.piece_values[board.piece_type_at(square)]
+                square_mask = chess.BB_SQUARES[square]
                 
                 # Find the lowest value attacker
-                min_attacker_value = min(self.piece_values[board.piece_at(attacker).piece_type] 
-                                       for attacker in attackers)
+                min_attacker_value = next(self.piece_values[piece_type] for piece_type in attackers_by_value
+                                          if enemy_attacks[piece_type] & square_mask)
                 
-                if not defenders:
+                if not attacks.all[color] & square_mask:
                     # Hanging piece
-                    if piece.color == chess.WHITE:
-                        score -= piece_value
-                    else:
-                        score += piece_value
+                    penalty = piece_value * self.hanging_piece_percent // 100
                 elif min_attacker_value < piece_value:
                     # Piece is inadequately defended
-                    if piece.color == chess.WHITE:
-                        score -= (piece_value - min_attacker_value) // 2
-                    else:
-                        score += (piece_value - min_attacker_value) // 2
+                    penalty = (piece_value - min_attacker_value) * self.weak_piece_percent // 100
+                else:
+                    continue
+                if color == chess.WHITE:
+                    score -= penalty
+                else:
+                    score += penalty
         
         return score
 
     def evaluate_position(self, board):
         """Evaluate the current position."""
         if board.is_checkmate():
-            return -20000 if board.turn else 20000
+            return -MATE_SCORE if board.turn else MATE_SCORE
         if board.is_stalemate() or board.is_insufficient_material():
             return 0
-            
-        # Material and piece activity
-        score = self.evaluate_material(board)
+
+        return self.evaluate_static(board)
+
+    def evaluate_static(self, board, key=None):
+        """Evaluate the position without checking for mate or stalemate.
+
+        Used as the stand-pat score in quiescence search, where the game-over
+        checks of evaluate_position would generate the legal moves twice more.
+        ``key`` is the position's Zobrist hash when the caller already has it.
+        """
+        if self.eval_cache is not None:
+            if key is None:
+                key = chess.polyglot.zobrist_hash(board)
+            score = self.eval_cache.probe(key)
+            if score is not None:
+                return score
+
+        # One attack map and pawn structure entry shared by all terms
+        attacks = AttackMap(board)
+        pawns = self.evaluate_pawn_structure(board)
+
+        # Material, pawn structure and piece activity
+        score = self.evaluate_material(board, attacks, pawns)
         
         # King safety
-        score += self.evaluate_king_safety(board)
+        score += self.evaluate_king_safety(board, attacks, pawns)
         
         # Threats and hanging pieces
-        score += self.evaluate_threats(board)
+        score += self.evaluate_threats(board, attacks)
         
         # Mobility (weighted by game phase)
         piece_count = len(board.piece_map())
         mobility_weight = piece_count / 32.0  # More important in endgame
         
         if board.turn == chess.WHITE:
-            score += len(list(board.legal_moves)) * 5 * mobility_weight
+            score += board.legal_moves.count() * self.mobility_bonus * mobility_weight
         else:
-            score -= len(list(board.legal_moves)) * 5 * mobility_weight
-        
+            score -= board.legal_moves.count() * self.mobility_bonus * mobility_weight
+
+        if self.eval_cache is not None:
+            self.eval_cache.store(key, score)
         return score
 
-    def get_best_move(self, board, depth=4):
-        """Find the best move using minimax with alpha-beta pruning."""
-        def quiescence_search(board, alpha, beta, depth=4):
-            """Search captures until a quiet position."""
-            stand_pat = self.evaluate_position(board)
-            
-            if depth == 0:
+    def probe_tt(self, key, depth, alpha, beta, ply=0):
+        """Look up the position and return (cutoff score or None, hash move).
+
+        Scores, like alpha and beta, are from the side to move's perspective,
+        with mates counted from the root, ``ply`` moves up.
+        """
+        entry = self.tt.probe(key)
+        if self.stats is not None:
+            self.stats.tt_probes += 1
+            self.stats.tt_hits += entry is not None
+        if entry is None:
+            return None, None
+        if entry.depth >= depth:
+            score, bound = score_from_tt(entry.score, ply), entry.bound
+            if (bound == EXACT or (bound == LOWER and score >= beta)
+                    or (bound == UPPER and score <= alpha)):
+                return score, entry.move
+        return None, entry.move
+
+    def store_tt(self, key, depth, score, alpha, beta, move, ply=0):
+        """Store a negamax result searched with window (alpha, beta), ``ply`` moves from the root."""
+        if score <= alpha:
+            bound = UPPER
+        elif score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.tt.store(key, depth, bound, score_to_tt(score, ply), move)
+
+    def check_time(self):
+        """Count a node and abort the search once the deadline or node limit has passed or a stop is requested."""
+        self.nodes += 1
+        if (self.clock.expired() or (self.stop_event is not None and self.stop_event.is_set())
+                or (self.node_limit is not None and self.nodes >= self.node_limit)):
+            raise SearchTimeout()
+
+    def is_repetition(self, board, key):
+        """Whether the position occurred before, in the game or on the search path.
+
+        Only positions with the same side to move since the last capture or
+        pawn move can repeat, so at most halfmove_clock keys are looked at.
+        A repetition is scored as a draw.
+        """
+        history = self.key_history
+        for index in range(len(history) - 2, len(history) - 1 - min(board.halfmove_clock, len(history)), -2):
+            if history[index] == key:
+                return True
+        return False
+
+    def quiescence_search(self, board, alpha, beta, depth=4, ply=0):
+        """Search captures until a quiet position (scores from the side to move's perspective).
+
+        A side in check searches all its evasions instead. Mates are counted
+        from the root, ``ply`` moves up.
+        """
+        self.check_time()
+
+        key = chess.polyglot.zobrist_hash(board)
+        entry = self.tt.probe(key)
+        stats = self.stats
+        if stats is not None:
+            stats.qnodes += 1
+            stats.tt_probes += 1
+            stats.tt_hits += entry is not None
+        hash_move = None
+        if entry is not None:
+            score = score_from_tt(entry.score, ply)
+            if (entry.bound == EXACT or (entry.bound == LOWER and score >= beta)
+                    or (entry.bound == UPPER and score <= alpha)):
+                return score
+            hash_move = entry.move
+
+        alpha_orig = alpha
+        best_move = None
+        in_check = board.is_check()
+        if in_check:
+            # Mates delivered by a capture, which the pruning in negamax relies on seeing
+            if not any(board.generate_legal_moves()):
+                return -(MATE_SCORE - ply)
+            # In check there is no standing pat: every evasion is searched, none pruned
+            moves = self.order_moves(board, hash_move)
+        else:
+            stand_pat = self.evaluate_static(board, key)
+            if board.turn == chess.BLACK:
+                stand_pat = -stand_pat
+
+            if depth <= 0:
                 return stand_pat
-                
+
             if stand_pat >= beta:
+                self.tt.store(key, 0, LOWER, score_to_tt(beta, ply), hash_move)
                 return beta
-                
             alpha = max(alpha, stand_pat)
-            
-            # Look at captures only
-            for move in board.legal_moves:
-                if not board.is_capture(move):
+
+            # Generate captures only, trying the hash move first
+            moves = self.move_ordering.captures(board)
+            if hash_move in moves:
+                moves.remove(hash_move)
+                moves.insert(0, hash_move)
+
+        for move in moves:
+            if not in_check:
+                # Delta pruning: even winning the captured piece cannot raise alpha
+                captured = chess.PAWN if board.is_en_passant(move) else board.piece_type_at(move.to_square)
+                gain = self.piece_values[captured] if captured else 0
+                if move.promotion:
+                    gain += self.piece_values[move.promotion] - self.piece_values[chess.PAWN]
+                if stand_pat + gain + DELTA_MARGIN <= alpha:
                     continue
-                    
-                board.push(move)
-                score = -quiescence_search(board, -beta, -alpha, depth - 1)
-                board.pop()
-                
+
+                # Skip captures that lose material once all recaptures are played out
+                if static_exchange_evaluation(board, move, self.piece_values) < 0:
+                    continue
+
+            self.make_move(board, move)
+            score = -self.quiescence_search(board, -beta, -alpha, depth - 1, ply + 1)
+            self.unmake_move(board)
+            
+            if score >= beta:
+                self.tt.store(key, 0, LOWER, score_to_tt(beta, ply), move)
+                return beta
+            if score > alpha:
+                alpha = score
+                best_move = move
+            
+        self.tt.store(key, 0, EXACT if alpha > alpha_orig else UPPER, score_to_tt(alpha, ply), best_move)
+        return alpha
+
+    def negamax(self, board, depth, alpha, beta, ply=1, allow_null=True):
+        """Alpha-beta search in negamax form (scores from the side to move's perspective).
+
+        Principal variation search, null-move pruning, late move reductions,
+        futility pruning and razoring are applied as enabled for the engine;
+        without any of them this is plain alpha-beta with quiescence search.
+        """
+        if depth <= 0:
+            return self.quiescence_search(board, alpha, beta, ply=ply)
+
+        self.check_time()
+            
+        if board.is_game_over():
+            if board.is_checkmate():
+                return -(MATE_SCORE - ply)
+            return 0
+
+        # Exact result from the endgame tables
+        if self.tablebase is not None and chess.popcount(board.occupied) <= self.tablebase.max_pieces:
+            score = self.tablebase.probe_score(board)
+            if score is not None:
+                return score_from_tt(score if board.turn == chess.WHITE else -score, ply)
+
+        key = chess.polyglot.zobrist_hash(board)
+        if self.is_repetition(board, key):
+            return 0
+        score, hash_move = self.probe_tt(key, depth, alpha, beta, ply)
+        if score is not None:
+            return score
+
+        stats = self.stats
+        in_check = board.is_check()
+        frontier = ((self.use_futility and depth < len(FUTILITY_MARGINS))
+                    or (self.use_razoring and depth < len(RAZOR_MARGINS)))
+        try_null = (self.use_null_move and allow_null and depth >= NULL_MOVE_MIN_DEPTH and beta < MATE_THRESHOLD
+                    # Zugzwang guard: with only pawns left passing can be the best move
+                    and board.occupied_co[board.turn] & ~(board.pawns | board.kings))
+        static_eval = None
+        if not in_check and (frontier or try_null):
+            static_eval = self.evaluate_static(board, key)
+            if board.turn == chess.BLACK:
+                static_eval = -static_eval
+
+            # Razoring: so far below alpha near the leaves that only captures can help
+            if self.use_razoring and depth < len(RAZOR_MARGINS) and -MATE_THRESHOLD < alpha < MATE_THRESHOLD:
+                threshold = alpha - RAZOR_MARGINS[depth]
+                if static_eval <= threshold:
+                    score = self.quiescence_search(board, threshold, threshold + 1, ply=ply)
+                    if score <= threshold:
+                        if stats is not None:
+                            stats.razor_cutoffs += 1
+                        return score
+
+            # Null-move pruning: if passing still fails high, a real move would too
+            if try_null and static_eval >= beta:
+                reduction = NULL_MOVE_REDUCTION + (depth >= 6)
+                self.key_history.append(key)
+                self.make_move(board, chess.Move.null())
+                score = -self.negamax(board, depth - 1 - reduction, -beta, -beta + 1, ply + 1, allow_null=False)
+                self.unmake_move(board)
+                self.key_history.pop()
                 if score >= beta:
+                    if stats is not None:
+                        stats.null_move_cutoffs += 1
                     return beta
-                alpha = max(alpha, score)
-                
-            return alpha
 
-        def minimax(board, depth, alpha, beta, maximizing_player):
-            """Minimax with alpha-beta pruning and quiescence search."""
-            if depth == 0:
-                return quiescence_search(board, alpha, beta)
-                
-            if board.is_game_over():
-                if board.is_checkmate():
-                    return -20000 if maximizing_player else 20000
-                return 0
-            
-            if maximizing_player:
-                max_eval = float('-inf')
-                for move in self.order_moves(board):
-                    board.push(move)
-                    eval = minimax(board, depth - 1, alpha, beta, False)
-                    board.pop()
-                    max_eval = max(max_eval, eval)
-                    alpha = max(alpha, eval)
-                    if beta <= alpha:
-                        break
-                return max_eval
+        # Futility pruning: quiet moves cannot lift a position this far below alpha
+        futility_score = None
+        if (self.use_futility and depth < len(FUTILITY_MARGINS) and static_eval is not None
+                and -MATE_THRESHOLD < alpha < MATE_THRESHOLD and static_eval + FUTILITY_MARGINS[depth] <= alpha):
+            futility_score = static_eval + FUTILITY_MARGINS[depth]
+
+        alpha_orig = alpha
+        best_score = float('-inf')
+        best_move = None
+        self.key_history.append(key)
+        for index, move in enumerate(self.order_moves(board, hash_move, ply)):
+            quiet = not move.promotion and not board.is_capture(move)
+            if futility_score is not None and quiet and not board.gives_check(move):
+                best_score = max(best_score, futility_score)
+                if stats is not None:
+                    stats.futility_pruned += 1
+                continue
+
+            self.make_move(board, move)
+            if index == 0:
+                score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
             else:
-                min_eval = float('inf')
-                for move in self.order_moves(board):
-                    board.push(move)
-                    eval = minimax(board, depth - 1, alpha, beta, True)
-                    board.pop()
-                    min_eval = min(min_eval, eval)
-                    beta = min(beta, eval)
-                    if beta <= alpha:
-                        break
-                return min_eval
+                # Late quiet moves are searched shallower first (late move reductions)
+                reduction = 0
+                if (self.use_lmr and depth >= LMR_MIN_DEPTH and index >= LMR_MIN_MOVE and quiet
+                        and not in_check and not board.is_check()):
+                    reduction = min(1 if index < LMR_DEEP_MOVE else 2, depth - 2)
+                # With PVS, later moves only have to prove they are no better than alpha
+                bound = alpha + 1 if self.use_pvs else beta
+                score = -self.negamax(board, depth - 1 - reduction, -bound, -alpha, ply + 1)
+                if reduction:
+                    if stats is not None:
+                        stats.reductions += 1
+                    if score > alpha:
+                        if stats is not None:
+                            stats.re_searches += 1
+                        score = -self.negamax(board, depth - 1, -bound, -alpha, ply + 1)
+                if self.use_pvs and alpha < score < beta:
+                    if stats is not None:
+                        stats.re_searches += 1
+                    score = -self.negamax(board, depth - 1, -beta, -alpha, ply + 1)
+            self.unmake_move(board)
 
-        # Check opening book first
-        fen = board.fen()
-        if fen in self.opening_moves:
-            move_uci = random.choice(self.opening_moves[fen])
-            return chess.Move.from_uci(move_uci), 100
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    self.move_ordering.record_cutoff(board, move, depth, ply)
+                    if stats is not None:
+                        stats.record_cutoff(index)
+                    break
+        self.key_history.pop()
 
-        legal_moves = list(board.legal_moves)
-        if not legal_moves:
-            return None, 0
+        self.store_tt(key, depth, best_score, alpha_orig, beta, best_move, ply)
+        return best_score
+
+    def search_root(self, board, depth, pv_move=None, rng=None, alpha=float('-inf'), beta=float('inf')):
+        """Search the root position to a fixed depth, trying pv_move first.
+
+        Returns (best move, score from the side to move's perspective); a
+        score outside (alpha, beta) is only a bound. With ``rng`` the moves
+        after the first are searched in shuffled order, which Lazy SMP
+        helpers use to diverge from the main search.
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        moves = self.order_moves(board, pv_move)
+        if rng is not None:
+            moves = list(moves)
+            tail = moves[1:]
+            rng.shuffle(tail)
+            moves[1:] = tail
 
+        alpha_orig = alpha
         best_move = None
-        best_eval = float('-inf')
-        alpha = float('-inf')
-        beta = float('inf')
-        
-        # Search each move
-        for move in self.order_moves(board):
-            board.push(move)
-            eval = minimax(board, depth - 1, alpha, beta, False)
-            board.pop()
-            
-            if eval > best_eval:
-                best_eval = eval
+        best_score = float('-inf')
+        for index, move in enumerate(moves):
+            self.make_move(board, move)
+            if index == 0 or not self.use_pvs:
+                score = -self.negamax(board, depth - 1, -beta, -alpha)
+            else:
+                score = -self.negamax(board, depth - 1, -alpha - 1, -alpha)
+                if alpha < score < beta:
+                    score = -self.negamax(board, depth - 1, -beta, -alpha)
+            self.unmake_move(board)
+
+            if score > best_score:
+                best_score = score
                 best_move = move
-                
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+
+        self.store_tt(key, depth, best_score, alpha_orig, beta, best_move)
+        return best_move, best_score
+
+    def search_root_lines(self, board, depth, multipv, previous=()):
+        """Search the root for its ``multipv`` best moves, each with an exact score.
+
+        Returns [(move, score, pv)] best first, scores from the side to move's
+        perspective. The moves of ``previous`` (the last iteration's lines)
+        are searched first. Once ``multipv`` lines are known, every other
+        move only has to show that it is no better than the worst of them,
+        with a null window, so extra lines cost little more than one.
+        """
+        key = chess.polyglot.zobrist_hash(board)
+        first = [move for move, _, _ in previous]
+        moves = first + [move for move in self.order_moves(board, first[0] if first else None) if move not in first]
+
+        lines = []
+        for move in moves:
+            full = len(lines) < multipv
+            bound = None if full else lines[-1][1]
+            self.make_move(board, move)
+            if full:
+                score = -self.negamax(board, depth - 1, float('-inf'), float('inf'))
+            elif self.use_pvs:
+                score = -self.negamax(board, depth - 1, -bound - 1, -bound)
+                if score > bound:
+                    score = -self.negamax(board, depth - 1, float('-inf'), -bound)
+            else:
+                score = -self.negamax(board, depth - 1, float('-inf'), -bound)
+            self.unmake_move(board)
+
+            if full or score > bound:
+                lines.append((move, score, self.get_pv(board, move, depth)))
+                lines.sort(key=lambda line: line[1], reverse=True)
+                del lines[multipv:]
+
+        self.store_tt(key, depth, lines[0][1], float('-inf'), float('inf'), lines[0][0])
+        return lines
+
+    def aspiration_search(self, board, depth, pv_move, rng, previous):
+        """search_root in a narrow window around the previous iteration's score, widened until it holds."""
+        if (not self.use_aspiration or previous is None or depth < ASPIRATION_MIN_DEPTH
+                or abs(previous) >= MATE_THRESHOLD):
+            return self.search_root(board, depth, pv_move, rng)
+
+        delta = ASPIRATION_WINDOW
+        alpha, beta = previous - delta, previous + delta
+        while True:
+            move, score = self.search_root(board, depth, pv_move, rng, alpha, beta)
+            if alpha < score < beta:
+                return move, score
+            if self.stats is not None:
+                self.stats.re_searches += 1
+            delta *= 2
+            if delta > ASPIRATION_MAX_WINDOW:
+                alpha, beta = float('-inf'), float('inf')
+            elif score <= alpha:
+                alpha = score - delta
+            else:
+                beta = score + delta
+                pv_move = move
+
+    def get_best_move(self, board, depth=4, time_limit=None, threads=1, on_iteration=None,
+                      node_limit=None, use_book=True, multipv=1):
+        """
+        Find the best move using iterative deepening negamax with alpha-beta pruning.
+
+        Searches depth 1, 2, ... up to ``depth`` (or MAX_DEPTH when only a time
+        limit is given) and returns the result of the deepest completed
+        iteration. With ``time_limit`` in seconds the search stops starting new
+        iterations halfway through the budget and aborts at the deadline.
+        With ``threads`` > 1 on an engine built for several threads, Lazy SMP
+        helper processes search alongside.
+
+        ``on_iteration`` is called with a dict (depth, score, move, pv, nodes,
+        nps, time_ms) after every completed iteration. ``node_limit`` aborts
+        the search after that many nodes, and ``use_book=False`` searches
+        book positions too.
+
+        With ``multipv`` > 1 the search finds that many best moves, left in
+        ``lines`` as (move, score, pv) with white's scores; book moves and
+        tablebase results have a single line only and leave it None.
+        """
+        self.completed_depth = 0
+        self.nodes = 0
+        self.lines = None
+
+        # Check opening book first
+        book_move = self.book.probe(board) if use_book else None
+        if book_move is not None:
+            return book_move, 100
+
+        # Endgames covered by the tables need no search
+        if self.tablebase is not None:
+            result = self.tablebase.best_move(board)
+            if result is not None:
+                return result
+
+        if not any(board.legal_moves):
+            return None, 0
+
+        if threads > 1 and self.smp is not None:
+            return self.smp.search(self, board, depth, time_limit, threads, on_iteration, node_limit, multipv)
+        return self.iterative_deepening(board, depth, time_limit, on_iteration=on_iteration, node_limit=node_limit,
+                                        multipv=multipv)
+
+    def iterative_deepening(self, board, depth, time_limit, start_depth=1, rng=None, on_iteration=None,
+                            node_limit=None, multipv=1):
+        """Run the iterative deepening loop for get_best_move on this process."""
+        legal_moves = list(board.legal_moves)
+        if depth is None:
+            depth = MAX_DEPTH
+
+        self.tt.new_search()
+        self.move_ordering.new_search()
+        self.clock = SearchClock(time_limit)
+        self.nodes = 0
+        self.node_limit = node_limit
+        self.completed_depth = 0
+
+        # An aborted iteration leaves moves pushed, so search on a copy
+        search_board = board.copy()
+        _, _, game_keys = position_history(board)
+        entry = self.tt.probe(chess.polyglot.zobrist_hash(board))
+        best_move = entry.move if entry is not None and entry.move in legal_moves else None
+        best_eval = 0
+        score = None
+        lines = []
+        # Side to move's scores to white's
+        sign = 1 if board.turn == chess.WHITE else -1
+
+        # Material and piece-square totals are updated move by move from here
+        self.eval_state = EvalState(search_board, self.mg_tables, self.eg_tables)
+        try:
+            for current_depth in range(min(start_depth, depth), depth + 1):
+                # Keys of the positions played so far, which the search must not repeat
+                self.key_history = list(game_keys)
+                try:
+                    # The previous iteration's best moves are searched first
+                    if multipv > 1:
+                        lines = self.search_root_lines(search_board, current_depth, multipv, lines)
+                        best_move, score, _ = lines[0]
+                    else:
+                        best_move, score = self.aspiration_search(search_board, current_depth, best_move, rng, score)
+                except SearchTimeout:
+                    break
+                best_eval = sign * score
+                self.completed_depth = current_depth
+                if multipv > 1:
+                    self.lines = [(move, sign * line_score, pv) for move, line_score, pv in lines]
+                if self.stats is not None:
+                    self.stats.record_iteration(current_depth, self.nodes)
+                if on_iteration is not None:
+                    on_iteration(self.iteration_info(search_board, best_move, best_eval, self.lines))
+                if not self.clock.can_start_iteration():
+                    break
+        finally:
+            self.eval_state = None
+
+        if self.completed_depth == 0:
+            # Not even depth 1 finished, fall back to the best-ordered move
+            best_move = best_move or next(self.order_moves(board))
+            best_eval = self.evaluate_position(board)
+
         return best_move, best_eval
 
-    def order_moves(self, board):
-        """Order moves for better alpha-beta pruning efficiency."""
-        def move_value(move):
-            value = 0
-            
-            # Captures are searched first, ordered by MVV/LVA
-            if board.is_capture(move):
-                victim_square = move.to_square
-                victim = board.piece_at(victim_square)
-                attacker = board.piece_at(move.from_square)
-                if victim and attacker:
-                    value = 10 * self.piece_values[victim.piece_type] - self.piece_values[attacker.piece_type]
-            
-            # Promotions are also valuable
-            if move.promotion:
-                value += self.piece_values[move.promotion]
-            
-            # Check moves
-            if board.gives_check(move):
-                value += 300
-                
-            # Control of center in opening/middlegame
-            if board.fullmove_number <= 20:
-                to_file = chess.square_file(move.to_square)
-                to_rank = chess.square_rank(move.to_square)
-                if 2 <= to_file <= 5 and 2 <= to_rank <= 5:
-                    value += 50
-                    
-            return value
-            
-        moves = list(board.legal_moves)
-        moves.sort(key=move_value, reverse=True)
-        return moves
+    def get_pv(self, board, first_move, max_length):
+        """Principal variation: first_move followed by the hash moves stored in the table."""
+        board = board.copy(stack=False)
+        pv = [first_move]
+        board.push(first_move)
+        seen = {chess.polyglot.zobrist_hash(board)}
+        while len(pv) < max_length:
+            entry = self.tt.probe(chess.polyglot.zobrist_hash(board))
+            if entry is None or entry.move is None or not board.is_legal(entry.move):
+                break
+            pv.append(entry.move)
+            board.push(entry.move)
+            key = chess.polyglot.zobrist_hash(board)
+            if key in seen:
+                break
+            seen.add(key)
+        return pv
+
+    def iteration_info(self, board, best_move, score, lines=None):
+        """Progress report for the iteration that just completed, with its ``lines`` in multi-PV mode."""
+        elapsed = self.clock.elapsed()
+        info = {
+            'depth': self.completed_depth,
+            'score': score,
+            'move': best_move.uci(),
+            'pv': [move.uci() for move in self.get_pv(board, best_move, self.completed_depth)],
+            'nodes': self.nodes,
+            'nps': int(self.nodes / elapsed) if elapsed > 0 else 0,
+            'time_ms': int(elapsed * 1000),
+        }
+        if lines is not None:
+            info['lines'] = [{'move': move.uci(), 'score': line_score, 'pv': [pv_move.uci() for pv_move in pv]}
+                             for move, line_score, pv in lines]
+        return info
+
+    def close(self):
+        """Stop Lazy SMP helpers, release the shared transposition table and close the book and tables."""
+        self.book.close()
+        if self.tablebase is not None:
+            self.tablebase.close()
+        if self.smp is not None:
+            self.smp.close()
+            self.tt.close()
+            self.smp = None
+
+    def use_session(self, session_id):
+        """
+        Search with a game session's transposition table and move ordering,
+        or the engine's own ones for None.
+
+        A session's state stays with the engine between its searches, so
+        each search starts from what the previous one learnt about the same
+        game. Engines searching with Lazy SMP helpers keep their shared table.
+        """
+        if self.smp is not None:
+            return
+        if session_id is None:
+            self.tt, self.move_ordering = self.own_search_state
+        else:
+            self.tt, self.move_ordering = self.session_states.get(session_id)
+
+    def order_moves(self, board, hash_move=None, ply=0):
+        """Order moves for better alpha-beta pruning efficiency.
+
+        Returns a generator: hash move, MVV/LVA captures, killers, then quiet
+        moves by history, so moves after a cutoff are never generated.
+        """
+        return self.move_ordering.moves(board, hash_move, ply)
+
+def create_engine():
+    """Build the long-lived engine held by each worker process."""
+    return ImprovedChessEngine(hash_size_mb=HASH_SIZE_MB, threads=SEARCH_THREADS, book_path=BOOK_PATH,
+                               book_min_weight=BOOK_MIN_WEIGHT, book_max_ply=BOOK_MAX_PLY,
+                               tablebase_path=TABLEBASE_PATH, search_features=SEARCH_FEATURES,
+                               weights_path=EVAL_WEIGHTS_PATH)
+
+def run_analysis(engine, progress, fen, depth=None, time_limit=None, threads=1, stats=False, multipv=1,
+                 moves=(), session_id=None):
+    """Search a position on a worker's engine.
+
+    Returns (best move UCI, evaluation, completed depth, PV as UCI strings,
+    search statistics, lines); the depth is 0 for book moves. ``progress``
+    receives the per-depth info of the search as it runs. The statistics
+    are a dict (see SearchStats.as_dict) when ``stats`` is set, else None.
+    ``lines`` holds (move, evaluation, PV) for each of the ``multipv`` best
+    moves, best first; it has only the best move's line when no search ran.
+    The UCI ``moves`` are played from ``fen`` first, so the search knows
+    the positions they passed through. With ``session_id`` the search uses
+    that game session's transposition table and move ordering.
+    """
+    board = chess.Board(fen)
+    for move in moves:
+        board.push_uci(move)
+    # Each request picks the tables it searches with, the engine's own ones without a session
+    engine.use_session(session_id)
+    search_stats = SearchStats().attach(engine) if stats else None
+    try:
+        best_move, evaluation = engine.get_best_move(board, depth=depth, time_limit=time_limit,
+                                                     threads=threads, on_iteration=progress, multipv=multipv)
+    finally:
+        if search_stats is not None:
+            search_stats.detach(engine)
+            search_stats.nodes = engine.nodes
+            search_stats = search_stats.as_dict()
+    if best_move is None:
+        return None, evaluation, 0, [], search_stats, []
+    depth = engine.completed_depth
+    if engine.lines is not None:
+        lines = [(move.uci(), score, [pv_move.uci() for pv_move in pv]) for move, score, pv in engine.lines]
+        return lines[0][0], lines[0][1], depth, lines[0][2], search_stats, lines
+    pv = engine.get_pv(board, best_move, depth) if depth > 0 else [best_move]
+    pv = [move.uci() for move in pv]
+    return best_move.uci(), evaluation, depth, pv, search_stats, [(best_move.uci(), evaluation, pv)]
+
+def get_search_limits(data):
+    """Read the maximum depth and the time limit in seconds from a request body.
+
+    ``movetime_ms`` fixes the search time. Otherwise ``clock_ms`` (the side to
+    move's remaining time) with optional ``increment_ms`` and ``moves_to_go``
+    is turned into a budget. A request with only ``depth`` searches to that
+    depth without a time limit.
+    """
+    depth = data.get('depth')
+    depth = int(depth) if depth is not None else None
+
+    if data.get('movetime_ms') is not None:
+        time_limit = float(data['movetime_ms']) / 1000.0
+    elif data.get('clock_ms') is not None:
+        moves_to_go = data.get('moves_to_go')
+        time_limit = allocate_time(float(data['clock_ms']),
+                                   float(data.get('increment_ms', 0)),
+                                   int(moves_to_go) if moves_to_go else None)
+    elif depth is None:
+        time_limit = DEFAULT_MOVETIME_MS / 1000.0
+    else:
+        time_limit = None
+    return depth, time_limit
+
+def format_score(evaluation, player_color):
+    """Evaluation in pawns from the player's perspective, e.g. "+0.35"."""
+    if player_color == 'black':
+        evaluation = -evaluation
+    return f"{evaluation/100:+.2f}"
+
+def format_lines(lines, player_color):
+    """(move, evaluation, PV) lines as event data, scored from the player's perspective."""
+    return [{'move': move, 'score': format_score(evaluation, player_color), 'pv': pv} for move, evaluation, pv in lines]
+
+def format_event(event, data):
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+engine_pool = None
+coalescer = None
+ponderer = None
+engine_pool_lock = threading.Lock()
+
+def get_engine_pool():
+    """Start the engine worker pool on first use."""
+    global engine_pool, coalescer, ponderer
+    with engine_pool_lock:
+        if engine_pool is None:
+            logger.info(f"Starting {ENGINE_WORKERS} engine workers")
+            engine_pool = EnginePool(create_engine, run_analysis,
+                                     num_workers=ENGINE_WORKERS, timeout=ANALYSIS_TIMEOUT)
+            coalescer = RequestCoalescer(engine_pool, on_result=record_search)
+            ponderer = Ponderer(engine_pool, PONDER_MOVETIME_MS / 1000.0,
+                                on_result=finish_ponder, collect_stats=SEARCH_STATS)
+        return engine_pool
+
+def get_coalescer():
+    """Request coalescer in front of the engine pool."""
+    get_engine_pool()
+    return coalescer
+
+def get_ponderer():
+    """Background searcher of the sessions' expected next positions."""
+    get_engine_pool()
+    return ponderer
+
+def close_game_session(session_id):
+    """Forget the worker and the ponder search of a game session that was deleted or evicted."""
+    if engine_pool is not None:
+        engine_pool.forget(session_id)
+        ponderer.forget(session_id)
+
+game_sessions = SessionStore(MAX_SESSIONS, SESSION_IDLE_SECONDS, on_close=close_game_session)
+
+def search_position(board):
+    """
+    What a search of ``board`` is sent: (FEN, UCI moves, result key).
+
+    The search starts at the last capture or pawn move on the board's move
+    stack and replays the moves since, so that it knows the positions the
+    game can still repeat. The result key is the normalized FEN, or None
+    once a position has repeated since then: the result depends on the game
+    and not just the position, so it is neither cached nor shared.
+    """
+    fen, moves, keys = position_history(board)
+    key = normalize_fen(board) if len(set(keys)) == len(keys) else None
+    return fen, moves, key
+
+def start_pondering(session_id, board, pv, game_id=None):
+    """Ponder on the position after the answer and its predicted reply, for a session."""
+    if session_id is None or PONDER_MOVETIME_MS <= 0 or len(pv) < 2:
+        return
+    expected = board.copy()
+    try:
+        for uci in pv[:2]:
+            expected.push_uci(uci)
+    except ValueError:
+        return
+    if expected.is_game_over():
+        return
+    fen, moves, key = search_position(expected)
+    if key is not None:
+        get_ponderer().start(session_id, key, fen, moves, game_id)
+
+def finish_ponder(fen, key, result):
+    """Keep a finished ponder search for when its position is asked for."""
+    cache_result(key, result)
+    record_search(result)
+
+def follow_ponder(ponder, depth, time_limit, timeout):
+    """Result of a ponder hit under a request's limits, or None; stops the ponder search."""
+    result = None
+    try:
+        for kind, value in ponder.follow(depth, time_limit, timeout):
+            if kind == 'result':
+                result = value
+    finally:
+        get_ponderer().stop(ponder)
+    return result
+
+analysis_cache = None
+
+def get_analysis_cache():
+    """Open the result cache on first use."""
+    global analysis_cache
+    with engine_pool_lock:
+        if analysis_cache is None:
+            # Results searched with other weights, tables or search settings are dropped
+            settings = {'search_features': sorted(SEARCH_FEATURES), 'book_min_weight': BOOK_MIN_WEIGHT,
+                        'book_max_ply': BOOK_MAX_PLY}
+            analysis_cache = AnalysisCache(ANALYSIS_CACHE_PATH or None,
+                                           memory_entries=ANALYSIS_CACHE_ENTRIES,
+                                           disk_entries=ANALYSIS_CACHE_DISK_ENTRIES,
+                                           fingerprint=fingerprint(settings, (EVAL_WEIGHTS_PATH, BOOK_PATH,
+                                                                              TABLEBASE_PATH)))
+        return analysis_cache
+
+def cache_result(key, result):
+    """Store a finished search in the result cache; book moves, game ends and results without a key are skipped."""
+    best_move, evaluation, depth, pv, _, lines = result
+    if key is not None and best_move is not None and depth > 0:
+        get_analysis_cache().put(key, CacheEntry(depth, evaluation, best_move, pv, lines))
+
+def get_cached(key, board, depth, multipv):
+    """Cached result deep enough for a request and holding its ``multipv`` lines, else None."""
+    if key is None:
+        return None
+    entry = get_analysis_cache().get(key, depth if depth is not None else CACHE_MIN_DEPTH)
+    if entry is None or multipv == 1:
+        return entry
+    wanted = min(multipv, board.legal_moves.count())
+    return entry if entry.moves is not None and len(entry.moves) >= wanted else None
+
+def entry_lines(entry):
+    """The (move, evaluation, PV) lines of a cache entry; older entries only have the best one."""
+    return entry.moves or [(entry.best_move, entry.score, entry.pv)]
+
+def get_multipv(data):
+    """Number of principal variations a request asks for, at most MAX_MULTIPV."""
+    return max(1, min(int(data.get('multipv', 1)), MAX_MULTIPV))
+
+metrics = Registry()
+request_latency = metrics.histogram(
+    'chess_http_request_duration_seconds',
+    "Time to answer HTTP requests; the whole stream for /analyze/stream", ('endpoint', 'status'))
+searches_total = metrics.counter('chess_searches_total', "Searches that reported statistics")
+search_counters = {
+    name: metrics.counter(f'chess_search_{name}_total', documentation)
+    for name, documentation in (
+        ('nodes', "Nodes searched, including quiescence nodes"),
+        ('qnodes', "Quiescence search nodes"),
+        ('tt_probes', "Transposition table probes"),
+        ('tt_hits', "Transposition table probes that found an entry"),
+        ('cutoffs', "Beta cutoffs in the main search"),
+        ('first_move_cutoffs', "Beta cutoffs caused by the first move searched"),
+        ('null_move_cutoffs', "Nodes cut off by null-move pruning"),
+        ('razor_cutoffs', "Nodes cut off by razoring"),
+        ('futility_pruned', "Quiet moves skipped by futility pruning"),
+        ('reductions', "Moves searched with a late move reduction"),
+        ('re_searches', "Reduced, null-window or aspiration searches repeated after failing"),
+        ('pawn_hash_probes', "Pawn hash table probes"),
+        ('pawn_hash_hits', "Pawn hash table probes that found the pawn structure"),
+        ('eval_cache_probes', "Evaluation cache probes"),
+        ('eval_cache_hits', "Evaluation cache probes that found the evaluation"),
+    )
+}
+search_depth = metrics.histogram('chess_search_depth', "Deepest completed iteration per search",
+                                 buckets=(1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20, 32))
+search_branching = metrics.histogram('chess_search_branching_factor',
+                                     "Nodes of the last iteration over those of the one before",
+                                     buckets=(1.5, 2, 3, 4, 6, 8, 12, 16, 24, 32))
+eval_seconds = metrics.counter('chess_eval_seconds_total',
+                               "Time spent in each evaluation term (terms include the ones they call)", ('term',))
+eval_calls = metrics.counter('chess_eval_calls_total', "Calls of each evaluation term", ('term',))
+
+def pool_stat(name):
+    """Scrape-time reader of one engine pool counter (nothing before the pool starts)."""
+    return lambda: engine_pool.stats()[name] if engine_pool is not None else None
+
+metrics.gauge('chess_engine_workers', "Engine worker processes", callback=pool_stat('workers'))
+metrics.gauge('chess_engine_workers_busy', "Engine workers running a request", callback=pool_stat('busy'))
+metrics.gauge('chess_engine_queue_depth', "Requests waiting for an engine worker", callback=pool_stat('waiting'))
+metrics.counter('chess_engine_busy_seconds_total',
+                "Seconds engine workers have spent on requests; its rate over the worker count is utilization",
+                callback=pool_stat('busy_seconds'))
+metrics.counter('chess_coalescer_searches_total', "Searches started by the request coalescer",
+                callback=lambda: coalescer.searches if coalescer is not None else None)
+metrics.counter('chess_coalescer_coalesced_total', "Requests that joined a search already running",
+                callback=lambda: coalescer.coalesced if coalescer is not None else None)
+metrics.counter('chess_coalescer_cancelled_total', "Searches stopped because nobody waited for them",
+                callback=lambda: coalescer.cancelled if coalescer is not None else None)
+metrics.gauge('chess_game_sessions', "Game sessions kept by the server", callback=lambda: len(game_sessions))
+metrics.counter('chess_game_sessions_created_total', "Game sessions created",
+                callback=lambda: game_sessions.created)
+metrics.counter('chess_game_sessions_evicted_total', "Game sessions evicted for being idle or over MAX_SESSIONS",
+                callback=lambda: game_sessions.evicted)
+metrics.counter('chess_ponder_searches_total', "Ponder searches started on a session's expected position",
+                callback=lambda: ponderer.started if ponderer is not None else None)
+metrics.counter('chess_ponder_hits_total', "Requests for the position being pondered on",
+                callback=lambda: ponderer.hits if ponderer is not None else None)
+metrics.counter('chess_ponder_misses_total', "Ponder searches stopped because another position was asked for",
+                callback=lambda: ponderer.misses if ponderer is not None else None)
+
+def cache_stats(*names):
+    """Scrape-time reader of result cache counters, labelled by tier."""
+    def read():
+        if analysis_cache is None:
+            return None
+        stats = analysis_cache.stats()
+        return {(tier,): stats[name] for tier, name in names}
+    return read
+
+metrics.counter('chess_analysis_cache_hits_total', "Result cache hits", ('tier',),
+                callback=cache_stats(('memory', 'memory_hits'), ('disk', 'disk_hits')))
+metrics.counter('chess_analysis_cache_misses_total', "Result cache misses",
+                callback=lambda: analysis_cache.stats()['misses'] if analysis_cache is not None else None)
+metrics.gauge('chess_analysis_cache_entries', "Results held by the cache", ('tier',),
+              callback=cache_stats(('memory', 'memory_entries'), ('disk', 'disk_entries')))
+
+def record_search(result):
+    """Add the statistics of a finished search (if it collected any) to the metrics."""
+    stats = result[4]
+    if stats is None:
+        return
+    searches_total.inc()
+    for name, counter in search_counters.items():
+        counter.inc(stats[name])
+    search_depth.observe(stats['depth'])
+    if stats['branching_factor'] is not None:
+        search_branching.observe(stats['branching_factor'])
+    for term in EVAL_TERMS:
+        eval_seconds.inc(stats['eval_ms'][term] / 1000, term=term)
+        eval_calls.inc(stats['eval_calls'][term], term=term)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.monotonic()
+
+@app.after_request
+def record_latency(response):
+    # Streams are timed when they end, in analyze_stream
+    if not response.is_streamed and 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.monotonic() - g.request_start, endpoint=endpoint,
+                                status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Server and search metrics in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 # Add root route to show server status
 @app.route('/')
 def index():
     return "Chess Analysis Server is running! Version 1.0"
 
-@app.route('/analyze', methods=['POST'])
-def analyze():
+def analyze_request(data, deadline=None, game_session=None):
+    """
+    Answer an /analyze request body; returns the response body and status.
+
+    ``deadline`` (a time.monotonic() value) caps the time the request may
+    still take, searching included. With ``game_session`` the session's
+    current position is analyzed instead of the body's ``fen``.
+    """
     try:
-        data = request.get_json()
-        fen = data.get('fen')
         player_color = data.get('player_color', 'white')
-        
-        logger.info(f"Received analysis request - FEN: {fen}, Player Color: {player_color}")
-        
-        if not fen:
-            return jsonify({'error': 'No FEN position provided'}), 400
+        if game_session is None:
+            fen = data.get('fen')
+            logger.info(f"Received analysis request - FEN: {fen}, Player Color: {player_color}")
 
-        # Create a board from the FEN
-        board = chess.Board(fen)
-        
-        # Initialize our custom engine
-        engine = ImprovedChessEngine()
-        
-        # Get the best move
-        best_move, evaluation = engine.get_best_move(board)
+            if not fen:
+                return {'error': 'No FEN position provided'}, 400
+
+            # Create a board from the FEN
+            board = chess.Board(fen)
+            session_id = data.get('session_id')
+            game_id = None
+        else:
+            board = game_session.snapshot()
+            session_id = game_id = game_session.id
+            logger.info(f"Received analysis request - session: {game_id}, FEN: {board.fen()}, "
+                        f"Player Color: {player_color}")
+
+        depth, time_limit = get_search_limits(data)
+        timeout = ANALYSIS_TIMEOUT if time_limit is None else time_limit + ANALYSIS_TIMEOUT_GRACE
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise TimeoutError("Request deadline passed before the search started")
+        threads = max(1, min(int(data.get('threads', SEARCH_THREADS)), SEARCH_THREADS))
+        multipv = get_multipv(data)
+        want_stats = bool(data.get('stats'))
+        collect_stats = want_stats or SEARCH_STATS
+
+        search_fen, moves, key = search_position(board)
+        # A ponder search on another position is stopped here
+        ponder = get_ponderer().take(session_id, key) if session_id is not None else None
+        if ponder is not None and multipv > 1:
+            # Ponder searches only follow the best line
+            get_ponderer().stop(ponder)
+            ponder = None
+
+        # Answer from the cache when it holds a deep enough result
+        entry = get_cached(key, board, depth, multipv)
+        if entry is not None:
+            if ponder is not None:
+                get_ponderer().stop(ponder)
+            lines = entry_lines(entry)
+            stats = {'cached': True}
+        else:
+            result = None
+            if ponder is not None:
+                # Ponder hit: continue the search already running for this position
+                result = follow_ponder(ponder, depth, time_limit, timeout)
+                if result is not None:
+                    cache_result(key, result)
+                    stats = dict(result[4] or {}, ponder_hit=True)
+            if result is None:
+                # Search on one of the warm engine workers, shared with identical requests
+                get_ponderer().make_room()
+                flight_key = (key or (search_fen, moves), depth, time_limit, threads, collect_stats, multipv)
+                result = get_coalescer().run(flight_key,
+                                             (search_fen, depth, time_limit, threads, collect_stats, multipv,
+                                              moves, game_id),
+                                             timeout, session_id=session_id, affinity=game_id)
+                cache_result(key, result)
+                stats = result[4]
+            lines = result[5]
+        if lines:
+            start_pondering(session_id, board, lines[0][2], game_id)
         
-        if best_move:
-            # Convert evaluation to be from the player's perspective
-            if player_color == 'black':
-                evaluation = -evaluation
-                
-            # Format the evaluation as a string
-            eval_str = f"{evaluation/100:+.2f}"
+        if lines:
+            # Evaluations from the player's perspective, as strings
+            best_move, evaluation, _ = lines[0]
+            eval_str = format_score(evaluation, player_color)
             
-            logger.info(f"Analysis complete - Best move: {best_move.uci()}, Evaluation: {eval_str}")
+            logger.info(f"Analysis complete - Best move: {best_move}, Evaluation: {eval_str}")
             
-            return jsonify({
-                'moves': [{
-                    'uci': best_move.uci(),
-                    'score': eval_str
-                }]
-            })
+            response = {'moves': []}
+            for move, evaluation, pv in lines[:multipv]:
+                line = {'uci': move, 'score': format_score(evaluation, player_color)}
+                if multipv > 1:
+                    line['pv'] = pv
+                response['moves'].append(line)
         else:
             logger.warning("No legal moves found")
-            return jsonify({'moves': []})
+            response = {'moves': []}
+        if want_stats:
+            response['stats'] = stats
+        return response, 200
             
+    except SearchCancelled as e:
+        logger.info(f"Analysis cancelled: {e}")
+        return {'error': str(e)}, 409
+    except TimeoutError as e:
+        logger.error(f"Analysis timed out: {e}")
+        return {'error': str(e)}, 504
     except Exception as e:
         logger.error(f"Error analyzing position: {e}")
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    response, status = analyze_request(request.get_json())
+    return jsonify(response), status
+
+@app.route('/analyze/stream', methods=['GET'])
+def analyze_stream():
+    """
+    Stream an analysis as Server-Sent Events.
+
+    Sends an ``info`` event after every completed depth (depth, score, move,
+    pv, nodes, nps, time_ms) and ends with a ``bestmove`` event. Takes the
+    same parameters as /analyze as query arguments; without any limit the
+    search runs until the client disconnects or ANALYSIS_TIMEOUT passes.
+    Disconnecting stops the search, and so does a newer request with the
+    same ``session_id`` (the stream then ends with a ``cancelled`` event).
+    With ``stats=1`` the ``bestmove`` event carries the search statistics.
+    With ``multipv`` > 1 both events also carry ``lines``, the best moves
+    each with its score and PV. When a ``session_id``'s position was pondered on, the stream follows
+    that search instead of starting a new one.
+    """
+    return stream_analysis(request.args)
+
+def stream_analysis(args, game_session=None):
+    """
+    Response streaming the analysis asked for by query ``args``, of the
+    ``fen`` they give or of a game session's current position.
+    """
+    fen = args.get('fen')
+    player_color = args.get('player_color', 'white')
+    if game_session is None and not fen:
+        return jsonify({'error': 'No FEN position provided'}), 400
+
+    try:
+        board = chess.Board(fen) if game_session is None else game_session.snapshot()
+        limits = ('depth', 'movetime_ms', 'clock_ms')
+        limited = any(args.get(name) is not None for name in limits)
+        if limited:
+            depth, time_limit = get_search_limits(args)
+        else:
+            depth, time_limit = None, float(ANALYSIS_TIMEOUT)
+        threads = max(1, min(int(args.get('threads', SEARCH_THREADS)), SEARCH_THREADS))
+        multipv = get_multipv(args)
+        want_stats = args.get('stats', '0') not in ('0', 'false', '')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    timeout = ANALYSIS_TIMEOUT if time_limit is None else time_limit + ANALYSIS_TIMEOUT_GRACE
+    if game_session is None:
+        session_id, game_id = args.get('session_id'), None
+        logger.info(f"Received streaming analysis request - FEN: {fen}, Player Color: {player_color}")
+    else:
+        session_id = game_id = game_session.id
+        logger.info(f"Received streaming analysis request - session: {game_id}, FEN: {board.fen()}, "
+                    f"Player Color: {player_color}")
+
+    endpoint = request.url_rule.rule
+    search_fen, moves, key = search_position(board)
+    ponder = get_ponderer().take(session_id, key) if session_id is not None else None
+    if ponder is not None and multipv > 1:
+        get_ponderer().stop(ponder)
+        ponder = None
+
+    # A limited search can be answered from the cache; open-ended analysis always runs
+    entry = None
+    if limited:
+        entry = get_cached(key, board, depth, multipv)
+    if entry is not None:
+        if ponder is not None:
+            get_ponderer().stop(ponder)
+        start_pondering(session_id, board, entry.pv, game_id)
+        score = format_score(entry.score, player_color)
+        info = {'depth': entry.depth, 'score': score, 'move': entry.best_move, 'pv': entry.pv, 'cached': True}
+        final = {'move': entry.best_move, 'score': score, 'depth': entry.depth, 'pv': entry.pv}
+        if multipv > 1:
+            info['lines'] = final['lines'] = format_lines(entry_lines(entry)[:multipv], player_color)
+        if want_stats:
+            final['stats'] = {'cached': True}
+        return Response(format_event('info', info) + format_event('bestmove', final),
+                        mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    ponder_hit = False
+
+    def search():
+        nonlocal ponder_hit
+        if ponder is not None:
+            # Ponder hit: report the search already running for this position
+            try:
+                for kind, value in ponder.follow(depth, time_limit, timeout):
+                    if kind == 'result':
+                        ponder_hit = True
+                    yield kind, value
+                    if ponder_hit:
+                        return
+            finally:
+                get_ponderer().stop(ponder)
+        # Closing this generator closes the pool stream too, which cancels the search
+        get_ponderer().make_room()
+        yield from get_engine_pool().stream(search_fen, depth, time_limit, threads, want_stats or SEARCH_STATS,
+                                            multipv, moves, game_id, timeout=timeout,
+                                            heartbeat=CANCEL_POLL_INTERVAL, affinity=game_id)
+
+    def events():
+        waiter = get_coalescer().open_session(session_id)
+        stream = search()
+        result = None
+        started = last_sent = time.monotonic()
+        try:
+            for kind, value in stream:
+                if waiter.cancelled:
+                    yield format_event('cancelled', {'error': 'Superseded by a newer request'})
+                    break
+                if kind == 'heartbeat':
+                    if time.monotonic() - last_sent < STREAM_HEARTBEAT:
+                        continue
+                    # Comment line, lets the server notice a disconnected client
+                    message = ": keep-alive\n\n"
+                elif kind == 'progress':
+                    info = dict(value, score=format_score(value['score'], player_color))
+                    if 'lines' in value:
+                        info['lines'] = [dict(line, score=format_score(line['score'], player_color))
+                                         for line in value['lines']]
+                    message = format_event('info', info)
+                else:
+                    result = value
+                    cache_result(key, value)
+                    best_move, evaluation, searched_depth, pv, stats, lines = value
+                    if ponder_hit:
+                        # A ponder search's statistics were recorded when it finished
+                        stats = dict(stats or {}, ponder_hit=True)
+                    else:
+                        record_search(value)
+                    final = {
+                        'move': best_move,
+                        'score': format_score(evaluation, player_color) if best_move else None,
+                        'depth': searched_depth,
+                        'pv': pv,
+                    }
+                    if multipv > 1:
+                        final['lines'] = format_lines(lines, player_color)
+                    if want_stats:
+                        final['stats'] = stats
+                    message = format_event('bestmove', final)
+                last_sent = time.monotonic()
+                yield message
+        except Exception as e:
+            logger.error(f"Error streaming analysis: {e}")
+            yield format_event('error', {'error': str(e)})
+        finally:
+            # Runs when the client disconnects too, which cancels the search
+            stream.close()
+            get_coalescer().close_session(session_id, waiter)
+            if result is not None:
+                start_pondering(session_id, board, result[3], game_id)
+            request_latency.observe(time.monotonic() - started, endpoint=endpoint, status=200)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def session_info(game_session, board, moves=False):
+    """A game session's id, position and number of half-moves played, with the moves themselves if asked for."""
+    info = {'session_id': game_session.id, 'fen': board.fen(), 'ply': len(board.move_stack)}
+    if moves:
+        info['moves'] = [move.uci() for move in board.move_stack]
+    return info
+
+def unknown_session():
+    return jsonify({'error': 'Unknown or expired session'}), 404
+
+@app.route('/sessions', methods=['POST'])
+def create_session():
+    """
+    Start a game session.
+
+    The JSON body may give the starting ``fen`` (the standard starting
+    position by default) and UCI ``moves`` already played from it. Answers
+    201 with the session's ``session_id``, ``fen`` and ``ply``. Sessions
+    unused for SESSION_IDLE_SECONDS, and the least recently used ones
+    beyond MAX_SESSIONS, are evicted; their requests then get 404.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        board = chess.Board(data.get('fen') or chess.STARTING_FEN)
+        for uci in data.get('moves', []):
+            board.push_uci(uci)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    game_session = game_sessions.create(board)
+    return jsonify(session_info(game_session, board)), 201
+
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """A game session's position and every move played in it."""
+    game_session = game_sessions.get(session_id)
+    if game_session is None:
+        return unknown_session()
+    return jsonify(session_info(game_session, game_session.snapshot(), moves=True))
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """End a game session."""
+    if not game_sessions.delete(session_id):
+        return unknown_session()
+    return '', 204
+
+@app.route('/sessions/<session_id>/moves', methods=['POST'])
+def push_session_moves(session_id):
+    """
+    Play moves in a game session.
+
+    The JSON body holds the UCI ``moves`` to play, after taking back
+    ``undo`` moves first (0 by default) when the game went another way.
+    Nothing is played if any move is illegal (400).
+    """
+    game_session = game_sessions.get(session_id)
+    if game_session is None:
+        return unknown_session()
+    data = request.get_json(silent=True) or {}
+    moves = data.get('moves', [])
+    if not isinstance(moves, list):
+        return jsonify({'error': 'moves must be a list of UCI moves'}), 400
+    try:
+        board = game_session.play(moves, int(data.get('undo', 0)))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(session_info(game_session, board))
+
+@app.route('/sessions/<session_id>/analyze', methods=['POST'])
+def analyze_session(session_id):
+    """Analyze a game session's current position; takes the /analyze body without ``fen``."""
+    game_session = game_sessions.get(session_id)
+    if game_session is None:
+        return unknown_session()
+    response, status = analyze_request(request.get_json(silent=True) or {}, game_session=game_session)
+    return jsonify(response), status
+
+@app.route('/sessions/<session_id>/analyze/stream', methods=['GET'])
+def analyze_session_stream(session_id):
+    """Stream the analysis of a game session's current position, like /analyze/stream without ``fen``."""
+    game_session = game_sessions.get(session_id)
+    if game_session is None:
+        return unknown_session()
+    return stream_analysis(request.args, game_session)
 
 if __name__ == '__main__':
-    app.run(port=5001) 
\ No newline at end of file
+    get_engine_pool()
+    app.run(port=5001)
@@ -0,0 +1,272 @@
+"""
+Asynchronous (ASGI) front end for the analysis server.
+
+Serves the same /analyze contract as the Flask app, plus / and /metrics,
+for use under an ASGI server at peak traffic:
+
+    uvicorn asgi_server:app --port 5001
+    python asgi_server.py
+
+Searches still run on the warm engine worker processes of app.py; the
+blocking wait for each one happens on a thread, so the event loop stays
+free to answer other requests. At most ASGI_MAX_SEARCHES requests are
+searched at a time, and at most ASGI_QUEUE_SIZE more wait for a turn.
+Beyond that a request is turned away at once with 429 and a Retry-After
+estimate instead of queueing without bound, and while the server drains
+for shutdown new requests get 503. Each request must finish within its
+deadline (the ``deadline_ms`` body field, else ANALYSIS_TIMEOUT), time
+spent queueing included.
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import time
+
+import app as server
+
+logger = logging.getLogger(__name__)
+
+# Requests searched at the same time (default: one per engine worker)
+ASGI_MAX_SEARCHES = int(os.environ.get('ASGI_MAX_SEARCHES', server.ENGINE_WORKERS))
+
+# Requests that may wait for a turn before new ones are turned away with 429
+ASGI_QUEUE_SIZE = int(os.environ.get('ASGI_QUEUE_SIZE', 4 * ASGI_MAX_SEARCHES))
+
+# Longest wait for in-flight requests when the server shuts down
+ASGI_DRAIN_TIMEOUT = float(os.environ.get('ASGI_DRAIN_TIMEOUT', 30))
+
+# Largest accepted request body
+MAX_BODY_BYTES = 64 * 1024
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+
+
+class Rejected(Exception):
+    """A request turned away before searching, with its status and Retry-After seconds."""
+
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionQueue:
+    """
+    Bounded admission to the search slots.
+
+    ``max_running`` requests hold a slot at a time and at most
+    ``max_waiting`` wait for one, in arrival order. Retry-After hints are
+    the expected time for the requests ahead to finish, from a moving
+    average of how long slots are held.
+    """
+
+    def __init__(self, max_running, max_waiting):
+        self.max_running = max_running
+        self.max_waiting = max_waiting
+        self.running = 0
+        self.waiting = 0
+        self.draining = False
+        self.service_time = 1.0
+        self.rejected = {429: 0, 503: 0}
+        self._slots = asyncio.Semaphore(max_running)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def retry_after(self):
+        """Whole seconds until a request arriving now would probably get a slot."""
+        ahead = self.running + self.waiting + 1
+        return max(1, math.ceil(self.service_time * ahead / self.max_running))
+
+    def _reject(self, status, message):
+        self.rejected[status] += 1
+        return Rejected(status, message, self.retry_after())
+
+    async def acquire(self, deadline):
+        """Wait for a slot until ``deadline`` (a loop.time() value); raises Rejected."""
+        if self.draining:
+            raise self._reject(503, "Server is shutting down")
+        if self.running + self.waiting >= self.max_running + self.max_waiting:
+            raise self._reject(429, "Too many requests queued")
+        self.waiting += 1
+        self._idle.clear()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), deadline - asyncio.get_running_loop().time())
+        except asyncio.TimeoutError:
+            raise self._reject(503, "Request deadline passed while queued")
+        finally:
+            self.waiting -= 1
+            self._check_idle()
+        self.running += 1
+        self._idle.clear()
+        return time.monotonic()
+
+    def release(self, acquired):
+        """Give back a slot taken at ``acquired`` (the value acquire returned)."""
+        self.running -= 1
+        self._slots.release()
+        self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - acquired)
+        self._check_idle()
+
+    def _check_idle(self):
+        if not self.running and not self.waiting:
+            self._idle.set()
+
+    async def drain(self, timeout):
+        """Turn new requests away and wait for the admitted ones; False if they outlast ``timeout``."""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class AnalysisApp:
+    """ASGI application; the queue and thread pool are created at startup, on the serving loop."""
+
+    def __init__(self, max_searches=ASGI_MAX_SEARCHES, queue_size=ASGI_QUEUE_SIZE,
+                 drain_timeout=ASGI_DRAIN_TIMEOUT):
+        self.max_searches = max_searches
+        self.queue_size = queue_size
+        self.drain_timeout = drain_timeout
+        self.admission = None
+        self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def startup(self):
+        if self.admission is None:
+            self.admission = AdmissionQueue(self.max_searches, self.queue_size)
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.max_searches,
+                                                                  thread_name_prefix="asgi-search")
+            # Start the engine workers before the first request rather than during it
+            await asyncio.get_running_loop().run_in_executor(self.executor, server.get_engine_pool)
+
+    async def shutdown(self):
+        if self.admission is None:
+            return
+        logger.info("Draining in-flight analysis requests")
+        if not await self.admission.drain(self.drain_timeout):
+            logger.warning(f"Requests still running after {self.drain_timeout:.0f}s; shutting down anyway")
+        self.executor.shutdown(wait=False)
+        if server.engine_pool is not None:
+            server.engine_pool.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        started = time.monotonic()
+        method, path = scope['method'], scope['path']
+        if method == 'OPTIONS':
+            status = await respond(send, 204, b'')
+        elif path == '/analyze' and method == 'POST':
+            status = await self.analyze(receive, send)
+        elif path == '/' and method == 'GET':
+            status = await respond(send, 200, server.index().encode(), 'text/html; charset=utf-8')
+        elif path == '/metrics' and method == 'GET':
+            status = await respond(send, 200, server.metrics.render().encode(),
+                                   'text/plain; version=0.0.4; charset=utf-8')
+        else:
+            status = await respond_json(send, 404, {'error': 'Not found'})
+            path = 'unmatched'
+        server.request_latency.observe(time.monotonic() - started, endpoint=path, status=status)
+
+    async def analyze(self, receive, send):
+        # Lifespan-less servers get their queue on the first request
+        await self.startup()
+        loop = asyncio.get_running_loop()
+        arrived = loop.time()
+        try:
+            data = json.loads(await read_body(receive))
+            if not isinstance(data, dict):
+                raise ValueError("Request body must be a JSON object")
+            budget = float(data['deadline_ms']) / 1000.0 if data.get('deadline_ms') is not None \
+                else server.ANALYSIS_TIMEOUT
+        except (ValueError, TypeError) as e:
+            return await respond_json(send, 400, {'error': str(e)})
+
+        try:
+            acquired = await self.admission.acquire(arrived + budget)
+        except Rejected as e:
+            logger.warning(f"Rejected analysis request: {e}")
+            return await respond_json(send, e.status, {'error': str(e)},
+                                      [(b'retry-after', str(e.retry_after).encode())])
+        try:
+            deadline = time.monotonic() + (arrived + budget - loop.time())
+            response, status = await loop.run_in_executor(self.executor, server.analyze_request,
+                                                          data, deadline)
+        finally:
+            self.admission.release(acquired)
+        return await respond_json(send, status, response)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ValueError("Client disconnected")
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        if not message.get('more_body'):
+            return body
+
+
+async def respond(send, status, body, content_type=None, headers=()):
+    """Send a whole response; returns its status."""
+    all_headers = list(CORS_HEADERS) + list(headers)
+    if content_type is not None:
+        all_headers.append((b'content-type', content_type.encode()))
+    all_headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': all_headers})
+    await send({'type': 'http.response.body', 'body': body})
+    return status
+
+
+async def respond_json(send, status, data, headers=()):
+    return await respond(send, status, json.dumps(data).encode(), 'application/json', headers)
+
+
+app = AnalysisApp()
+
+server.metrics.gauge('chess_asgi_requests_running', "Analysis requests holding a search slot",
+                     callback=lambda: app.admission.running if app.admission is not None else None)
+server.metrics.gauge('chess_asgi_requests_queued', "Analysis requests waiting for a search slot",
+                     callback=lambda: app.admission.waiting if app.admission is not None else None)
+server.metrics.counter('chess_asgi_requests_rejected_total', "Analysis requests turned away before searching",
+                       ('status',), callback=lambda: {(status,): count for status, count
+                                                      in app.admission.rejected.items()}
+                       if app.admission is not None else None)
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("The ASGI server needs uvicorn: pip install uvicorn")
+    uvicorn.run(app, host='127.0.0.1', port=5001, lifespan='on',
+                timeout_graceful_shutdown=int(ASGI_DRAIN_TIMEOUT))
@@ -0,0 +1,68 @@
+import chess
+
+# The four central squares
+CENTER_MASK = chess.BB_D4 | chess.BB_E4 | chess.BB_D5 | chess.BB_E5
+
+
+def _king_zone(square):
+    """Squares within two files and two ranks of the given square."""
+    file, rank = chess.square_file(square), chess.square_rank(square)
+    mask = 0
+    for s in chess.SQUARES:
+        if abs(chess.square_file(s) - file) <= 2 and abs(chess.square_rank(s) - rank) <= 2:
+            mask |= chess.BB_SQUARES[s]
+    return mask
+
+
+def _shield_squares(color, square):
+    """Pawn shield squares in front of a king, as a list of masks.
+
+    On the a- and h-files the king's own file is listed twice, matching
+    how the shield has always been scored.
+    """
+    file, rank = chess.square_file(square), chess.square_rank(square)
+    pawn_rank = rank + (1 if color == chess.WHITE else -1)
+    if not 0 <= pawn_rank <= 7:
+        return []
+    return [chess.BB_SQUARES[chess.square(f, pawn_rank)]
+            for f in [max(0, file - 1), file, min(7, file + 1)]]
+
+
+KING_ZONE_MASKS = [_king_zone(square) for square in chess.SQUARES]
+SHIELD_SQUARES = {color: [_shield_squares(color, square) for square in chess.SQUARES]
+                  for color in chess.COLORS}
+
+
+class AttackMap:
+    """
+    Attack information for both sides of one position.
+
+    Built once per evaluated node from the python-chess bitboards, so the
+    evaluation terms can share it instead of querying ``board.attackers``
+    square by square.
+    """
+
+    __slots__ = ('pieces', 'by_type', 'all')
+
+    def __init__(self, board):
+        # Per color: list of (square, piece type, attacked squares)
+        self.pieces = ([], [])
+        # Per color and piece type: union of the squares they attack
+        self.by_type = ([0] * 7, [0] * 7)
+        # Per color: every square attacked at least once
+        self.all = [0, 0]
+
+        for color in chess.COLORS:
+            pieces = self.pieces[color]
+            by_type = self.by_type[color]
+            for square in chess.scan_reversed(board.occupied_co[color]):
+                piece_type = board.piece_type_at(square)
+                mask = board.attacks_mask(square)
+                pieces.append((square, piece_type, mask))
+                by_type[piece_type] |= mask
+            self.all[color] = (by_type[chess.PAWN] | by_type[chess.KNIGHT] | by_type[chess.BISHOP] |
+                               by_type[chess.ROOK] | by_type[chess.QUEEN] | by_type[chess.KING])
+
+    def count(self, color, mask):
+        """Number of (piece, square) attacks by one side into a set of squares."""
+        return sum(chess.popcount(attacks & mask) for _, _, attacks in self.pieces[color])
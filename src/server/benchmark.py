@@ -0,0 +1,465 @@
+"""
+Reproducible benchmarks for move generation, evaluation, search and the HTTP API.
+
+Every run uses the same fixed positions and limits, so results from two
+checkouts on the same machine can be compared directly. Results are written
+as JSON; the ``compare`` command reports the differences between two runs
+and exits with status 1 when a timing or throughput metric regressed by
+more than the threshold.
+
+    python benchmark.py run -o before.json
+    python benchmark.py run -o after.json
+    python benchmark.py compare before.json after.json --threshold 0.1
+
+``run --quick`` uses smaller limits for a smoke test; quick results are
+only comparable with other quick results.
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import chess
+
+# The engine in src/engine is benchmarked alongside the server's
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'engine')
+sys.path.append(ENGINE_DIR)
+
+# Test positions by category, as (name, FEN)
+POSITIONS = {
+    'opening': [
+        ('start', chess.STARTING_FEN),
+        ('italian', 'r1bqk1nr/pppp1ppp/2n5/2b1p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4'),
+    ],
+    'middlegame': [
+        ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'),
+        ('qgd', 'r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R2QK2R w KQ - 0 8'),
+    ],
+    'tactical': [
+        ('wac001', '2rr3k/pp3pp1/1nnqbN1p/3pN3/2pP4/2P3Q1/PPB4P/R4RK1 w - - 0 1'),
+        ('wac003', '5rk1/1ppb3p/p1pb4/6q1/3P1p1r/2P1R2P/PP1BQ1P1/5RKN w - - 0 1'),
+    ],
+    'endgame': [
+        ('rook_pawns', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1'),
+        ('lucena', '1K1k4/1P6/8/8/8/8/r7/2R5 w - - 0 1'),
+    ],
+}
+
+# Perft positions with their published node counts by depth
+PERFT_POSITIONS = [
+    ('start', chess.STARTING_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281}),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     {1: 48, 2: 2039, 3: 97862}),
+    ('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', {1: 14, 2: 191, 3: 2812, 4: 43238}),
+    ('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     {1: 6, 2: 264, 3: 9467}),
+    ('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', {1: 44, 2: 1486, 3: 62379}),
+]
+
+# Limits for full and quick runs. Timed measurements are repeated and the
+# best one is kept, which filters out most scheduling noise
+SETTINGS = {
+    'full': {'repeats': 3, 'perft_depth': 3, 'eval_seconds': 0.5, 'search_depth': 4,
+             'basic_search_depth': 3, 'selectivity_depth': 4, 'api_rounds': 5, 'api_depth': 3},
+    'quick': {'repeats': 1, 'perft_depth': 2, 'eval_seconds': 0.2, 'search_depth': 2,
+              'basic_search_depth': 2, 'selectivity_depth': 3, 'api_rounds': 1, 'api_depth': 2},
+}
+
+# Default relative change reported as a regression by ``compare``
+DEFAULT_THRESHOLD = 0.10
+
+# Metric name suffixes that are better when higher or lower; others are informational
+HIGHER_IS_BETTER = ('nps', 'per_sec')
+LOWER_IS_BETTER = ('_ms',)
+
+
+def iter_positions():
+    """Yield (category, name, FEN) for every test position."""
+    for category, positions in POSITIONS.items():
+        for name, fen in positions:
+            yield category, name, fen
+
+
+def perft(board, depth):
+    """Number of leaf nodes of the legal move tree to ``depth``."""
+    if depth == 1:
+        return board.legal_moves.count()
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def best_time(function, repeats):
+    """Return (result, shortest time in seconds) of ``repeats`` calls of ``function``."""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[1]:
+            best = (result, elapsed)
+    return best
+
+
+def bench_perft(depth, repeats):
+    """Perft with python-chess and with the engine's SearchBoard, checked against the published counts."""
+    from search_board import SearchBoard
+
+    results = {'python_chess': {}, 'search_board': {}}
+    for name, fen, expected in PERFT_POSITIONS:
+        target = min(depth, max(expected))
+        board = chess.Board(fen)
+        position = SearchBoard(board)
+        for implementation, function in (('python_chess', lambda: perft(board, target)),
+                                         ('search_board', lambda: position.perft(target))):
+            nodes, elapsed = best_time(function, repeats)
+            results[implementation][name] = {
+                'depth': target,
+                'nodes': nodes,
+                'correct': nodes == expected[target],
+                'time_ms': elapsed * 1000,
+                'nps': nodes / elapsed if elapsed > 0 else 0,
+            }
+    return results
+
+
+def evals_per_second(function, boards, min_seconds):
+    """Calls of ``function`` per second, cycling over ``boards`` for at least ``min_seconds``."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        for board in boards:
+            function(board)
+        calls += len(boards)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+
+def bench_eval(min_seconds, repeats):
+    from app import ImprovedChessEngine
+    from chess_engine import ChessEngine
+
+    boards = [chess.Board(fen) for _, _, fen in iter_positions()]
+    basic = ChessEngine()
+    # Without the pawn hash table and evaluation cache, which would answer
+    # every call after the first for the same position
+    improved = ImprovedChessEngine(hash_size_mb=0, pawn_hash_entries=0, eval_cache_entries=0)
+
+    batch_boards = boards * 16
+
+    def batch(_):
+        basic.evaluate_batch(batch_boards)
+
+    def rate(function, boards):
+        return max(evals_per_second(function, boards, min_seconds) for _ in range(repeats))
+
+    results = {
+        'chess_engine': {
+            'evaluate_position': rate(basic.evaluate_position, boards),
+            # Positions per second scored by evaluate_batch, in batches of len(batch_boards)
+            'evaluate_batch': rate(batch, boards[:1]) * len(batch_boards),
+        },
+        'improved_engine': {},
+    }
+    for name in ('evaluate_position', 'evaluate_static', 'evaluate_material', 'evaluate_piece_squares',
+                 'evaluate_pawn_structure', 'evaluate_center_control', 'evaluate_development', 'evaluate_king_safety',
+                 'evaluate_threats'):
+        results['improved_engine'][name] = rate(getattr(improved, name), boards)
+    improved.close()
+    return {engine: {name: {'evals_per_sec': rate} for name, rate in terms.items()}
+            for engine, terms in results.items()}
+
+
+def bench_search(depth, basic_depth, repeats):
+    """Fixed-depth searches of every test position, from a fresh engine each time.
+
+    For each depth up to the target the search is run from scratch, so
+    ``time_ms`` at depth d is the time a new search takes to complete d.
+    """
+    from app import ImprovedChessEngine
+    from chess_engine import ChessEngine
+
+    results = {'chess_engine': {}, 'improved_engine': {}}
+    for category, name, fen in iter_positions():
+        for engine_name, factory, max_depth in (
+                ('chess_engine', ChessEngine, basic_depth),
+                ('improved_engine', lambda: ImprovedChessEngine(hash_size_mb=16), depth)):
+            depths = {}
+            for target in range(1, max_depth + 1):
+                elapsed = None
+                for _ in range(repeats):
+                    engine = factory()
+                    board = chess.Board(fen)
+                    start = time.perf_counter()
+                    if engine_name == 'improved_engine':
+                        move, _ = engine.get_best_move(board, depth=target, use_book=False)
+                    else:
+                        move = engine.get_best_move(board, depth=target)
+                    seconds = time.perf_counter() - start
+                    if elapsed is None or seconds < elapsed:
+                        elapsed, nodes = seconds, engine.nodes
+                    if engine_name == 'improved_engine':
+                        engine.close()
+                depths[f'depth_{target}'] = {
+                    'nodes': nodes,
+                    'time_ms': elapsed * 1000,
+                    'nps': nodes / elapsed if elapsed > 0 else 0,
+                    'move': move.uci() if move else None,
+                }
+            results[engine_name][f'{category}/{name}'] = depths
+
+    for engine_name, positions in results.items():
+        deepest = [position[max(position, key=lambda d: int(d.split('_')[1]))]
+                   for position in positions.values()]
+        nodes = sum(result['nodes'] for result in deepest)
+        seconds = sum(result['time_ms'] for result in deepest) / 1000
+        positions['total'] = {'nodes': nodes, 'time_ms': seconds * 1000,
+                              'nps': nodes / seconds if seconds > 0 else 0}
+    return results
+
+
+def bench_selectivity(depth, repeats):
+    """Fixed-depth searches of all test positions with each selective search technique switched off in turn.
+
+    ``all`` uses every technique and ``none`` is plain alpha-beta; the
+    ``no_<feature>`` totals show what a single technique saves.
+    """
+    from app import ImprovedChessEngine, ALL_SEARCH_FEATURES
+
+    configurations = {'all': ALL_SEARCH_FEATURES, 'none': ()}
+    for feature in ALL_SEARCH_FEATURES:
+        configurations[f'no_{feature}'] = tuple(name for name in ALL_SEARCH_FEATURES if name != feature)
+
+    results = {}
+    for label, features in configurations.items():
+        nodes, seconds = 0, 0.0
+        for _, _, fen in iter_positions():
+            elapsed = None
+            for _ in range(repeats):
+                engine = ImprovedChessEngine(hash_size_mb=16, search_features=features)
+                board = chess.Board(fen)
+                start = time.perf_counter()
+                engine.get_best_move(board, depth=depth, use_book=False)
+                duration = time.perf_counter() - start
+                if elapsed is None or duration < elapsed:
+                    elapsed, searched = duration, engine.nodes
+                engine.close()
+            nodes += searched
+            seconds += elapsed
+        results[label] = {'nodes': nodes, 'time_ms': seconds * 1000, 'nps': nodes / seconds if seconds > 0 else 0}
+    return results
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+    return {'requests': len(samples), 'mean_ms': statistics.fmean(samples),
+            'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p99_ms': at(0.99)}
+
+
+def time_requests(client, path, bodies, rounds):
+    samples = []
+    for _ in range(rounds):
+        for body in bodies:
+            start = time.perf_counter()
+            response = client.post(path, json=body)
+            samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} answered {response.status_code}: {response.get_data(as_text=True)}")
+    return percentiles(samples)
+
+
+def bench_api(rounds, depth):
+    """End-to-end /analyze latency through the Flask test clients of both servers.
+
+    The result caches are disabled for the ``analyze`` figures, so every
+    request reaches an engine; ``analyze_cached`` repeats the requests once
+    they are all in the cache. The worker process is started before timing.
+    """
+    import app as server_app
+    from analysis_cache import AnalysisCache
+    server_app.logger.setLevel(logging.WARNING)
+
+    # Book positions would be answered without a search
+    fens = [fen for category, _, fen in iter_positions() if category != 'opening']
+    bodies = [{'fen': fen, 'depth': depth} for fen in fens]
+
+    results = {}
+    server_app.ENGINE_WORKERS = 1
+    server_app.analysis_cache = AnalysisCache(memory_entries=0)
+    client = server_app.app.test_client()
+    try:
+        client.post('/analyze', json={'fen': chess.STARTING_FEN, 'depth': 1})
+        results['analyze'] = time_requests(client, '/analyze', bodies, rounds)
+        server_app.analysis_cache = AnalysisCache(memory_entries=len(bodies))
+        time_requests(client, '/analyze', bodies, 1)
+        results['analyze_cached'] = time_requests(client, '/analyze', bodies, rounds)
+    finally:
+        if server_app.engine_pool is not None:
+            server_app.engine_pool.close()
+            server_app.engine_pool = None
+
+    os.environ.update(ENGINE_CACHE_PATH='', ENGINE_CACHE_ENTRIES='0')
+    spec = importlib.util.spec_from_file_location('engine_server', os.path.join(ENGINE_DIR, 'server.py'))
+    engine_server = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(engine_server)
+    engine_server.logger.setLevel(logging.WARNING)
+    results['engine_analyze'] = time_requests(engine_server.app.test_client(), '/analyze',
+                                              [{'fen': fen} for fen in fens], rounds)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(mode='full', sections=None):
+    """Run the benchmark sections and return the results as a JSON-serializable dict."""
+    settings = SETTINGS[mode]
+    sections = sections or ['perft', 'eval', 'search', 'selectivity', 'api']
+    results = {
+        'meta': {
+            'mode': mode,
+            'settings': settings,
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'python_chess': chess.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+    }
+    for section in sections:
+        start = time.perf_counter()
+        if section == 'perft':
+            results['perft'] = bench_perft(settings['perft_depth'], settings['repeats'])
+        elif section == 'eval':
+            results['eval'] = bench_eval(settings['eval_seconds'], settings['repeats'])
+        elif section == 'search':
+            results['search'] = bench_search(settings['search_depth'], settings['basic_search_depth'],
+                                             settings['repeats'])
+        elif section == 'selectivity':
+            results['selectivity'] = bench_selectivity(settings['selectivity_depth'], settings['repeats'])
+        elif section == 'api':
+            results['api'] = bench_api(settings['api_rounds'], settings['api_depth'])
+        logging.info(f"{section} took {time.perf_counter() - start:.1f}s")
+    return results
+
+
+def flatten(results, prefix=''):
+    """Map 'section/.../metric' paths to the numeric and boolean leaves of a result dict."""
+    metrics = {}
+    for key, value in results.items():
+        if prefix == '' and key == 'meta':
+            continue
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            metrics.update(flatten(value, path + '/'))
+        elif isinstance(value, (bool, int, float)):
+            metrics[path] = value
+    return metrics
+
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two benchmark results.
+
+    Returns a list of (path, old, new, relative change, status) rows, where
+    status is 'regression', 'improvement', 'changed' (informational values
+    such as node counts) or 'ok'. Failed perft checks are regressions.
+    """
+    old_metrics, new_metrics = flatten(old), flatten(new)
+    rows = []
+    for path in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[path], new_metrics[path]
+        metric = path.rsplit('/', 1)[-1]
+        if isinstance(after, bool):
+            status = 'regression' if before and not after else 'ok'
+            rows.append((path, before, after, None, status))
+            continue
+        change = (after - before) / before if before else None
+        status = 'ok'
+        if metric.endswith(HIGHER_IS_BETTER) and change is not None:
+            if change < -threshold:
+                status = 'regression'
+            elif change > threshold:
+                status = 'improvement'
+        elif metric.endswith(LOWER_IS_BETTER) and change is not None:
+            if change > threshold:
+                status = 'regression'
+            elif change < -threshold:
+                status = 'improvement'
+        elif before != after:
+            status = 'changed'
+        rows.append((path, before, after, change, status))
+    return rows
+
+
+def print_comparison(rows, verbose=False, output=sys.stdout):
+    for path, before, after, change, status in rows:
+        if status == 'ok' and not verbose:
+            continue
+        change = f'{change:+.1%}' if change is not None else ''
+        output.write(f'{status:<12} {path:<70} {before:>14.6g} {after:>14.6g} {change:>8}\n')
+    regressions = sum(1 for row in rows if row[4] == 'regression')
+    output.write(f'{len(rows)} metrics compared, {regressions} regressions\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the engines and the analysis server.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks and write JSON results")
+    run_parser.add_argument('-o', '--output', help="output file (default: standard output)")
+    run_parser.add_argument('--quick', action='store_true', help="smaller limits for a smoke test")
+    run_parser.add_argument('--only', action='append', choices=['perft', 'eval', 'search', 'selectivity', 'api'],
+                            help="run only this section (repeatable)")
+
+    compare_parser = commands.add_parser('compare', help="compare two result files")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help="relative change counted as a regression (default: 0.10)")
+    compare_parser.add_argument('-v', '--verbose', action='store_true', help="also list unchanged metrics")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'run':
+        results = run('quick' if args.quick else 'full', args.only)
+        text = json.dumps(results, indent=2) + '\n'
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            sys.stdout.write(text)
+        return 0
+
+    with open(args.old, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    if old.get('meta', {}).get('mode') != new.get('meta', {}).get('mode'):
+        logging.warning("Comparing results of different modes")
+    rows = compare(old, new, args.threshold)
+    print_comparison(rows, args.verbose)
+    return 1 if any(row[4] == 'regression' for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks whether a running search is still wanted
+CANCEL_POLL_INTERVAL = 0.01
+
+
+class SearchCancelled(Exception):
+    """Raised for a request superseded by a newer request from the same session."""
+
+
+class _Waiter:
+    """One request waiting for a search result."""
+
+    __slots__ = ('event', 'cancelled')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.cancelled = False
+
+
+class _Flight:
+    """A search in progress and the requests waiting for it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.waiters = set()
+        self.cancel = threading.Event()
+        self.finished = False
+        self.result = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """
+    Share searches between identical requests and cancel superseded ones.
+
+    Concurrent requests with the same key (normalized FEN and search limits)
+    wait on a single search on the engine pool. Each client session has at
+    most one live request: a new request from the session answers the
+    previous one with SearchCancelled, and a search nobody waits for any
+    more is stopped through the worker's stop event. ``on_result`` is
+    called once with each search's result, however many requests share it.
+    """
+
+    def __init__(self, pool, on_result=None):
+        self.pool = pool
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.sessions = {}
+        self.searches = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def open_session(self, session_id):
+        """Register a new request for a session, superseding its previous one."""
+        waiter = _Waiter()
+        if session_id is None:
+            return waiter
+        with self.lock:
+            previous = self.sessions.get(session_id)
+            if previous is not None:
+                self._withdraw(*previous)
+            self.sessions[session_id] = (None, waiter)
+        return waiter
+
+    def close_session(self, session_id, waiter):
+        """Forget a session's request once it has been answered."""
+        if session_id is None:
+            return
+        with self.lock:
+            current = self.sessions.get(session_id)
+            if current is not None and current[1] is waiter:
+                del self.sessions[session_id]
+
+    def run(self, key, args, timeout, session_id=None, affinity=None):
+        """
+        Return the pool's result for ``args``, sharing the search with other
+        requests for the same key. A new search is run with the pool's
+        ``affinity``.
+
+        Raises SearchCancelled if a newer request from the same session
+        arrives first, and TimeoutError if no result comes within ``timeout``.
+        """
+        waiter = self.open_session(session_id)
+        with self.lock:
+            if waiter.cancelled:
+                raise SearchCancelled("Superseded by a newer request")
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = _Flight(key)
+                self.flights[key] = flight
+                self.searches += 1
+                threading.Thread(target=self._search, args=(flight, args, timeout, affinity),
+                                 name="coalesced-search", daemon=True).start()
+            else:
+                self.coalesced += 1
+            flight.waiters.add(waiter)
+            if session_id is not None:
+                self.sessions[session_id] = (flight, waiter)
+
+        try:
+            if not waiter.event.wait(timeout):
+                with self.lock:
+                    self._withdraw(flight, waiter)
+                raise TimeoutError(f"Analysis did not finish within {timeout:.1f}s")
+        finally:
+            self.close_session(session_id, waiter)
+
+        if waiter.cancelled:
+            raise SearchCancelled("Superseded by a newer request")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _withdraw(self, flight, waiter):
+        """Answer a waiter as cancelled and stop its search if nobody else wants it."""
+        waiter.cancelled = True
+        waiter.event.set()
+        if flight is None:
+            return
+        flight.waiters.discard(waiter)
+        if not flight.waiters and not flight.finished:
+            flight.cancel.set()
+            self.cancelled += 1
+            # Later requests for the position start a fresh search
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+
+    def _search(self, flight, args, timeout, affinity):
+        """Run one search on the pool, stopping it when it gets cancelled."""
+        try:
+            stream = self.pool.stream(*args, timeout=timeout, heartbeat=CANCEL_POLL_INTERVAL, affinity=affinity)
+            try:
+                for kind, value in stream:
+                    if flight.cancel.is_set():
+                        logger.info("Cancelled a search nobody is waiting for")
+                        break
+                    if kind == 'result':
+                        flight.result = value
+            finally:
+                # Closing the stream early stops the search on its worker
+                stream.close()
+            if flight.result is not None and self.on_result is not None:
+                self.on_result(flight.result)
+        except Exception as e:
+            flight.error = e
+
+        with self.lock:
+            flight.finished = True
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            for waiter in flight.waiters:
+                waiter.event.set()
@@ -0,0 +1,88 @@
+"""
+Evaluation weights files.
+
+A weights file is a JSON object mapping ImprovedChessEngine attribute
+names to values: 64-entry piece-square tables, laid out from white's side
+with rank 8 first, and single numbers for the other terms. Files written
+by tuning.py hold every weight; hand-written ones may hold any subset,
+and the engine keeps its built-in values for the rest.
+"""
+import json
+
+# Piece-square tables, in the order of the tuner's parameter vector
+TABLE_WEIGHTS = (
+    'pawn_position_values',
+    'knight_position_values',
+    'bishop_position_values',
+    'rook_position_values',
+    'queen_position_values',
+    'king_position_values_middlegame',
+    'king_position_values_endgame',
+)
+
+# Single weights of the other evaluation terms
+SCALAR_WEIGHTS = (
+    'pawn_advance_bonus',
+    'knight_center_penalty',
+    'doubled_pawn_penalty',
+    'isolated_pawn_penalty',
+    'backward_pawn_penalty',
+    'passed_pawn_bonus',
+    'bishop_mobility_bonus',
+    'rook_open_file_bonus',
+    'queen_mobility_bonus',
+    'pawn_shield_bonus',
+    'king_zone_attack_penalty',
+    'hanging_piece_percent',
+    'weak_piece_percent',
+    'mobility_bonus',
+)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def read_weights(path):
+    """Read and check a weights file; returns a dict of weight name to value."""
+    with open(path) as f:
+        weights = json.load(f)
+    if not isinstance(weights, dict):
+        raise ValueError(f"{path}: weights file must hold a JSON object")
+
+    unknown = set(weights) - set(TABLE_WEIGHTS) - set(SCALAR_WEIGHTS)
+    if unknown:
+        raise ValueError(f"{path}: unknown weights: {', '.join(sorted(unknown))}")
+    for name, value in weights.items():
+        if name in TABLE_WEIGHTS:
+            if not isinstance(value, list) or len(value) != 64 or not all(map(_is_number, value)):
+                raise ValueError(f"{path}: {name} must be a list of 64 numbers")
+        elif not _is_number(value):
+            raise ValueError(f"{path}: {name} must be a number")
+    return weights
+
+
+def write_weights(path, weights):
+    """Write weights as JSON, one table rank per line."""
+    entries = []
+    for name, value in weights.items():
+        if name in TABLE_WEIGHTS:
+            ranks = (', '.join(f'{v:4}' for v in value[i:i + 8]) for i in range(0, 64, 8))
+            entries.append(f'  "{name}": [\n    ' + ',\n    '.join(ranks) + '\n  ]')
+        else:
+            entries.append(f'  "{name}": {json.dumps(value)}')
+    with open(path, 'w') as f:
+        f.write('{\n' + ',\n'.join(entries) + '\n}\n')
+
+
+def engine_weights(engine):
+    """The weights an engine evaluates with, in the layout of a weights file."""
+    weights = {name: list(getattr(engine, name)) for name in TABLE_WEIGHTS}
+    weights.update((name, getattr(engine, name)) for name in SCALAR_WEIGHTS)
+    return weights
+
+
+def apply_weights(engine, weights):
+    """Replace an engine's weights; call before it builds its square tables."""
+    for name, value in weights.items():
+        setattr(engine, name, list(value) if name in TABLE_WEIGHTS else value)
@@ -0,0 +1,84 @@
+import chess
+
+
+def attackers_mask(board, color, square, occupied):
+    """Attackers of a square by one side, with sliders seeing through removed pieces.
+
+    Same as ``board.attackers(color, square)`` but computed for the given
+    occupancy, so pieces lined up behind an exchanged piece (x-rays) appear
+    once the pieces in front of them are removed from ``occupied``.
+    """
+    queens_and_rooks = board.queens | board.rooks
+    queens_and_bishops = board.queens | board.bishops
+
+    attackers = (
+        (chess.BB_KING_ATTACKS[square] & board.kings) |
+        (chess.BB_KNIGHT_ATTACKS[square] & board.knights) |
+        (chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] & queens_and_rooks) |
+        (chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied] & queens_and_rooks) |
+        (chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied] & queens_and_bishops) |
+        (chess.BB_PAWN_ATTACKS[not color][square] & board.pawns))
+
+    return attackers & board.occupied_co[color] & occupied
+
+
+def least_valuable_attacker(board, attackers):
+    """Return (square, piece type) of the cheapest piece in an attacker mask."""
+    pieces = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+    for piece_type, mask in zip(chess.PIECE_TYPES, pieces):
+        candidates = attackers & mask
+        if candidates:
+            return chess.lsb(candidates), piece_type
+    return None, None
+
+
+def static_exchange_evaluation(board, move, piece_values):
+    """
+    Material balance of the capture sequence started by a move on its target square.
+
+    Both sides keep recapturing with their least valuable attacker and may
+    stop whenever continuing would lose material. Returns the gain for the
+    side making the move, in the units of ``piece_values``.
+    """
+    from_square, to_square = move.from_square, move.to_square
+    occupied = board.occupied & ~chess.BB_SQUARES[from_square]
+
+    if board.is_en_passant(move):
+        captured_value = piece_values[chess.PAWN]
+        captured_square = to_square - 8 if board.turn == chess.WHITE else to_square + 8
+        occupied &= ~chess.BB_SQUARES[captured_square]
+    else:
+        captured_type = board.piece_type_at(to_square)
+        captured_value = piece_values[captured_type] if captured_type else 0
+
+    moving_type = board.piece_type_at(from_square)
+    gains = [captured_value]
+    if move.promotion:
+        gains[0] += piece_values[move.promotion] - piece_values[chess.PAWN]
+        moving_type = move.promotion
+
+    # Value of the piece currently standing on the target square
+    at_risk = piece_values[moving_type]
+    color = not board.turn
+
+    while True:
+        attackers = attackers_mask(board, color, to_square, occupied)
+        square, piece_type = least_valuable_attacker(board, attackers)
+        if square is None:
+            break
+
+        # A king can only recapture if the square is no longer defended
+        if piece_type == chess.KING:
+            if attackers_mask(board, not color, to_square, occupied & ~chess.BB_SQUARES[square]):
+                break
+
+        gains.append(at_risk - gains[-1])
+        at_risk = piece_values[piece_type]
+        occupied &= ~chess.BB_SQUARES[square]
+        color = not color
+
+    # Each side may stop capturing when that is better for it
+    while len(gains) > 1:
+        last = gains.pop()
+        gains[-1] = -max(-gains[-1], last)
+    return gains[0]
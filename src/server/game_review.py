@@ -0,0 +1,220 @@
+"""
+Review finished games: evaluate every ply and flag inaccuracies, mistakes and blunders.
+
+Games are read one at a time from a PGN stream and spread over a pool of
+worker processes, each holding one long-lived engine, so consecutive plies
+of a game reuse its transposition table and history. Only a bounded number
+of games is in flight at any time, so memory stays flat however large the
+input is. Results come out in input order, as NDJSON (one line per move)
+or as annotated PGN.
+
+    python game_review.py games.pgn --movetime-ms 200 --workers 4 > review.ndjson
+    python game_review.py games.pgn --nodes 20000 --format pgn -o annotated.pgn
+"""
+import argparse
+import collections
+import io
+import json
+import multiprocessing
+import sys
+
+import chess
+import chess.pgn
+
+from app import ImprovedChessEngine, mate_in
+
+# Loss in centipawns, from the mover's perspective, for each judgement
+INACCURACY_THRESHOLD = 50
+MISTAKE_THRESHOLD = 100
+BLUNDER_THRESHOLD = 300
+
+# Evaluations are capped before losses are computed, so that choosing a
+# slower mate or a won ending over a mating line does not count as a blunder
+EVAL_CAP = 1000
+
+JUDGEMENT_NAGS = {
+    'inaccuracy': chess.pgn.NAG_DUBIOUS_MOVE,
+    'mistake': chess.pgn.NAG_MISTAKE,
+    'blunder': chess.pgn.NAG_BLUNDER,
+}
+
+# Games queued per worker process
+GAMES_IN_FLIGHT_PER_WORKER = 2
+
+
+def iter_games(pgn):
+    """Yield games from a PGN text stream one at a time."""
+    while True:
+        game = chess.pgn.read_game(pgn)
+        if game is None:
+            return
+        yield game
+
+
+def judge(loss):
+    """Judgement for a centipawn loss, or None for a good move."""
+    if loss >= BLUNDER_THRESHOLD:
+        return 'blunder'
+    if loss >= MISTAKE_THRESHOLD:
+        return 'mistake'
+    if loss >= INACCURACY_THRESHOLD:
+        return 'inaccuracy'
+    return None
+
+
+def _cap(score):
+    return max(-EVAL_CAP, min(EVAL_CAP, score))
+
+
+def _evaluation(score, when):
+    """Record fields for White's score: centipawns, or moves to mate (negative when White is mated)."""
+    mate = mate_in(score)
+    return {f'eval_{when}': score if mate is None else None, f'mate_{when}': mate}
+
+
+def _eval_comment(evaluation, mate):
+    if mate is not None:
+        return f"[%eval #{mate}]"
+    return f"[%eval {evaluation / 100:.2f}]"
+
+
+def analyse_position(engine, board, depth=None, time_limit=None, node_limit=None):
+    """Return (best move or None, White's evaluation, completed depth) for one position."""
+    if board.is_game_over():
+        return None, engine.evaluate_position(board), 0
+    best_move, score = engine.get_best_move(board, depth=depth, time_limit=time_limit,
+                                            node_limit=node_limit, use_book=False)
+    return best_move, score, engine.completed_depth
+
+
+def review_game(engine, game, depth=None, time_limit=None, node_limit=None):
+    """
+    Evaluate every position of a game's main line.
+
+    Returns one dict per move with the played and best moves, White's
+    evaluation before and after the move, the mover's centipawn loss and
+    its judgement. Evaluations are in centipawns, or None when the
+    position is a mate, with the moves to mate instead (negative when
+    White is mated, 0 when the game is over). The same engine searches all plies in order, so each
+    search starts from the table entries left by the previous one.
+    """
+    board = game.board()
+    best_move, score, searched_depth = analyse_position(engine, board, depth, time_limit, node_limit)
+
+    records = []
+    for ply, move in enumerate(game.mainline_moves(), start=1):
+        record = {
+            'ply': ply,
+            'move': board.san(move),
+            'uci': move.uci(),
+            'best_move': board.san(best_move) if best_move else None,
+            'best_uci': best_move.uci() if best_move else None,
+            **_evaluation(score, 'before'),
+            'depth': searched_depth,
+        }
+        mover = board.turn
+        board.push(move)
+        best_move, next_score, searched_depth = analyse_position(engine, board, depth, time_limit, node_limit)
+
+        loss = _cap(score) - _cap(next_score)
+        if mover == chess.BLACK:
+            loss = -loss
+        # The engine's own choice never counts as a loss
+        if record['uci'] == record['best_uci']:
+            loss = 0
+        loss = max(0, loss)
+        record.update(_evaluation(next_score, 'after'), loss=loss, judgement=judge(loss))
+        records.append(record)
+        score = next_score
+    return records
+
+
+def annotate_game(game, records):
+    """Add evaluations, judgement NAGs and the better move to a game's main line."""
+    node = game
+    for record in records:
+        parent, node = node, node.variation(0)
+        node.comment = _eval_comment(record['eval_after'], record['mate_after'])
+        if record['judgement']:
+            node.nags.add(JUDGEMENT_NAGS[record['judgement']])
+            if record['best_uci'] and record['judgement'] != 'inaccuracy':
+                variation = parent.add_variation(chess.Move.from_uci(record['best_uci']))
+                variation.comment = _eval_comment(record['eval_before'], record['mate_before'])
+    return game
+
+
+_engine = None
+
+
+def _init_worker(hash_size_mb, tablebase_path):
+    global _engine
+    _engine = ImprovedChessEngine(hash_size_mb=hash_size_mb, tablebase_path=tablebase_path)
+
+
+def _review_task(index, pgn_text, output_format, depth, time_limit, node_limit):
+    game = chess.pgn.read_game(io.StringIO(pgn_text))
+    records = review_game(_engine, game, depth, time_limit, node_limit)
+    if output_format == 'pgn':
+        return str(annotate_game(game, records)) + '\n\n'
+    lines = []
+    for record in records:
+        record = dict(record, game=index, white=game.headers.get('White'), black=game.headers.get('Black'))
+        lines.append(json.dumps(record) + '\n')
+    return ''.join(lines)
+
+
+def review_pgn(pgn, output_format='ndjson', depth=None, time_limit=None, node_limit=None,
+               workers=None, hash_size_mb=16, tablebase_path=None):
+    """
+    Review every game in a PGN text stream and yield the output for each, in order.
+
+    Each yielded string holds one game's NDJSON lines or annotated PGN.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=_init_worker, initargs=(hash_size_mb, tablebase_path)) as pool:
+        pending = collections.deque()
+        for index, game in enumerate(iter_games(pgn)):
+            # Exported without annotations; the worker parses it again
+            pgn_text = str(game)
+            pending.append(pool.apply_async(_review_task, (index, pgn_text, output_format,
+                                                           depth, time_limit, node_limit)))
+            if len(pending) >= workers * GAMES_IN_FLIGHT_PER_WORKER:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Review the games in a PGN file.")
+    parser.add_argument('pgn', help="PGN file to review ('-' for standard input)")
+    parser.add_argument('-o', '--output', help="output file (default: standard output)")
+    parser.add_argument('--format', choices=['ndjson', 'pgn'], default='ndjson')
+    parser.add_argument('--depth', type=int, help="search depth per position")
+    parser.add_argument('--movetime-ms', type=int, help="search time per position")
+    parser.add_argument('--nodes', type=int, help="search nodes per position")
+    parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument('--hash-mb', type=int, default=16, help="transposition table size per worker")
+    parser.add_argument('--tablebases', help="directory of endgame tables")
+    args = parser.parse_args(argv)
+
+    time_limit = args.movetime_ms / 1000.0 if args.movetime_ms else None
+    if args.depth is None and time_limit is None and args.nodes is None:
+        time_limit = 0.2
+
+    pgn = sys.stdin if args.pgn == '-' else open(args.pgn, encoding='utf-8-sig', errors='replace')
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for chunk in review_pgn(pgn, args.format, args.depth, time_limit, args.nodes,
+                                args.workers, args.hash_mb, args.tablebases):
+            output.write(chunk)
+            output.flush()
+    finally:
+        if pgn is not sys.stdin:
+            pgn.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
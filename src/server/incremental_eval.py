@@ -0,0 +1,122 @@
+import chess
+
+from pawn_hash import PAWN_KEYS, pawn_key
+
+# Game phase contributed by each piece type; 24 is the full opening set
+PHASE_WEIGHTS = {
+    chess.PAWN: 0,
+    chess.KNIGHT: 1,
+    chess.BISHOP: 1,
+    chess.ROOK: 2,
+    chess.QUEEN: 4,
+    chess.KING: 0,
+}
+MAX_PHASE = 24
+
+
+def taper(mg, eg, phase):
+    """Blend middlegame and endgame scores by the game phase."""
+    phase = min(phase, MAX_PHASE)
+    return (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+
+def piece_square_totals(board, mg_tables, eg_tables):
+    """Compute (mg, eg, phase) for a board from scratch."""
+    mg = eg = phase = 0
+    for square, piece in board.piece_map().items():
+        mg += mg_tables[piece.color][piece.piece_type][square]
+        eg += eg_tables[piece.color][piece.piece_type][square]
+        phase += PHASE_WEIGHTS[piece.piece_type]
+    return mg, eg, phase
+
+
+class EvalState:
+    """
+    Running material and piece-square totals for one board.
+
+    Moves must be made and taken back through push() and pop() so the
+    middlegame, endgame and phase accumulators and the pawn key stay in
+    step with the board.
+    Tables are indexed [color][piece_type][square] and hold values from
+    white's perspective (black entries are already negated).
+    """
+
+    def __init__(self, board, mg_tables, eg_tables):
+        self.board = board
+        self.mg_tables = mg_tables
+        self.eg_tables = eg_tables
+        self.mg, self.eg, self.phase = piece_square_totals(board, mg_tables, eg_tables)
+        self.pawn_key = pawn_key(board)
+        self.deltas = []
+
+    def score(self):
+        """Tapered material and piece-square score from white's perspective."""
+        return taper(self.mg, self.eg, self.phase)
+
+    def move_delta(self, move):
+        """Return the (mg, eg, phase, pawn key) change caused by a move on the current board.
+
+        The pawn key change is the value to XOR into the key.
+        """
+        board = self.board
+        if not move:
+            return 0, 0, 0, 0  # Null move
+
+        mg_tables, eg_tables = self.mg_tables, self.eg_tables
+        color = board.turn
+        from_square, to_square = move.from_square, move.to_square
+        piece_type = board.piece_type_at(from_square)
+        new_type = move.promotion or piece_type
+
+        mg = mg_tables[color][new_type][to_square] - mg_tables[color][piece_type][from_square]
+        eg = eg_tables[color][new_type][to_square] - eg_tables[color][piece_type][from_square]
+        phase = PHASE_WEIGHTS[new_type] - PHASE_WEIGHTS[piece_type]
+        pawn_key = 0
+        if piece_type == chess.PAWN:
+            pawn_key = PAWN_KEYS[color][from_square]
+            if not move.promotion:
+                pawn_key ^= PAWN_KEYS[color][to_square]
+
+        if board.is_castling(move):
+            rank = chess.square_rank(from_square)
+            if board.is_kingside_castling(move):
+                rook_from, rook_to = chess.square(7, rank), chess.square(5, rank)
+            else:
+                rook_from, rook_to = chess.square(0, rank), chess.square(3, rank)
+            mg += mg_tables[color][chess.ROOK][rook_to] - mg_tables[color][chess.ROOK][rook_from]
+            eg += eg_tables[color][chess.ROOK][rook_to] - eg_tables[color][chess.ROOK][rook_from]
+            return mg, eg, phase, pawn_key
+
+        if board.is_en_passant(move):
+            captured_square = to_square - 8 if color == chess.WHITE else to_square + 8
+            captured_type = chess.PAWN
+        else:
+            captured_square = to_square
+            captured_type = board.piece_type_at(to_square)
+
+        if captured_type:
+            mg -= mg_tables[not color][captured_type][captured_square]
+            eg -= eg_tables[not color][captured_type][captured_square]
+            phase -= PHASE_WEIGHTS[captured_type]
+            if captured_type == chess.PAWN:
+                pawn_key ^= PAWN_KEYS[not color][captured_square]
+
+        return mg, eg, phase, pawn_key
+
+    def push(self, move):
+        delta = self.move_delta(move)
+        self.board.push(move)
+        self.mg += delta[0]
+        self.eg += delta[1]
+        self.phase += delta[2]
+        self.pawn_key ^= delta[3]
+        self.deltas.append(delta)
+
+    def pop(self):
+        move = self.board.pop()
+        delta = self.deltas.pop()
+        self.mg -= delta[0]
+        self.eg -= delta[1]
+        self.phase -= delta[2]
+        self.pawn_key ^= delta[3]
+        return move
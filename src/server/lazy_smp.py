@@ -0,0 +1,122 @@
+import logging
+import multiprocessing
+import random
+
+import chess
+
+from transposition import SharedTranspositionTable
+
+logger = logging.getLogger(__name__)
+
+
+def _helper_main(conn, stop_event, engine_factory, tt_name, index):
+    """Run searches on a helper engine that shares the main transposition table."""
+    engine = engine_factory()
+    engine.tt = SharedTranspositionTable(name=tt_name)
+    engine.stop_event = stop_event
+
+    # Helpers alternate start depths and shuffle root moves differently
+    rng = random.Random(index)
+    start_depth = 1 + index % 2
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+
+        root_fen, moves, depth, time_limit = task
+        board = chess.Board(root_fen)
+        for move in moves:
+            board.push_uci(move)
+
+        try:
+            best_move, score = engine.iterative_deepening(board, depth, time_limit,
+                                                          start_depth=start_depth, rng=rng)
+            conn.send((engine.completed_depth, best_move.uci() if best_move else None, score))
+        except Exception as e:
+            logger.error(f"Lazy SMP helper {index} failed: {e}")
+            conn.send((0, None, 0))
+
+    engine.tt.close()
+
+
+class LazySMP:
+    """
+    Lazy SMP: helper processes search the same root position as the main search.
+
+    All searches share one SharedTranspositionTable, so helpers fill the table
+    with results the main search can cut off on. Helpers start at alternating
+    depths with shuffled root move orders so they do not all walk the same
+    tree. The deepest completed result over all searches wins.
+    """
+
+    def __init__(self, engine_factory, tt, num_helpers):
+        self.tt = tt
+        context = multiprocessing.get_context('spawn')
+        self.stop_event = context.Event()
+        self.helpers = []
+        for index in range(1, num_helpers + 1):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_helper_main,
+                args=(child_conn, self.stop_event, engine_factory, tt.name, index),
+                name=f"lazy-smp-helper-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.helpers.append((process, conn))
+
+    def search(self, engine, board, depth, time_limit, threads, on_iteration=None, node_limit=None, multipv=1):
+        """Search with the main engine plus threads - 1 helpers and return (move, score).
+
+        ``on_iteration`` receives the main search's per-depth progress and
+        ``node_limit`` bounds the main search only. In multi-PV mode the
+        main search's lines are the result; helpers only fill the table.
+        """
+        helpers = [conn for process, conn in self.helpers[:threads - 1] if process.is_alive()]
+        root_fen = board.root().fen()
+        moves = [move.uci() for move in board.move_stack]
+
+        self.stop_event.clear()
+        for conn in helpers:
+            conn.send((root_fen, moves, depth, time_limit))
+
+        try:
+            best_move, best_score = engine.iterative_deepening(board, depth, time_limit, on_iteration=on_iteration,
+                                                               node_limit=node_limit, multipv=multipv)
+        finally:
+            # The main search decides when everyone stops
+            self.stop_event.set()
+            results = []
+            for conn in helpers:
+                try:
+                    results.append(conn.recv())
+                except EOFError:
+                    logger.warning("Lazy SMP helper exited during search")
+
+        best_depth = engine.completed_depth
+        if multipv > 1:
+            return best_move, best_score
+        for completed_depth, move, score in results:
+            if move is not None and completed_depth > best_depth:
+                best_depth = completed_depth
+                best_move, best_score = chess.Move.from_uci(move), score
+        engine.completed_depth = best_depth
+        return best_move, best_score
+
+    def close(self):
+        """Stop all helpers."""
+        for process, conn in self.helpers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(timeout=1)
+            if process.is_alive():
+                process.kill()
+            conn.close()
+        self.helpers = []
@@ -0,0 +1,98 @@
+import chess
+
+# Number of killer moves remembered per ply
+KILLER_SLOTS = 2
+
+# History scores are halved between searches so old cutoffs fade out
+HISTORY_AGING = 2
+
+
+class MoveOrdering:
+    """
+    Staged move picker with killer moves and a history table.
+
+    Moves are produced lazily in stages: the hash move, captures and
+    promotions by MVV/LVA, killer moves, then the remaining quiet moves by
+    history score. A beta cutoff stops the generator, so later stages are
+    never generated or scored.
+    """
+
+    def __init__(self, piece_values, max_ply):
+        self.piece_values = piece_values
+        self.max_ply = max_ply
+        self.killers = [[None] * KILLER_SLOTS for _ in range(max_ply)]
+        # Indexed by (color * 64 + from_square) * 64 + to_square
+        self.history = [0] * (2 * 64 * 64)
+
+    def new_search(self):
+        """Forget killers and age the history table before a new search."""
+        self.killers = [[None] * KILLER_SLOTS for _ in range(self.max_ply)]
+        self.history = [score // HISTORY_AGING for score in self.history]
+
+    def history_score(self, color, move):
+        return self.history[(color * 64 + move.from_square) * 64 + move.to_square]
+
+    def capture_value(self, board, move):
+        """MVV/LVA score of a capture or promotion."""
+        value = 0
+        victim = board.piece_type_at(move.to_square)
+        if victim is None and board.is_en_passant(move):
+            victim = chess.PAWN
+        if victim:
+            attacker = board.piece_type_at(move.from_square)
+            value = 10 * self.piece_values[victim] - self.piece_values[attacker]
+        if move.promotion:
+            value += self.piece_values[move.promotion]
+        return value
+
+    def captures(self, board, hash_move=None):
+        """Yield captures and promotions, best MVV/LVA first, skipping hash_move."""
+        promotion_squares = chess.BB_BACKRANKS & ~board.occupied
+        moves = list(board.generate_legal_captures())
+        moves.extend(board.generate_legal_moves(board.pawns, promotion_squares))
+        if hash_move in moves:
+            moves.remove(hash_move)
+        moves.sort(key=lambda move: self.capture_value(board, move), reverse=True)
+        return moves
+
+    def moves(self, board, hash_move=None, ply=0):
+        """Yield all legal moves in staged order."""
+        # Stage 1: the best move stored for this position
+        if hash_move is not None and board.is_legal(hash_move):
+            yield hash_move
+        else:
+            hash_move = None
+
+        # Stage 2: captures and promotions
+        tactical = self.captures(board, hash_move)
+        yield from tactical
+
+        # Stage 3: quiet moves that caused cutoffs at this ply before
+        killers = list(self.killers[ply]) if ply < self.max_ply else []
+        for killer in killers:
+            if (killer is not None and killer != hash_move and not board.is_capture(killer)
+                    and not killer.promotion and board.is_legal(killer)):
+                yield killer
+
+        # Stage 4: remaining quiet moves ordered by history
+        skip = set(tactical)
+        skip.update(killers)
+        skip.add(hash_move)
+        quiet_squares = chess.BB_ALL & ~board.occupied_co[not board.turn]
+        quiets = [move for move in board.generate_legal_moves(chess.BB_ALL, quiet_squares)
+                  if move not in skip]
+        history = self.history
+        offset = board.turn * 64
+        quiets.sort(key=lambda move: history[(offset + move.from_square) * 64 + move.to_square], reverse=True)
+        yield from quiets
+
+    def record_cutoff(self, board, move, depth, ply):
+        """Remember a quiet move that caused a beta cutoff."""
+        if board.is_capture(move) or move.promotion:
+            return
+        if ply < self.max_ply:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1:] = killers[:-1]
+                killers[0] = move
+        self.history[(board.turn * 64 + move.from_square) * 64 + move.to_square] += depth * depth
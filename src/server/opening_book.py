@@ -0,0 +1,59 @@
+import logging
+import random
+
+import chess
+import chess.polyglot
+
+from analysis_cache import normalize_fen
+
+logger = logging.getLogger(__name__)
+
+
+class OpeningBook:
+    """
+    Book moves from a Polyglot ``.bin`` file, with a small built-in fallback.
+
+    The file is memory-mapped and looked up by binary search on the
+    position's Polyglot Zobrist key, so it is never loaded into memory and
+    its pages are shared by every process that opens it. Moves are picked
+    at random in proportion to their weight, ignoring entries below
+    ``min_weight``. Positions at or beyond ``max_ply`` half-moves are out
+    of book. ``fallback`` maps FENs to lists of UCI moves and is keyed by
+    normalized FEN, so move counters do not matter.
+    """
+
+    def __init__(self, path=None, min_weight=1, max_ply=None, fallback=None, rng=None):
+        self.min_weight = min_weight
+        self.max_ply = max_ply
+        self.rng = rng or random.Random()
+        self.fallback = {normalize_fen(chess.Board(fen)): moves for fen, moves in (fallback or {}).items()}
+
+        self.reader = None
+        if path:
+            try:
+                self.reader = chess.polyglot.open_reader(path)
+            except OSError as e:
+                logger.warning(f"Could not open opening book {path}: {e}")
+
+    def probe(self, board):
+        """Return a book move for the position, or None when it is out of book."""
+        if self.max_ply is not None and board.ply() >= self.max_ply:
+            return None
+
+        if self.reader is not None:
+            entries = list(self.reader.find_all(board, minimum_weight=self.min_weight))
+            if entries:
+                weights = [entry.weight for entry in entries]
+                if not any(weights):
+                    return self.rng.choice(entries).move
+                return self.rng.choices(entries, weights=weights)[0].move
+
+        moves = self.fallback.get(normalize_fen(board))
+        if moves:
+            return chess.Move.from_uci(self.rng.choice(moves))
+        return None
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
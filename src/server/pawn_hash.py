@@ -0,0 +1,135 @@
+import chess
+import chess.polyglot
+
+# Polyglot Zobrist numbers of the pawns by [color][square]. The pawn key of
+# a position is the XOR of those of its pawns, so only pawn moves, pawn
+# captures and promotions change it
+PAWN_KEYS = {color: [chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 * int(color) + square] for square in chess.SQUARES]
+             for color in chess.COLORS}
+
+
+def _adjacent_files(file):
+    return (chess.BB_FILES[file - 1] if file > 0 else 0) | (chess.BB_FILES[file + 1] if file < 7 else 0)
+
+
+def _ranks(color, rank, ahead):
+    """Ranks strictly ahead of ``rank`` from ``color``'s side, or the ones at or behind it."""
+    mask = 0
+    for r in range(8):
+        if (r > rank if color == chess.WHITE else r < rank) == ahead:
+            mask |= chess.BB_RANKS[r]
+    return mask
+
+
+ADJACENT_FILES = [_adjacent_files(file) for file in range(8)]
+
+# Per color and square: where enemy pawns stop a pawn from being passed,
+# and where friendly pawns could still support it from behind
+PASSED_MASKS = {color: [(chess.BB_FILES[chess.square_file(square)] | ADJACENT_FILES[chess.square_file(square)])
+                        & _ranks(color, chess.square_rank(square), True) for square in chess.SQUARES]
+                for color in chess.COLORS}
+SUPPORT_MASKS = {color: [ADJACENT_FILES[chess.square_file(square)] & _ranks(color, chess.square_rank(square), False)
+                         for square in chess.SQUARES]
+                 for color in chess.COLORS}
+
+
+def pawn_key(board):
+    """Zobrist key of the pawns alone, computed from scratch."""
+    key = 0
+    for color in chess.COLORS:
+        keys = PAWN_KEYS[color]
+        for square in chess.scan_reversed(board.pawns & board.occupied_co[color]):
+            key ^= keys[square]
+    return key
+
+
+def pawn_structure(board):
+    """
+    Count the pawn-structure terms of a position.
+
+    Returns (doubled, isolated, backward, passed, open_files). The first
+    four are white's count minus black's: pawns on files holding more than
+    one of their own, pawns with no friendly pawn on an adjacent file,
+    pawns that can no longer be supported by one and whose stop square an
+    enemy pawn attacks, and the ranks advanced by passed pawns. open_files
+    is the mask of the files without any pawn.
+    """
+    counts = [0, 0, 0, 0]
+    for color in chess.COLORS:
+        sign = 1 if color == chess.WHITE else -1
+        pawns = board.pawns & board.occupied_co[color]
+        enemy_pawns = board.pawns & board.occupied_co[not color]
+
+        for file_mask in chess.BB_FILES:
+            pawns_in_file = chess.popcount(pawns & file_mask)
+            if pawns_in_file > 1:
+                counts[0] += sign * pawns_in_file
+
+        for square in chess.scan_reversed(pawns):
+            rank = chess.square_rank(square)
+            if not pawns & ADJACENT_FILES[chess.square_file(square)]:
+                counts[1] += sign
+            elif not pawns & SUPPORT_MASKS[color][square]:
+                stop = square + 8 if color == chess.WHITE else square - 8
+                if chess.BB_PAWN_ATTACKS[color][stop] & enemy_pawns:
+                    counts[2] += sign
+            if not enemy_pawns & PASSED_MASKS[color][square]:
+                counts[3] += sign * (rank if color == chess.WHITE else 7 - rank)
+
+    open_files = 0
+    for file_mask in chess.BB_FILES:
+        if not board.pawns & file_mask:
+            open_files |= file_mask
+    return counts[0], counts[1], counts[2], counts[3], open_files
+
+
+class PawnEntry:
+    """
+    Pawn-structure evaluation of one pawn key.
+
+    ``score`` is the pawn terms from white's perspective and ``open_files``
+    the mask of files without pawns. Pawn shields also depend on where the
+    king stands, so the last shield score of each color is kept together
+    with the king square it was computed for.
+    """
+
+    __slots__ = ('score', 'open_files', 'king_squares', 'shields')
+
+    def __init__(self, score, open_files):
+        self.score = score
+        self.open_files = open_files
+        self.king_squares = {chess.WHITE: None, chess.BLACK: None}
+        self.shields = {chess.WHITE: 0, chess.BLACK: 0}
+
+
+class HashCache:
+    """
+    Fixed-size, direct-mapped cache of values by 64-bit key.
+
+    A new value replaces whatever shared its slot. Probes and hits are
+    counted for as long as the cache lives, which is across searches for
+    the engine's pawn hash table and evaluation cache.
+    """
+
+    def __init__(self, entries):
+        self.slots = [None] * max(1, entries)
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        """Return the value stored for ``key``, or None."""
+        self.probes += 1
+        slot = self.slots[key % len(self.slots)]
+        if slot is not None and slot[0] == key:
+            self.hits += 1
+            return slot[1]
+        return None
+
+    def store(self, key, value):
+        self.slots[key % len(self.slots)] = (key, value)
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else None
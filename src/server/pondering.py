@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+
+from coalescing import CANCEL_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Extra seconds a ponder search gets beyond its budget before it counts as stuck
+PONDER_GRACE = 5.0
+
+# Longest wait for news of a followed ponder search
+FOLLOW_POLL_INTERVAL = 0.1
+
+
+class _Ponder:
+    """A background search of one predicted position."""
+
+    def __init__(self, key, fen, moves, game_session):
+        self.key = key
+        self.fen = fen
+        self.moves = moves
+        self.game_session = game_session
+        self.started = time.monotonic()
+        self.cancel = threading.Event()
+        self.condition = threading.Condition()
+        self.infos = []
+        self.result = None
+        self.finished = False
+
+    def follow(self, depth=None, time_limit=None, timeout=None):
+        """
+        Yield the search's ('progress', info) reports, then ('result', result).
+
+        Reports already made are replayed first, and ('heartbeat', None) is
+        yielded while the search is quiet. The result is the search's own
+        once it finishes, or is built from the latest report as soon as it
+        satisfies ``depth`` or the search has run for ``time_limit`` seconds.
+        Nothing more is yielded if the search ends short of ``depth`` or
+        ``timeout`` passes first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        sent = 0
+        while True:
+            with self.condition:
+                if sent == len(self.infos) and not self.finished:
+                    wait = FOLLOW_POLL_INTERVAL
+                    if time_limit is not None and sent:
+                        wait = min(wait, max(0.0, self.started + time_limit - time.monotonic()))
+                    if deadline is not None:
+                        wait = min(wait, max(0.0, deadline - time.monotonic()))
+                    self.condition.wait(wait)
+                infos = self.infos[sent:]
+                finished, result = self.finished, self.result
+            for info in infos:
+                yield 'progress', info
+            sent += len(infos)
+
+            if finished:
+                if result is not None and (depth is None or result[2] >= depth):
+                    yield 'result', result
+                return
+            latest = self.infos[sent - 1] if sent else None
+            if latest is not None and (
+                    (depth is not None and latest['depth'] >= depth)
+                    or (time_limit is not None and time.monotonic() - self.started >= time_limit)):
+                yield 'result', (latest['move'], latest['score'], latest['depth'], latest['pv'], None,
+                                 [(latest['move'], latest['score'], latest['pv'])])
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            if not infos:
+                yield 'heartbeat', None
+
+
+class Ponderer:
+    """
+    Search the expected next position of each session in the background.
+
+    After a session gets its answer, ``start`` searches the position after
+    the suggested move and the predicted reply on an idle engine worker,
+    for at most ``budget`` seconds. The session's next request ``take``s
+    the ponder: on a hit it follows the running search (or gets its
+    finished result) instead of starting over, on a miss the search is
+    stopped at once. Ponder searches never wait for a worker, and
+    ``make_room`` stops one when a real request finds every worker busy.
+    ``on_result`` is called with each finished ponder search's result.
+    A search for a game session replays its ``moves`` and uses the
+    session's search state, like the session's own searches.
+    """
+
+    def __init__(self, pool, budget, on_result=None, collect_stats=False):
+        self.pool = pool
+        self.budget = budget
+        self.on_result = on_result
+        self.collect_stats = collect_stats
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, session_id, key, fen, moves=(), game_session=None):
+        """Ponder on ``fen`` and ``moves`` for a session, replacing its previous ponder search."""
+        ponder = _Ponder(key, fen, moves, game_session)
+        with self.lock:
+            previous = self.sessions.get(session_id)
+            if previous is not None:
+                previous.cancel.set()
+            self.sessions[session_id] = ponder
+            self.started += 1
+        threading.Thread(target=self._search, args=(session_id, ponder),
+                         name="ponder-search", daemon=True).start()
+
+    def take(self, session_id, key):
+        """
+        The session's ponder search if it was for ``key``, else None.
+
+        Either way the session has no ponder search afterwards; a search
+        for another position is stopped.
+        """
+        with self.lock:
+            ponder = self.sessions.pop(session_id, None)
+            if ponder is None:
+                return None
+            if ponder.key != key:
+                ponder.cancel.set()
+                self.misses += 1
+                return None
+            self.hits += 1
+            return ponder
+
+    def stop(self, ponder):
+        """Stop a ponder search returned by ``take`` once it is no longer followed."""
+        ponder.cancel.set()
+
+    def forget(self, session_id):
+        """Stop the ponder search of a session that has ended."""
+        with self.lock:
+            ponder = self.sessions.pop(session_id, None)
+        if ponder is not None:
+            ponder.cancel.set()
+
+    def make_room(self):
+        """Stop the oldest ponder search if no engine worker is idle."""
+        stats = self.pool.stats()
+        if stats['busy'] < stats['workers']:
+            return
+        with self.lock:
+            running = [(ponder.started, session_id) for session_id, ponder in self.sessions.items()
+                       if not ponder.finished]
+            if not running:
+                return
+            _, session_id = min(running)
+            self.sessions.pop(session_id).cancel.set()
+
+    def _search(self, session_id, ponder):
+        try:
+            # Only an idle worker is used; pondering never delays real requests
+            stream = self.pool.stream(ponder.fen, None, self.budget, 1, self.collect_stats, 1,
+                                      ponder.moves, ponder.game_session,
+                                      timeout=self.budget + PONDER_GRACE, queue_timeout=0,
+                                      heartbeat=CANCEL_POLL_INTERVAL, affinity=ponder.game_session)
+            try:
+                for kind, value in stream:
+                    if ponder.cancel.is_set():
+                        break
+                    if kind == 'progress':
+                        with ponder.condition:
+                            ponder.infos.append(value)
+                            ponder.condition.notify_all()
+                    elif kind == 'result':
+                        ponder.result = value
+            finally:
+                # Closing the stream early stops the search on its worker
+                stream.close()
+            if ponder.result is not None and self.on_result is not None:
+                self.on_result(ponder.fen, ponder.key, ponder.result)
+        except TimeoutError:
+            logger.debug("No idle engine worker to ponder on")
+        except Exception as e:
+            logger.warning(f"Ponder search failed: {e}")
+
+        with ponder.condition:
+            ponder.finished = True
+            ponder.condition.notify_all()
+        with self.lock:
+            # A finished search's result stays available through the result cache
+            if self.sessions.get(session_id) is ponder:
+                del self.sessions[session_id]
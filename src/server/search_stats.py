@@ -0,0 +1,133 @@
+import time
+
+# Evaluation terms timed while statistics are collected. evaluate_static
+# includes the others, and evaluate_material includes evaluate_piece_squares
+EVAL_TERMS = (
+    'evaluate_static',
+    'evaluate_material',
+    'evaluate_piece_squares',
+    'evaluate_pawn_structure',
+    'evaluate_center_control',
+    'evaluate_development',
+    'evaluate_king_safety',
+    'evaluate_threats',
+)
+
+
+class SearchStats:
+    """
+    Counters for one search.
+
+    The engine only counts while an instance is attached to it; otherwise
+    its ``stats`` attribute is None and each counting site costs a single
+    ``is not None`` test. Evaluation terms are timed by shadowing the
+    engine's evaluate_* methods with timed wrappers on attach, so they cost
+    nothing when statistics are off.
+    """
+
+    __slots__ = ('nodes', 'qnodes', 'tt_probes', 'tt_hits', 'cutoffs', 'first_move_cutoffs',
+                 'null_move_cutoffs', 'razor_cutoffs', 'futility_pruned', 'reductions', 're_searches',
+                 'pawn_hash_probes', 'pawn_hash_hits', 'eval_cache_probes', 'eval_cache_hits', 'iteration_nodes', 'depth', 'eval_calls', 'eval_seconds')
+
+    def __init__(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        # Selective search: nodes cut by a null move or razoring, quiet moves
+        # skipped by futility pruning, reduced moves and failed reduced,
+        # null-window or aspiration searches that had to be repeated
+        self.null_move_cutoffs = 0
+        self.razor_cutoffs = 0
+        self.futility_pruned = 0
+        self.reductions = 0
+        self.re_searches = 0
+        # Pawn hash table and evaluation cache use, taken on detach from the
+        # engine's counters, which run for the life of the engine
+        self.pawn_hash_probes = 0
+        self.pawn_hash_hits = 0
+        self.eval_cache_probes = 0
+        self.eval_cache_hits = 0
+        # Nodes searched by each completed iteration
+        self.iteration_nodes = []
+        self.depth = 0
+        self.eval_calls = dict.fromkeys(EVAL_TERMS, 0)
+        self.eval_seconds = dict.fromkeys(EVAL_TERMS, 0.0)
+
+    def attach(self, engine):
+        """Start counting on ``engine``; returns self."""
+        engine.stats = self
+        for term in EVAL_TERMS:
+            setattr(engine, term, self._timed(term, getattr(engine, term)))
+        self._count_caches(engine, -1)
+        return self
+
+    def detach(self, engine):
+        """Stop counting and restore the engine's evaluation methods."""
+        engine.stats = None
+        for term in EVAL_TERMS:
+            engine.__dict__.pop(term, None)
+        self._count_caches(engine, 1)
+
+    def _count_caches(self, engine, sign):
+        for name in ('pawn_hash', 'eval_cache'):
+            cache = getattr(engine, name, None)
+            if cache is not None:
+                setattr(self, f'{name}_probes', getattr(self, f'{name}_probes') + sign * cache.probes)
+                setattr(self, f'{name}_hits', getattr(self, f'{name}_hits') + sign * cache.hits)
+
+    def _timed(self, term, method):
+        calls, seconds = self.eval_calls, self.eval_seconds
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                seconds[term] += time.perf_counter() - start
+                calls[term] += 1
+        return timed
+
+    def record_cutoff(self, move_index):
+        self.cutoffs += 1
+        if move_index == 0:
+            self.first_move_cutoffs += 1
+
+    def record_iteration(self, depth, total_nodes):
+        self.iteration_nodes.append(total_nodes - sum(self.iteration_nodes))
+        self.depth = depth
+
+    def branching_factor(self):
+        """Ratio of the nodes of the last two completed iterations, or None."""
+        if len(self.iteration_nodes) < 2 or not self.iteration_nodes[-2]:
+            return None
+        return self.iteration_nodes[-1] / self.iteration_nodes[-2]
+
+    def as_dict(self):
+        return {
+            'nodes': self.nodes,
+            'qnodes': self.qnodes,
+            'tt_probes': self.tt_probes,
+            'tt_hits': self.tt_hits,
+            'tt_hit_rate': self.tt_hits / self.tt_probes if self.tt_probes else None,
+            'cutoffs': self.cutoffs,
+            'first_move_cutoffs': self.first_move_cutoffs,
+            'first_move_cutoff_rate': self.first_move_cutoffs / self.cutoffs if self.cutoffs else None,
+            'null_move_cutoffs': self.null_move_cutoffs,
+            'razor_cutoffs': self.razor_cutoffs,
+            'futility_pruned': self.futility_pruned,
+            'reductions': self.reductions,
+            're_searches': self.re_searches,
+            'pawn_hash_probes': self.pawn_hash_probes,
+            'pawn_hash_hits': self.pawn_hash_hits,
+            'pawn_hash_hit_rate': self.pawn_hash_hits / self.pawn_hash_probes if self.pawn_hash_probes else None,
+            'eval_cache_probes': self.eval_cache_probes,
+            'eval_cache_hits': self.eval_cache_hits,
+            'eval_cache_hit_rate': self.eval_cache_hits / self.eval_cache_probes if self.eval_cache_probes else None,
+            'branching_factor': self.branching_factor(),
+            'depth': self.depth,
+            'eval_calls': dict(self.eval_calls),
+            'eval_ms': {term: seconds * 1000 for term, seconds in self.eval_seconds.items()},
+        }
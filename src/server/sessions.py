@@ -0,0 +1,167 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import chess
+import chess.polyglot
+
+
+def position_history(board):
+    """
+    The part of a game that positions can still repeat from.
+
+    Returns (FEN, UCI moves, keys): the position after the last capture or
+    pawn move, the moves played since, and the Zobrist keys of the
+    positions from there on, the current one last. Positions before that
+    move can never occur again.
+    """
+    board = board.copy()
+    keys = [chess.polyglot.zobrist_hash(board)]
+    moves = []
+    for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+        moves.append(board.pop().uci())
+        keys.append(chess.polyglot.zobrist_hash(board))
+    moves.reverse()
+    keys.reverse()
+    return board.fen(), tuple(moves), keys
+
+
+class GameSession:
+    """One game followed move by move: its board, with the moves played on it."""
+
+    def __init__(self, session_id, board):
+        self.id = session_id
+        self.board = board
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def snapshot(self):
+        """A copy of the current board, move stack included."""
+        with self.lock:
+            return self.board.copy()
+
+    def play(self, moves, undo=0):
+        """
+        Take back ``undo`` moves, then play the UCI ``moves``.
+
+        Either every move is played or, when one is illegal, none are and
+        ValueError is raised. Returns the new board's copy.
+        """
+        with self.lock:
+            board = self.board.copy()
+            if not 0 <= undo <= len(board.move_stack):
+                raise ValueError(f"Cannot take back {undo} moves, {len(board.move_stack)} were played")
+            for _ in range(undo):
+                board.pop()
+            for uci in moves:
+                board.push_uci(uci)
+            self.board = board
+            return board.copy()
+
+
+class SessionStore:
+    """
+    Game sessions by id, for the web server's threads.
+
+    A session unused for ``idle_seconds`` is evicted, and so is the least
+    recently used one when a new session would exceed ``max_sessions``.
+    ``on_close`` is called with the id of every session that is deleted or
+    evicted, outside the store's lock.
+    """
+
+    def __init__(self, max_sessions, idle_seconds, on_close=None):
+        self.max_sessions = max(1, max_sessions)
+        self.idle_seconds = idle_seconds
+        self.on_close = on_close
+        self.lock = threading.Lock()
+        # Least recently used first
+        self.sessions = OrderedDict()
+        self.created = 0
+        self.evicted = 0
+
+    def create(self, board):
+        """Start a session on ``board`` and return it."""
+        session = GameSession(uuid.uuid4().hex, board)
+        with self.lock:
+            closed = self._expire(session.last_used)
+            self.sessions[session.id] = session
+            while len(self.sessions) > self.max_sessions:
+                closed.append(self.sessions.popitem(last=False)[0])
+                self.evicted += 1
+            self.created += 1
+        self._closed(closed)
+        return session
+
+    def get(self, session_id):
+        """The session with this id, marked as used, or None if it is unknown or was evicted."""
+        now = time.monotonic()
+        with self.lock:
+            closed = self._expire(now)
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self.sessions.move_to_end(session_id)
+        self._closed(closed)
+        return session
+
+    def delete(self, session_id):
+        """End a session; returns whether it existed."""
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self._closed([session_id])
+        return session is not None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _expire(self, now):
+        """Evict the sessions idle for too long; returns their ids."""
+        closed = []
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if now - session.last_used < self.idle_seconds:
+                break
+            del self.sessions[session_id]
+            closed.append(session_id)
+            self.evicted += 1
+        return closed
+
+    def _closed(self, session_ids):
+        if self.on_close is not None:
+            for session_id in session_ids:
+                self.on_close(session_id)
+
+
+class SearchStates:
+    """
+    Search state kept by an engine for each game session it searched.
+
+    ``factory()`` builds a new session's state. At most ``max_states`` are
+    kept; the least recently used one is dropped to make room, and states
+    unused for ``idle_seconds`` are dropped whenever one is looked up.
+    """
+
+    def __init__(self, factory, max_states, idle_seconds):
+        self.factory = factory
+        self.max_states = max_states
+        self.idle_seconds = idle_seconds
+        # session id -> (last used, state), least recently used first
+        self.states = OrderedDict()
+
+    def get(self, session_id):
+        """The session's state, created on first use."""
+        now = time.monotonic()
+        while self.states:
+            oldest_id, (last_used, _) = next(iter(self.states.items()))
+            if now - last_used < self.idle_seconds:
+                break
+            del self.states[oldest_id]
+
+        entry = self.states.pop(session_id, None)
+        state = entry[1] if entry is not None else self.factory()
+        self.states[session_id] = (now, state)
+        while len(self.states) > self.max_states:
+            self.states.popitem(last=False)
+        return state
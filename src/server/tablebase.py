@@ -0,0 +1,502 @@
+"""
+Distance-to-mate endgame tables for positions with up to four pieces.
+
+Tables are generated locally by retrograde analysis and stored one file
+per material balance (e.g. ``KRvK.ctb``). Each file is a small header
+followed by one signed 16-bit value per position, indexed by a
+symmetry-reduced position index, so a probe is one lookup in a
+memory-mapped file.
+
+Generate the tables with::
+
+    python tablebase.py --dir tablebases            # all 3-man tables
+    python tablebase.py --dir tablebases --four     # 3- and 4-man tables
+    python tablebase.py --dir tablebases KQvKR      # one table and its dependencies
+"""
+import argparse
+import logging
+import mmap
+import os
+import struct
+import time
+from array import array
+
+import chess
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CTB1'
+# Magic, material name, number of positions
+HEADER = struct.Struct('<4s16sI')
+FILE_EXTENSION = '.ctb'
+
+# Values are from the side to move's perspective: 0 is a draw, v > 0 wins
+# with mate in v plies and v < 0 loses with mate in -v - 1 plies
+DRAW = 0
+
+# Scores returned to the search: mate is worth MATE_SCORE, a longer mate less
+MATE_SCORE = 20000
+
+PIECE_ORDER = 'KQRBNP'
+PIECE_TYPES = {symbol: chess.PIECE_SYMBOLS.index(symbol.lower()) for symbol in PIECE_ORDER}
+PIECE_WEIGHTS = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+
+def win_value(dtm):
+    return dtm
+
+
+def loss_value(dtm):
+    return -dtm - 1
+
+
+def value_dtm(value):
+    """Plies to mate for a stored value (winning or losing)."""
+    return value if value > 0 else -value - 1
+
+
+def _side_key(pieces):
+    return ''.join(sorted(pieces, key=PIECE_ORDER.index))
+
+
+def material_name(board):
+    """Material of a board as e.g. "KRvK", White's pieces first."""
+    sides = []
+    for color in (chess.WHITE, chess.BLACK):
+        sides.append(''.join(symbol * chess.popcount(board.pieces_mask(PIECE_TYPES[symbol], color))
+                             for symbol in PIECE_ORDER))
+    return 'v'.join(sides)
+
+
+def canonical_name(name):
+    """Orientation a table is stored in: the stronger side first."""
+    white, black = name.split('v')
+    white, black = _side_key(white), _side_key(black)
+
+    def strength(side):
+        return (sum(PIECE_WEIGHTS[p] for p in side), len(side), [-PIECE_ORDER.index(p) for p in side])
+
+    if strength(black) > strength(white):
+        white, black = black, white
+    return f"{white}v{black}"
+
+
+def _transpose(square):
+    return chess.square(chess.square_rank(square), chess.square_file(square))
+
+
+def _build_symmetries(pawns):
+    """Per white king square: the square map that moves it into the reduced region."""
+    symmetries = []
+    for king in chess.SQUARES:
+        flip = 7 if chess.square_file(king) > 3 else 0
+        if not pawns and chess.square_rank(king) > 3:
+            flip |= 56
+        reduced = king ^ flip
+        transpose = not pawns and chess.square_rank(reduced) > chess.square_file(reduced)
+        symmetries.append([_transpose(square ^ flip) if transpose else square ^ flip
+                           for square in chess.SQUARES])
+    return symmetries
+
+
+SYMMETRIES = {pawns: _build_symmetries(pawns) for pawns in (False, True)}
+TRANSPOSE = [_transpose(square) for square in chess.SQUARES]
+
+# Squares the white king is moved to: the a1-d1-d4 triangle without pawns,
+# the a- to d-files with pawns
+KING_SQUARES = {
+    False: [s for s in chess.SQUARES if chess.square_file(s) <= 3 and chess.square_rank(s) <= chess.square_file(s)],
+    True: [s for s in chess.SQUARES if chess.square_file(s) <= 3],
+}
+KING_INDEX = {pawns: {square: i for i, square in enumerate(squares)} for pawns, squares in KING_SQUARES.items()}
+
+
+class TableIndex:
+    """
+    Position numbering for one material balance.
+
+    Pieces are ordered white king, other white pieces, black king, other
+    black pieces. A position is mirrored so the white king lies in the
+    reduced region, then numbered as
+    ``((side * kings + king) * 64 + square_1) * 64 + ... + square_n``.
+    Without pawns, a king on the a1-h8 diagonal leaves a choice between
+    a position and its transpose; the one with the smaller squares is used,
+    so every position has exactly one index.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        white, black = name.split('v')
+        self.pieces = ([(chess.WHITE, PIECE_TYPES[p]) for p in white] +
+                       [(chess.BLACK, PIECE_TYPES[p]) for p in black])
+        self.black_king_slot = len(white)
+        self.pawns = 'P' in name
+        self.symmetry = SYMMETRIES[self.pawns]
+        self.king_squares = KING_SQUARES[self.pawns]
+        self.king_index = KING_INDEX[self.pawns]
+        self.size = 2 * len(self.king_squares) * 64 ** (len(self.pieces) - 1)
+
+    def index(self, squares, turn):
+        """Index of a position given the square of each piece and the side to move."""
+        transform = self.symmetry[squares[0]]
+        king = transform[squares[0]]
+        others = [transform[square] for square in squares[1:]]
+        if not self.pawns and chess.square_file(king) == chess.square_rank(king):
+            transposed = [TRANSPOSE[square] for square in others]
+            if transposed < others:
+                others = transposed
+        index = (0 if turn == chess.WHITE else 1) * len(self.king_squares) + self.king_index[king]
+        for square in others:
+            index = index * 64 + square
+        return index
+
+    def decode(self, index):
+        """Inverse of index: (squares, side to move)."""
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, square = divmod(index, 64)
+            squares.append(square)
+        side, king = divmod(index, len(self.king_squares))
+        squares.append(self.king_squares[king])
+        squares.reverse()
+        return squares, chess.WHITE if side == 0 else chess.BLACK
+
+    def board_squares(self, board):
+        """Squares of the table's pieces on a board with this material."""
+        remaining = {}
+        squares = []
+        for color, piece_type in self.pieces:
+            key = (color, piece_type)
+            if key not in remaining:
+                remaining[key] = list(chess.scan_forward(board.pieces_mask(piece_type, color)))
+            squares.append(remaining[key].pop(0))
+        return squares
+
+
+class Tablebase:
+    """
+    Probe access to the tables in a directory.
+
+    Files are memory-mapped when first needed, so probing costs one index
+    computation and one array read. Positions with castling rights or a
+    legal en passant capture are not covered and probe as None.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.available = set()
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.endswith(FILE_EXTENSION):
+                    self.available.add(filename[:-len(FILE_EXTENSION)])
+        self.max_pieces = max((len(name) - 1 for name in self.available), default=2)
+
+    def _table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            with open(os.path.join(self.directory, name + FILE_EXTENSION), 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, stored_name, size = HEADER.unpack_from(data)
+            if magic != MAGIC or stored_name.rstrip(b'\0').decode() != name:
+                raise ValueError(f"{name}{FILE_EXTENSION} is not a valid table")
+            table = (TableIndex(name), memoryview(data)[HEADER.size:HEADER.size + 2 * size].cast('h'), data)
+            self.tables[name] = table
+        return table
+
+    def add(self, name):
+        """Make a newly written table available."""
+        self.available.add(name)
+        self.max_pieces = max(self.max_pieces, len(name) - 1)
+
+    def probe_value(self, board):
+        """Stored value of the position for the side to move, or None if it is not covered."""
+        if board.castling_rights or chess.popcount(board.occupied) > self.max_pieces:
+            return None
+        name = material_name(board)
+        if name == 'KvK':
+            return DRAW
+        if name not in self.available:
+            flipped = canonical_name(name)
+            if flipped == name or flipped not in self.available:
+                return None
+            board = board.mirror()
+            name = flipped
+        if board.has_legal_en_passant():
+            return None
+        index, values, _ = self._table(name)
+        return values[index.index(index.board_squares(board), board.turn)]
+
+    def probe_score(self, board):
+        """Score from White's perspective, or None if the position is not covered."""
+        value = self.probe_value(board)
+        if value is None:
+            return None
+        if value == DRAW:
+            return 0
+        score = MATE_SCORE - value_dtm(value)
+        if value < 0:
+            score = -score
+        return score if board.turn == chess.WHITE else -score
+
+    def best_move(self, board):
+        """Return (move, White's score) of the fastest win or slowest loss, or None if not covered."""
+        if self.probe_value(board) is None:
+            return None
+
+        best = None
+        for move in board.legal_moves:
+            board.push(move)
+            if board.is_checkmate():
+                value = loss_value(0)
+            else:
+                value = self.probe_value(board)
+            board.pop()
+            if value is None:
+                return None
+            # Rank moves by the result for the mover: quick wins, then draws, then slow losses
+            if value < 0:
+                rank = (2, -value_dtm(value))
+            elif value == DRAW:
+                rank = (1, 0)
+            else:
+                rank = (0, value_dtm(value))
+            if best is None or rank > best[0]:
+                best = (rank, move)
+
+        if best is None:
+            return None
+        return best[1], self.probe_score(board)
+
+    def close(self):
+        for _, values, data in self.tables.values():
+            values.release()
+            data.close()
+        self.tables = {}
+
+
+def _unmove_origins(piece_type, color, square, occupied):
+    """Squares a piece on ``square`` could have come from with a non-capturing move."""
+    empty = ~occupied & chess.BB_ALL
+    if piece_type == chess.PAWN:
+        step = -8 if color == chess.WHITE else 8
+        origin = square + step
+        origins = 0
+        if 8 <= origin < 56 and not occupied & chess.BB_SQUARES[origin]:
+            origins |= chess.BB_SQUARES[origin]
+            double_rank = 3 if color == chess.WHITE else 4
+            if chess.square_rank(square) == double_rank and not occupied & chess.BB_SQUARES[origin + step]:
+                origins |= chess.BB_SQUARES[origin + step]
+        return origins
+    if piece_type == chess.KNIGHT:
+        return chess.BB_KNIGHT_ATTACKS[square] & empty
+    if piece_type == chess.KING:
+        return chess.BB_KING_ATTACKS[square] & empty
+    attacks = 0
+    if piece_type in (chess.ROOK, chess.QUEEN):
+        attacks |= (chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+                    chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied])
+    if piece_type in (chess.BISHOP, chess.QUEEN):
+        attacks |= chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+    return attacks & empty
+
+
+class TablebaseGenerator:
+    """
+    Builds tables by retrograde analysis.
+
+    A forward pass with python-chess move generation finds mates,
+    stalemates and the results of captures and promotions (looked up in
+    the smaller tables, which are generated first). The retrograde pass
+    then walks un-moves back from every decided position in order of
+    distance to mate: a predecessor of a lost position is won, and a
+    position all of whose moves lead to won positions is lost. Whatever
+    is left undecided is a draw. En passant is not modelled.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.tablebase = Tablebase(directory)
+
+    def generate(self, name, force=False):
+        """Generate a table and any smaller tables it depends on."""
+        name = canonical_name(name)
+        if name in self.tablebase.available and not force:
+            return
+        for dependency in self._dependencies(name):
+            self.generate(dependency)
+
+        start = time.monotonic()
+        values = self._solve(TableIndex(name))
+        path = os.path.join(self.directory, name + FILE_EXTENSION)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(HEADER.pack(MAGIC, name.encode(), len(values)))
+            if values.itemsize != 2 or struct.pack('=h', 1) != struct.pack('<h', 1):
+                values = array('h', values)
+                values.byteswap()
+            f.write(values.tobytes())
+        os.replace(path + '.tmp', path)
+        self.tablebase.add(name)
+        logger.info(f"Generated {name} ({len(values)} positions) in {time.monotonic() - start:.1f}s")
+
+    def _dependencies(self, name):
+        """Tables reachable by a capture, a promotion or both."""
+        white, black = name.split('v')
+        result = set()
+        for side, other, white_moves in ((white, black, True), (black, white, False)):
+            captured = {other} | {other[:i] + other[i + 1:] for i, piece in enumerate(other) if piece != 'K'}
+            promoted = {side} | {_side_key(side[:i] + piece + side[i + 1:])
+                                 for i, p in enumerate(side) if p == 'P' for piece in 'QRBN'}
+            for own in promoted:
+                for opponent in captured:
+                    if (own, opponent) != (side, other):
+                        result.add(f"{own}v{opponent}" if white_moves else f"{opponent}v{own}")
+        return {canonical_name(n) for n in result if n != 'KvK'}
+
+    def _solve(self, table):
+        size = table.size
+        pieces = table.pieces
+        count = len(pieces)
+        values = array('h', bytes(2 * size))
+        # 1 for positions that can occur, 2 once their value is final
+        state = bytearray(size)
+        remaining = bytearray(size)
+        # Best known win for positions with a winning capture or promotion
+        best_win = array('h', bytes(2 * size))
+        # Longest loss over captures and promotions, -1 if a capture draws
+        exit_loss = array('h', bytes(2 * size))
+        win_buckets = {}
+        loss_buckets = {}
+
+        def push(buckets, dtm, index):
+            buckets.setdefault(dtm, []).append(index)
+
+        board = chess.Board(None)
+        black_king = table.black_king_slot
+        pawn_slots = [i for i, (_, piece_type) in enumerate(pieces) if piece_type == chess.PAWN]
+        piece_objects = [chess.Piece(piece_type, color) for color, piece_type in pieces]
+
+        # Forward pass
+        for index in range(size):
+            squares, turn = table.decode(index)
+            if len(set(squares)) < count or table.index(squares, turn) != index:
+                continue
+            if any(chess.square_rank(squares[i]) in (0, 7) for i in pawn_slots):
+                continue
+            if chess.square_distance(squares[0], squares[black_king]) <= 1:
+                continue
+            board.set_piece_map(dict(zip(squares, piece_objects)))
+            board.turn = turn
+            if board.is_attacked_by(turn, board.king(not turn)):
+                continue
+            state[index] = 1
+
+            children = set()
+            has_moves = False
+            exit_draw = False
+            longest_loss = 0
+            quickest_win = 0
+            slot_of = {square: slot for slot, square in enumerate(squares)}
+            for move in board.generate_legal_moves():
+                has_moves = True
+                if move.promotion or board.is_capture(move):
+                    board.push(move)
+                    value = DRAW if board.is_stalemate() else (
+                        loss_value(0) if board.is_checkmate() else self.tablebase.probe_value(board))
+                    board.pop()
+                    if value is None:
+                        raise RuntimeError(f"Missing table for a capture or promotion from {table.name}")
+                    if value < 0:
+                        dtm = value_dtm(value) + 1
+                        quickest_win = dtm if not quickest_win else min(quickest_win, dtm)
+                    elif value == DRAW:
+                        exit_draw = True
+                    else:
+                        longest_loss = max(longest_loss, value_dtm(value) + 1)
+                else:
+                    moved = list(squares)
+                    moved[slot_of[move.from_square]] = move.to_square
+                    children.add(table.index(moved, not turn))
+
+            if not has_moves:
+                if board.is_check():
+                    push(loss_buckets, 0, index)
+                else:
+                    state[index] = 2
+                continue
+
+            remaining[index] = len(children)
+            exit_loss[index] = -1 if exit_draw else longest_loss
+            if quickest_win:
+                best_win[index] = quickest_win
+                push(win_buckets, quickest_win, index)
+            elif not children and not exit_draw:
+                push(loss_buckets, longest_loss, index)
+
+        # Retrograde pass, in order of distance to mate
+        dtm = 0
+        while win_buckets or loss_buckets:
+            for buckets, winning in ((loss_buckets, False), (win_buckets, True)):
+                for index in buckets.pop(dtm, ()):
+                    if state[index] == 2:
+                        continue
+                    state[index] = 2
+                    values[index] = win_value(dtm) if winning else loss_value(dtm)
+
+                    squares, turn = table.decode(index)
+                    mover = not turn
+                    occupied = 0
+                    for square in squares:
+                        occupied |= chess.BB_SQUARES[square]
+                    predecessors = set()
+                    for slot, (color, piece_type) in enumerate(pieces):
+                        if color != mover:
+                            continue
+                        for origin in chess.scan_forward(_unmove_origins(piece_type, color, squares[slot], occupied)):
+                            previous = list(squares)
+                            previous[slot] = origin
+                            predecessors.add(table.index(previous, mover))
+
+                    for previous in predecessors:
+                        if state[previous] != 1:
+                            continue
+                        if not winning:
+                            # A move into a lost position wins
+                            if not best_win[previous] or dtm + 1 < best_win[previous]:
+                                best_win[previous] = dtm + 1
+                                push(win_buckets, dtm + 1, previous)
+                        else:
+                            remaining[previous] -= 1
+                            if remaining[previous] == 0 and not best_win[previous] and exit_loss[previous] >= 0:
+                                push(loss_buckets, max(dtm + 1, exit_loss[previous]), previous)
+            dtm += 1
+        return values
+
+
+ALL_PIECES = 'QRBNP'
+
+
+def standard_tables(max_pieces):
+    """Names of all tables with up to max_pieces pieces."""
+    names = {f"K{a}vK" for a in ALL_PIECES}
+    if max_pieces >= 4:
+        for i, a in enumerate(ALL_PIECES):
+            for b in ALL_PIECES[i:]:
+                names.add(f"K{a}{b}vK")
+                names.add(canonical_name(f"K{a}vK{b}"))
+    return sorted(names, key=lambda name: (len(name), name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate distance-to-mate endgame tables.")
+    parser.add_argument('tables', nargs='*', help="tables to generate, e.g. KRvK (default: all 3-man tables)")
+    parser.add_argument('--dir', default='tablebases', help="output directory")
+    parser.add_argument('--four', action='store_true', help="also generate all 4-man tables")
+    parser.add_argument('--force', action='store_true', help="regenerate existing tables")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    generator = TablebaseGenerator(args.dir)
+    for name in args.tables or standard_tables(4 if args.four else 3):
+        generator.generate(name, force=args.force)
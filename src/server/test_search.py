@@ -0,0 +1,22 @@
+import chess
+
+from app import ImprovedChessEngine
+
+
+def board_after(*moves):
+    board = chess.Board()
+    for move in moves:
+        board.push_san(move)
+    return board
+
+
+def test_quiescence_searches_evasions_when_in_check():
+    # After 3.Bxf7+ Black's stand-pat is meaningless; Kxf7 wins the bishop
+    board = board_after('e4', 'e5', 'Bc4', 'Nc6', 'Bxf7+')
+    assert ImprovedChessEngine().quiescence_search(board, -50, 50) == 50
+
+
+def test_bishop_sacrifice_on_f7_is_not_a_win():
+    board = board_after('e4', 'e5')
+    move, score = ImprovedChessEngine().get_best_move(board, depth=3, use_book=False)
+    assert score < 100
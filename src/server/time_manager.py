@@ -0,0 +1,48 @@
+import time
+
+# Assumed number of moves left in the game when the clock has no move count
+DEFAULT_MOVES_TO_GO = 30
+
+# Time kept in reserve for network and bookkeeping overhead
+MOVE_OVERHEAD_MS = 50
+
+# Never plan to search for less than this
+MIN_MOVE_TIME_MS = 10
+
+# Do not start another iteration once this share of the budget is used,
+# since the next depth usually takes several times longer than the last
+SOFT_LIMIT_RATIO = 0.5
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget runs out."""
+
+
+def allocate_time(clock_ms, increment_ms=0, moves_to_go=None):
+    """Return the time in seconds to spend on one move given the remaining clock."""
+    moves_to_go = moves_to_go or DEFAULT_MOVES_TO_GO
+    budget = clock_ms / moves_to_go + increment_ms * 0.75
+
+    # Never plan to use more than what is actually left on the clock
+    budget = min(budget, clock_ms - MOVE_OVERHEAD_MS)
+    return max(budget, MIN_MOVE_TIME_MS) / 1000.0
+
+
+class SearchClock:
+    """Tracks the hard deadline and the soft iteration limit of one search."""
+
+    def __init__(self, time_limit=None):
+        self.start = time.monotonic()
+        self.time_limit = time_limit
+        self.deadline = None if time_limit is None else self.start + time_limit
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def expired(self):
+        """True once the hard deadline has passed."""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def can_start_iteration(self):
+        """True if there is enough time left to start another depth."""
+        return self.time_limit is None or self.elapsed() < self.time_limit * SOFT_LIMIT_RATIO
@@ -0,0 +1,205 @@
+import struct
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import chess
+
+# Bound types stored with each search result
+EXACT = 0
+LOWER = 1  # Score is at least this value (fail high)
+UPPER = 2  # Score is at most this value (fail low)
+
+TTEntry = namedtuple('TTEntry', ['key', 'depth', 'bound', 'score', 'move', 'generation'])
+
+# Rough footprint of one stored entry (tuple, key, score, move and slot pointer)
+ENTRY_SIZE_BYTES = 192
+
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of search results keyed by Zobrist hash.
+
+    Every bucket has two slots: a depth-preferred slot that keeps the deepest
+    result seen for the bucket, and an always-replace slot that holds the most
+    recent one. Entries from older searches are replaced regardless of depth.
+    """
+
+    def __init__(self, size_mb=16):
+        self.num_buckets = max(1, (size_mb * 1024 * 1024) // (2 * ENTRY_SIZE_BYTES))
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        """Remove all entries."""
+        self.depth_slots = [None] * self.num_buckets
+        self.recent_slots = [None] * self.num_buckets
+
+    def new_search(self):
+        """Mark existing entries as belonging to a previous search."""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key):
+        """Return the stored entry for the given hash, or None."""
+        index = key % self.num_buckets
+        entry = self.depth_slots[index]
+        if entry is not None and entry.key == key:
+            return entry
+        entry = self.recent_slots[index]
+        if entry is not None and entry.key == key:
+            return entry
+        return None
+
+    def store(self, key, depth, bound, score, move):
+        """Store a search result, keeping the deeper entry in each bucket.
+
+        A shallower result never replaces a deeper one of the current
+        search, even for the same position; it goes to the always-replace
+        slot, where probes only find it after the deeper entry.
+        """
+        index = key % self.num_buckets
+        current = self.depth_slots[index]
+        if current is None or depth >= current.depth or current.generation != self.generation:
+            slots = self.depth_slots
+        else:
+            slots = self.recent_slots
+            current = slots[index]
+
+        # Keep a same-key hash move when the new result has none
+        if move is None and current is not None and current.key == key:
+            move = current.move
+        slots[index] = TTEntry(key, depth, bound, score, move, self.generation)
+
+    def hashfull(self):
+        """Approximate table usage in permille, sampled from the first buckets."""
+        sample = min(1000, self.num_buckets)
+        used = sum(1 for i in range(sample)
+                   if self.depth_slots[i] is not None and self.depth_slots[i].generation == self.generation)
+        return used * 1000 // sample
+
+
+# Layout of the shared table: two header words, then per bucket two slots of
+# two 64-bit words each (key ^ data, data)
+SHARED_HEADER_WORDS = 2
+SHARED_SLOT_WORDS = 2
+SHARED_BUCKET_WORDS = 2 * SHARED_SLOT_WORDS
+SHARED_GENERATION_MASK = 0x1F
+SHARED_VALID_BIT = 1 << 63
+
+
+def _pack_entry(depth, bound, score, move, generation):
+    """Pack an entry into one 64-bit word: score, move, depth, bound, generation."""
+    score_bits = struct.unpack('<I', struct.pack('<f', score))[0]
+    move_bits = 0
+    if move is not None:
+        move_bits = 0x8000 | (move.from_square << 9) | (move.to_square << 3) | (move.promotion or 0)
+    return (score_bits | move_bits << 32 | min(depth, 0xFF) << 48 | bound << 56
+            | generation << 58 | SHARED_VALID_BIT)
+
+
+def _unpack_entry(key, data):
+    score = struct.unpack('<f', struct.pack('<I', data & 0xFFFFFFFF))[0]
+    move_bits = (data >> 32) & 0xFFFF
+    move = None
+    if move_bits:
+        move = chess.Move((move_bits >> 9) & 0x3F, (move_bits >> 3) & 0x3F, (move_bits & 0x7) or None)
+    return TTEntry(key, (data >> 48) & 0xFF, (data >> 56) & 0x3, score, move,
+                   (data >> 58) & SHARED_GENERATION_MASK)
+
+
+class SharedTranspositionTable:
+    """
+    Transposition table in shared memory, used by several search processes.
+
+    Same interface and replacement scheme as TranspositionTable. Writes are
+    not locked: each slot stores ``key ^ data`` next to ``data``, so a slot
+    torn by two processes writing at once fails the key check and simply
+    reads as a miss. Scores are kept as 32-bit floats.
+
+    Create the table with a size in MB in one process, then attach to it in
+    the others with ``SharedTranspositionTable(name=table.name)``.
+    """
+
+    def __init__(self, size_mb=16, name=None):
+        if name is None:
+            num_buckets = max(1, (size_mb * 1024 * 1024) // (SHARED_BUCKET_WORDS * 8))
+            size = (SHARED_HEADER_WORDS + num_buckets * SHARED_BUCKET_WORDS) * 8
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+            self.words = self.shm.buf.cast('Q')
+            self.words[1] = num_buckets
+            self.clear()
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+            self.words = self.shm.buf.cast('Q')
+        self.name = self.shm.name
+        self.num_buckets = self.words[1]
+
+    @property
+    def generation(self):
+        return self.words[0]
+
+    def clear(self):
+        """Remove all entries."""
+        start = SHARED_HEADER_WORDS * 8
+        self.shm.buf[start:self.shm.size] = bytes(self.shm.size - start)
+
+    def new_search(self):
+        """Mark existing entries as belonging to a previous search.
+
+        Only the process that created the table advances the generation, so
+        helpers joining a search do not age the entries it has just written.
+        """
+        if self.owner:
+            self.words[0] = (self.words[0] + 1) & SHARED_GENERATION_MASK
+
+    def _read(self, offset, key):
+        data = self.words[offset + 1]
+        if data and self.words[offset] ^ data == key:
+            return _unpack_entry(key, data)
+        return None
+
+    def probe(self, key):
+        """Return the stored entry for the given hash, or None."""
+        base = SHARED_HEADER_WORDS + (key % self.num_buckets) * SHARED_BUCKET_WORDS
+        return self._read(base, key) or self._read(base + SHARED_SLOT_WORDS, key)
+
+    def _slot(self, offset):
+        """The entry in a slot whatever its key, or None if the slot is empty."""
+        data = self.words[offset + 1]
+        return _unpack_entry(self.words[offset] ^ data, data) if data else None
+
+    def store(self, key, depth, bound, score, move):
+        """Store a search result, keeping the deeper entry in each bucket (see TranspositionTable.store)."""
+        words = self.words
+        generation = words[0]
+        offset = SHARED_HEADER_WORDS + (key % self.num_buckets) * SHARED_BUCKET_WORDS
+        current = self._slot(offset)
+        if not (current is None or depth >= current.depth or current.generation != generation):
+            offset += SHARED_SLOT_WORDS
+            current = self._slot(offset)
+
+        # Keep a same-key hash move when the new result has none
+        if move is None and current is not None and current.key == key:
+            move = current.move
+
+        data = _pack_entry(depth, bound, score, move, generation)
+        words[offset] = key ^ data
+        words[offset + 1] = data
+
+    def hashfull(self):
+        """Approximate table usage in permille, sampled from the first buckets."""
+        sample = min(1000, self.num_buckets)
+        used = 0
+        for i in range(sample):
+            data = self.words[SHARED_HEADER_WORDS + i * SHARED_BUCKET_WORDS + 1]
+            if data and (data >> 58) & SHARED_GENERATION_MASK == self.generation:
+                used += 1
+        return used * 1000 // sample
+
+    def close(self):
+        """Detach from the shared memory, removing it if this process created it."""
+        self.words.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,407 @@
+"""
+Offline Texel tuning of ImprovedChessEngine's evaluation weights.
+
+Training positions are read from text files with one labeled position
+per line: a FEN followed by the result of the game it was taken from, as
+1-0, 0-1, 1/2-1/2 or 1.0, 0.5, 0.0, optionally quoted or bracketed, so
+EPD lines such as ``<fen> c9 "1-0";`` work too. Files ending in .gz are
+read compressed. Positions in check or without legal moves are skipped.
+
+The static evaluation is linear in each of the weights listed in
+eval_weights.py, so every position is reduced once to the coefficients
+of the weights in its evaluation. ``extract`` does this on a pool of
+worker processes and saves the result as a NumPy feature matrix. ``tune``
+then fits the weights to the game results by gradient descent (Adam, on
+shuffled mini-batches) on the mean squared error between the result and
+a sigmoid of the evaluation, computed for a whole batch at once, and
+writes a weights file to load with EVAL_WEIGHTS_PATH.
+
+    python tuning.py extract positions.epd more.epd.gz -o features.npz --workers 8
+    python tuning.py tune features.npz -o weights.json
+"""
+import argparse
+import collections
+import gzip
+import logging
+import math
+import multiprocessing
+import re
+import sys
+import time
+
+import chess
+import numpy as np
+
+from app import ImprovedChessEngine
+from attack_map import AttackMap, KING_ZONE_MASKS, SHIELD_SQUARES
+from eval_weights import TABLE_WEIGHTS, SCALAR_WEIGHTS, engine_weights, write_weights
+from incremental_eval import PHASE_WEIGHTS, MAX_PHASE
+from pawn_hash import pawn_structure
+
+logger = logging.getLogger(__name__)
+
+# Position of each weight in the parameter vector: the tables square by
+# square, then the single weights. The extra last entry is always zero and
+# pads rows of the feature matrix
+TABLE_OFFSETS = {name: i * 64 for i, name in enumerate(TABLE_WEIGHTS)}
+SCALAR_INDEX = {name: len(TABLE_WEIGHTS) * 64 + i for i, name in enumerate(SCALAR_WEIGHTS)}
+NUM_WEIGHTS = len(TABLE_WEIGHTS) * 64 + len(SCALAR_WEIGHTS)
+PADDING_INDEX = NUM_WEIGHTS
+
+PIECE_TABLES = {
+    chess.PAWN: 'pawn_position_values',
+    chess.KNIGHT: 'knight_position_values',
+    chess.BISHOP: 'bishop_position_values',
+    chess.ROOK: 'rook_position_values',
+    chess.QUEEN: 'queen_position_values',
+}
+
+# Nonzero coefficients per position: one table entry per piece, a second
+# one for each king, and the single weights
+ROW_WIDTH = 32 + 2 + len(SCALAR_WEIGHTS)
+
+# Game results, from white's side
+RESULTS = {'1-0': 1.0, '1.0': 1.0, '0-1': 0.0, '0.0': 0.0, '1/2-1/2': 0.5, '0.5': 0.5}
+RESULT_PATTERN = re.compile(r'[\s;,|]*["\[(]?(1-0|0-1|1/2-1/2|1\.0|0\.5|0\.0)[")\]]?;?\s*$')
+
+# Lines sent to a worker process at a time, and chunks in flight per worker
+CHUNK_LINES = 4096
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# Golden-section search range for the sigmoid scale
+SCALE_RANGE = (0.05, 5.0)
+
+
+def iter_lines(paths):
+    """Yield the non-empty lines of text files, decompressing .gz files."""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt') as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+
+def parse_line(line):
+    """Return (board, white's result) for a labeled position, or None if the line is not one."""
+    match = RESULT_PATTERN.search(line)
+    if match is None:
+        return None
+    fields = line[:match.start()].split()
+    if len(fields) < 4:
+        return None
+    # EPD lines carry opcodes instead of the move counters
+    counters = fields[4:6] if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit() else ['0', '1']
+    try:
+        board = chess.Board(' '.join(fields[:4] + counters))
+    except ValueError:
+        return None
+    return board, RESULTS[match.group(1)]
+
+
+def position_features(board, piece_values):
+    """
+    Coefficients of the tuned weights in the static evaluation of a position.
+
+    Returns (terms, base): ImprovedChessEngine.evaluate_static is ``base``,
+    the untuned material balance, plus the sum of coefficient times weight
+    over ``terms``, a dict of parameter index to coefficient (up to the
+    rounding of the phase taper). Mirrors the evaluate_* methods term by term.
+    """
+    terms = collections.defaultdict(float)
+    scalars = dict.fromkeys(SCALAR_WEIGHTS, 0.0)
+    piece_map = board.piece_map()
+    phase = min(sum(PHASE_WEIGHTS[piece.piece_type] for piece in piece_map.values()), MAX_PHASE)
+    base = 0
+
+    # Material and piece-square tables; only the king's tables are tapered
+    for square, piece in piece_map.items():
+        sign = 1 if piece.color == chess.WHITE else -1
+        base += sign * piece_values[piece.piece_type]
+        index = chess.square_mirror(square) if piece.color == chess.WHITE else square
+        rank, file = chess.square_rank(square), chess.square_file(square)
+        if piece.piece_type == chess.KING:
+            terms[TABLE_OFFSETS['king_position_values_middlegame'] + index] += sign * phase / MAX_PHASE
+            terms[TABLE_OFFSETS['king_position_values_endgame'] + index] += sign * (MAX_PHASE - phase) / MAX_PHASE
+            continue
+        terms[TABLE_OFFSETS[PIECE_TABLES[piece.piece_type]] + index] += sign
+        if piece.piece_type == chess.PAWN:
+            scalars['pawn_advance_bonus'] += sign * (rank if piece.color == chess.WHITE else 7 - rank)
+        elif piece.piece_type == chess.KNIGHT:
+            scalars['knight_center_penalty'] -= sign * (abs(3.5 - file) + abs(3.5 - rank))
+
+    # evaluate_pawn_structure
+    doubled, isolated, backward, passed, open_files = pawn_structure(board)
+    scalars['doubled_pawn_penalty'] -= doubled
+    scalars['isolated_pawn_penalty'] -= isolated
+    scalars['backward_pawn_penalty'] -= backward
+    scalars['passed_pawn_bonus'] += passed
+
+    attacks = AttackMap(board)
+    attackers_by_value = sorted(chess.PIECE_TYPES, key=lambda piece_type: piece_values[piece_type])
+    for color in chess.COLORS:
+        sign = 1 if color == chess.WHITE else -1
+        pawns = board.pawns & board.occupied_co[color]
+
+        # evaluate_material
+        for square, piece_type, piece_attacks in attacks.pieces[color]:
+            if piece_type == chess.BISHOP:
+                scalars['bishop_mobility_bonus'] += sign * chess.popcount(piece_attacks)
+            elif piece_type == chess.ROOK:
+                if open_files & chess.BB_SQUARES[square]:
+                    scalars['rook_open_file_bonus'] += sign
+            elif piece_type == chess.QUEEN:
+                scalars['queen_mobility_bonus'] += sign * chess.popcount(piece_attacks)
+
+        # evaluate_king_safety
+        king_square = board.king(color)
+        if king_square is not None:
+            scalars['pawn_shield_bonus'] += sign * sum(1 for mask in SHIELD_SQUARES[color][king_square]
+                                                       if pawns & mask)
+            scalars['king_zone_attack_penalty'] -= sign * attacks.count(not color, KING_ZONE_MASKS[king_square])
+
+        # evaluate_threats
+        enemy_attacks = attacks.by_type[not color]
+        for square in chess.scan_reversed(board.occupied_co[color] & attacks.all[not color]):
+            piece_value = piece_values[board.piece_type_at(square)]
+            square_mask = chess.BB_SQUARES[square]
+            min_attacker_value = next(piece_values[piece_type] for piece_type in attackers_by_value
+                                      if enemy_attacks[piece_type] & square_mask)
+            if not attacks.all[color] & square_mask:
+                scalars['hanging_piece_percent'] -= sign * piece_value / 100
+            elif min_attacker_value < piece_value:
+                scalars['weak_piece_percent'] -= sign * (piece_value - min_attacker_value) / 100
+
+    # Mobility of the side to move
+    sign = 1 if board.turn == chess.WHITE else -1
+    scalars['mobility_bonus'] += sign * board.legal_moves.count() * len(piece_map) / 32.0
+
+    for name, coefficient in scalars.items():
+        if coefficient:
+            terms[SCALAR_INDEX[name]] = coefficient
+    return terms, base
+
+
+_piece_values = None
+
+
+def _init_worker(piece_values):
+    global _piece_values
+    _piece_values = piece_values
+
+
+def _extract_chunk(lines):
+    """Feature rows of the usable positions among ``lines``, and the number of lines skipped."""
+    rows = []
+    skipped = 0
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            skipped += 1
+            continue
+        board, result = parsed
+        if board.is_check() or not any(board.generate_legal_moves()):
+            skipped += 1
+            continue
+        terms, base = position_features(board, _piece_values)
+        rows.append((terms, base, result))
+
+    indices = np.full((len(rows), ROW_WIDTH), PADDING_INDEX, dtype=np.int16)
+    coefficients = np.zeros((len(rows), ROW_WIDTH), dtype=np.float32)
+    for i, (terms, _, _) in enumerate(rows):
+        indices[i, :len(terms)] = list(terms.keys())
+        coefficients[i, :len(terms)] = list(terms.values())
+    base = np.array([row[1] for row in rows], dtype=np.float32)
+    results = np.array([row[2] for row in rows], dtype=np.float32)
+    return indices, coefficients, base, results, skipped
+
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def extract_features(paths, piece_values, workers=None, chunk_lines=CHUNK_LINES):
+    """
+    Read labeled positions from ``paths`` and build their feature matrix.
+
+    Returns a dict of arrays: ``indices`` and ``coefficients`` (one row of
+    ROW_WIDTH parameter indices and their coefficients per position,
+    padded with PADDING_INDEX), ``base`` (the untuned part of each
+    evaluation) and ``results``. Lines are read as they are needed, with
+    a bounded number of chunks in flight.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    context = multiprocessing.get_context('spawn')
+    parts = []
+    skipped = 0
+    started = time.monotonic()
+    with context.Pool(workers, initializer=_init_worker, initargs=(piece_values,)) as pool:
+        pending = collections.deque()
+
+        def collect():
+            nonlocal skipped
+            *arrays, chunk_skipped = pending.popleft().get()
+            parts.append(arrays)
+            skipped += chunk_skipped
+            if len(parts) % 100 == 0:
+                positions = sum(len(part[3]) for part in parts)
+                logger.info(f"{positions} positions extracted ({positions / (time.monotonic() - started):.0f}/s)")
+
+        for chunk in _chunks(iter_lines(paths), chunk_lines):
+            pending.append(pool.apply_async(_extract_chunk, (chunk,)))
+            if len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                collect()
+        while pending:
+            collect()
+
+    if not parts:
+        raise ValueError("No labeled positions found")
+    indices, coefficients, base, results = (np.concatenate(arrays) for arrays in zip(*parts))
+    logger.info(f"{len(results)} positions extracted in {time.monotonic() - started:.1f}s, {skipped} lines skipped")
+    return {'indices': indices, 'coefficients': coefficients, 'base': base, 'results': results}
+
+
+def save_features(path, features):
+    np.savez(path, layout=np.array(TABLE_WEIGHTS + SCALAR_WEIGHTS), **features)
+
+
+def load_features(path):
+    with np.load(path) as data:
+        if tuple(data['layout']) != TABLE_WEIGHTS + SCALAR_WEIGHTS:
+            raise ValueError(f"{path} was extracted for other evaluation weights; extract it again")
+        return {name: data[name] for name in ('indices', 'coefficients', 'base', 'results')}
+
+
+def weights_to_vector(weights):
+    """Parameter vector, with the padding entry, of a full set of weights."""
+    vector = np.zeros(NUM_WEIGHTS + 1)
+    for name in TABLE_WEIGHTS:
+        vector[TABLE_OFFSETS[name]:TABLE_OFFSETS[name] + 64] = weights[name]
+    for name in SCALAR_WEIGHTS:
+        vector[SCALAR_INDEX[name]] = weights[name]
+    return vector
+
+
+def vector_to_weights(vector):
+    """Weights rounded to whole numbers, in the layout of a weights file."""
+    weights = {name: [int(round(v)) for v in vector[TABLE_OFFSETS[name]:TABLE_OFFSETS[name] + 64]]
+               for name in TABLE_WEIGHTS}
+    weights.update((name, int(round(vector[SCALAR_INDEX[name]]))) for name in SCALAR_WEIGHTS)
+    return weights
+
+
+def evaluate(vector, indices, coefficients, base):
+    """Static evaluations of feature rows under the weights in ``vector``."""
+    return base + (vector[indices] * coefficients).sum(axis=1)
+
+
+def win_probability(scores, scale):
+    """Expected result for white from evaluations in centipawns."""
+    return 1.0 / (1.0 + np.power(10.0, -scale * scores / 400.0))
+
+
+def mean_squared_error(scores, results, scale):
+    return float(np.mean((results - win_probability(scores, scale)) ** 2))
+
+
+def fit_scale(scores, results, tolerance=1e-4):
+    """The sigmoid scale that best maps evaluations to results, by golden-section search."""
+    ratio = (math.sqrt(5) - 1) / 2
+    low, high = SCALE_RANGE
+    while high - low > tolerance:
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if mean_squared_error(scores, results, a) < mean_squared_error(scores, results, b):
+            high = b
+        else:
+            low = a
+    return (low + high) / 2
+
+
+def tune(features, vector, scale=None, epochs=100, batch_size=16384, learning_rate=1.0, seed=0):
+    """
+    Fit the weights to the game results; returns (tuned vector, scale, loss before, loss after).
+
+    The sigmoid scale is fitted to the starting weights first, unless
+    given, and then held fixed so the weights keep their centipawn scale.
+    """
+    indices, coefficients = features['indices'], features['coefficients']
+    base, results = features['base'].astype(np.float64), features['results'].astype(np.float64)
+    vector = np.array(vector, dtype=np.float64)
+    if scale is None:
+        scale = fit_scale(evaluate(vector, indices, coefficients, base), results)
+    initial_loss = mean_squared_error(evaluate(vector, indices, coefficients, base), results, scale)
+    logger.info(f"{len(results)} positions, scale {scale:.4f}, loss {initial_loss:.6f}")
+
+    # d(win probability)/d(score) is p * (1 - p) times this
+    slope = scale * math.log(10) / 400.0
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    moment = np.zeros_like(vector)
+    velocity = np.zeros_like(vector)
+    rng = np.random.default_rng(seed)
+    step = 0
+    loss = initial_loss
+    for epoch in range(1, epochs + 1):
+        started = time.monotonic()
+        order = rng.permutation(len(results))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            batch_indices, batch_coefficients = indices[batch], coefficients[batch]
+            probability = win_probability(evaluate(vector, batch_indices, batch_coefficients, base[batch]), scale)
+            error = 2.0 * (probability - results[batch]) * probability * (1.0 - probability) * slope / len(batch)
+            gradient = np.bincount(batch_indices.ravel(), weights=(batch_coefficients * error[:, None]).ravel(),
+                                   minlength=NUM_WEIGHTS + 1)
+            gradient[PADDING_INDEX] = 0.0
+
+            step += 1
+            moment = beta1 * moment + (1 - beta1) * gradient
+            velocity = beta2 * velocity + (1 - beta2) * gradient ** 2
+            vector -= (learning_rate * (moment / (1 - beta1 ** step))
+                       / (np.sqrt(velocity / (1 - beta2 ** step)) + epsilon))
+        loss = mean_squared_error(evaluate(vector, indices, coefficients, base), results, scale)
+        logger.info(f"Epoch {epoch}: loss {loss:.6f} ({time.monotonic() - started:.1f}s)")
+    return vector, scale, initial_loss, loss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the evaluation weights on labeled positions.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extract_parser = commands.add_parser('extract', help="build the feature matrix of labeled positions")
+    extract_parser.add_argument('positions', nargs='+', help="files of FENs with game results (.gz allowed)")
+    extract_parser.add_argument('-o', '--output', required=True, help="feature file to write (.npz)")
+    extract_parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+
+    tune_parser = commands.add_parser('tune', help="fit the weights to a feature file")
+    tune_parser.add_argument('features', help="feature file written by extract")
+    tune_parser.add_argument('-o', '--output', required=True, help="weights file to write")
+    tune_parser.add_argument('--start', help="weights file to start from (default: the built-in weights)")
+    tune_parser.add_argument('--epochs', type=int, default=100)
+    tune_parser.add_argument('--batch-size', type=int, default=16384)
+    tune_parser.add_argument('--learning-rate', type=float, default=1.0, help="Adam step size in centipawns")
+    tune_parser.add_argument('--scale', type=float, help="sigmoid scale (default: fitted to the start weights)")
+    tune_parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engine = ImprovedChessEngine(hash_size_mb=0, weights_path=args.start if args.command == 'tune' else None)
+    if args.command == 'extract':
+        save_features(args.output, extract_features(args.positions, engine.piece_values, args.workers))
+        return 0
+
+    features = load_features(args.features)
+    vector, scale, initial_loss, loss = tune(features, weights_to_vector(engine_weights(engine)), args.scale,
+                                             args.epochs, args.batch_size, args.learning_rate, args.seed)
+    write_weights(args.output, vector_to_weights(vector))
+    logger.info(f"Loss {initial_loss:.6f} -> {loss:.6f} at scale {scale:.4f}; weights written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
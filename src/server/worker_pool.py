@@ -0,0 +1,255 @@
+import atexit
+import collections
+import logging
+import multiprocessing
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cancelled request gets to stop before its worker is restarted
+CANCEL_GRACE = 2.0
+
+
+class WorkerCrashed(Exception):
+    """Raised when an engine worker dies while handling a request."""
+
+
+def _worker_main(conn, stop_event, engine_factory, handler):
+    """Serve requests on one persistent engine until the pipe is closed."""
+    engine = engine_factory()
+    # Setting the event asks the running search to stop early
+    engine.stop_event = stop_event
+
+    def progress(info):
+        conn.send(('progress', info))
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        try:
+            conn.send(('ok', handler(engine, progress, *task)))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+    # Let the engine release helper processes or shared memory it holds
+    if hasattr(engine, 'close'):
+        engine.close()
+
+
+class EngineWorker:
+    """A worker process holding one long-lived engine."""
+
+    def __init__(self, context, engine_factory, handler, index):
+        self.context = context
+        self.engine_factory = engine_factory
+        self.handler = handler
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.stop_event = context.Event()
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.stop_event, self.engine_factory, self.handler),
+            name=f"engine-worker-{self.index}",
+            # Not a daemon, so the engine can start its own Lazy SMP helpers
+            daemon=False,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+    def restart(self):
+        """Kill the current process (if any) and start a fresh one."""
+        logger.warning(f"Restarting engine worker {self.index}")
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+        self.stop_event.clear()
+        self.start()
+
+    def cancel(self, grace):
+        """Ask the running request to stop and wait for its result, restarting the worker if it never comes."""
+        self.stop_event.set()
+        deadline = time.monotonic() + grace
+        try:
+            while self.conn.poll(max(0.0, deadline - time.monotonic())):
+                status, _ = self.conn.recv()
+                if status != 'progress':
+                    self.stop_event.clear()
+                    return
+        except (EOFError, OSError):
+            pass
+        self.restart()
+
+
+class EnginePool:
+    """
+    Pool of pre-started worker processes, each holding a persistent engine.
+
+    ``engine_factory()`` builds the engine inside the worker and
+    ``handler(engine, progress, *args)`` runs one request on it, calling
+    ``progress(info)`` for intermediate results. The engine's ``stop_event``
+    is set when a request is cancelled. Both must be picklable
+    module-level callables. Engines keep their caches between requests, and
+    requests run on separate cores instead of the web server's threads.
+    Requests with the same ``affinity`` go to the worker that ran the last
+    one whenever it is idle, so state its engine keeps for them is reused.
+    """
+
+    def __init__(self, engine_factory, handler, num_workers=None, timeout=30.0):
+        # Spawned workers do not inherit the web server's threads or locks
+        context = multiprocessing.get_context('spawn')
+        self.timeout = timeout
+        self.workers = [EngineWorker(context, engine_factory, handler, i)
+                        for i in range(num_workers or multiprocessing.cpu_count())]
+        for worker in self.workers:
+            worker.start()
+        atexit.register(self.close)
+
+        # Idle workers, longest idle first, and the worker each affinity last ran on
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = collections.deque(self.workers)
+        self._affinity = {}
+
+        # Load counters, see stats()
+        self._waiting = 0
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._busy_since = {}
+
+    def run(self, *args, timeout=None):
+        """
+        Run one request on the next idle worker and return the handler's result.
+
+        Raises TimeoutError if no worker is free or the request does not finish
+        in time, and WorkerCrashed if the worker process died.
+        """
+        for kind, value in self.stream(*args, timeout=timeout):
+            if kind == 'result':
+                return value
+
+    def stream(self, *args, timeout=None, heartbeat=None, queue_timeout=None, affinity=None):
+        """
+        Run one request and yield its messages as (kind, value) pairs.
+
+        Yields ('progress', info) for every report the handler sends through
+        its ``progress`` callback and ends with ('result', value). With
+        ``heartbeat`` in seconds, ('heartbeat', None) is yielded whenever the
+        worker has been quiet that long. Closing the generator early stops
+        the request and returns the worker to the pool. ``queue_timeout``
+        limits the wait for an idle worker separately (0: only take one
+        that is idle now). With ``affinity``, the worker that last ran a
+        request with the same affinity is preferred.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(timeout if queue_timeout is None else queue_timeout, affinity)
+
+        finished = False
+        try:
+            if not worker.process.is_alive():
+                worker.restart()
+            worker.conn.send(args)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Analysis did not finish within {timeout:.1f}s")
+                wait = remaining if heartbeat is None else min(remaining, heartbeat)
+                if not worker.conn.poll(wait):
+                    if heartbeat is not None and wait < remaining:
+                        yield 'heartbeat', None
+                    continue
+                status, value = worker.conn.recv()
+                if status == 'progress':
+                    yield 'progress', value
+                    continue
+                finished = True
+                if status == 'error':
+                    raise RuntimeError(value)
+                yield 'result', value
+                return
+        except (EOFError, BrokenPipeError, ConnectionResetError) as e:
+            finished = True
+            worker.restart()
+            raise WorkerCrashed(f"Engine worker {worker.index} crashed") from e
+        finally:
+            if not finished:
+                # Timed out or the consumer went away: stop the search
+                worker.cancel(CANCEL_GRACE)
+            with self._lock:
+                self._busy -= 1
+                self._busy_seconds += time.monotonic() - self._busy_since.pop(worker.index)
+                self._idle.append(worker)
+                self._available.notify()
+
+    def _acquire(self, wait, affinity):
+        """Take an idle worker, waiting at most ``wait`` seconds for one."""
+        deadline = time.monotonic() + wait
+        with self._available:
+            self._waiting += 1
+            try:
+                while not self._idle:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No engine worker became available in time")
+                    self._available.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            worker = self._idle[0]
+            if affinity is not None:
+                preferred = self._affinity.get(affinity)
+                worker = next((idle for idle in self._idle if idle.index == preferred), worker)
+                self._affinity[affinity] = worker.index
+            self._idle.remove(worker)
+            self._busy += 1
+            self._busy_since[worker.index] = time.monotonic()
+        return worker
+
+    def forget(self, affinity):
+        """Drop the worker remembered for an affinity that will not be used again."""
+        with self._lock:
+            self._affinity.pop(affinity, None)
+
+    def stats(self):
+        """
+        Load counters: the number of workers, how many are busy, requests
+        waiting for a worker, and total seconds workers have spent busy
+        (including the running requests so far).
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'workers': len(self.workers),
+                'busy': self._busy,
+                'waiting': self._waiting,
+                'busy_seconds': self._busy_seconds + sum(now - since for since in self._busy_since.values()),
+            }
+
+    def close(self):
+        """Stop all workers."""
+        for worker in self.workers:
+            worker.stop()